@@ -0,0 +1,54 @@
+"""Compare the line-based and the bulk mprofile loaders.
+
+Writes a synthetic profile with a few million MEM records (and some CHLD
+and FUNC records), then times mprof's loaders on it::
+
+    python examples/bench_read_mprofile.py [n_samples]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+import memory_profiler as mp
+import mprof
+
+
+def write_profile(filename, n_samples):
+    with open(filename, "w") as f:
+        writer = mp.TextProfileWriter(f)
+        writer.write_header("python script.py")
+        for i in range(n_samples):
+            t = 1700000000. + i * 0.01
+            writer.write_mem(100. + (i % 1000) * 0.001, t)
+            if i % 10 == 0:
+                writer.write_child(1234, 50. + (i % 100) * 0.01, t)
+            if i % 1000 == 0:
+                writer.write_func("__main__.f", 100., t, 101., t + 5., 0)
+        writer.flush()
+
+
+def best_of(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+if __name__ == "__main__":
+    n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    fd, filename = tempfile.mkstemp(suffix=".dat")
+    os.close(fd)
+    try:
+        write_profile(filename, n_samples)
+        print("%d samples, %.1f MiB" % (
+            n_samples, os.path.getsize(filename) / 1024. ** 2))
+        timings = [
+            ("line by line", lambda: mprof._read_mprofile_text_file(filename)),
+            ("read_mprofile_arrays", lambda: mprof.read_mprofile_arrays(filename)),
+            ("read_mprofile_file", lambda: mprof.read_mprofile_file(filename)),
+        ]
+        baseline = None
+        for name, func in timings:
+            elapsed = best_of(func)
+            baseline = baseline or elapsed
+            print("%-22s %7.3f s  (x%.1f)" % (name, elapsed, baseline / elapsed))
+    finally:
+        os.remove(filename)
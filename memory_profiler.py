@@ -7,22 +7,32 @@ __version__ = '0.61.0'
 
 _CMD_USAGE = "python -m memory_profiler script_file.py"
 
+from abc import ABC, abstractmethod
+from array import array
 from asyncio import iscoroutinefunction
+from collections.abc import Coroutine
 from contextlib import contextmanager
 from functools import partial, wraps
 from types import coroutine
+import asyncio
 import builtins
+import dis
 import inspect
 import linecache
 import logging
 import os
 import io
+import itertools
 import pdb
+import re
+import struct
 import subprocess
 import sys
+import threading
 import time
 import traceback
 import warnings
+import weakref
 
 if sys.platform == "win32":
     # any value except signal.CTRL_C_EVENT and signal.CTRL_BREAK_EVENT
@@ -58,6 +68,14 @@ try:
 except ImportError:
     has_tracemalloc = False
 
+# .. sys.monitoring (PEP 669) is available starting with Python 3.12 ..
+has_monitoring = hasattr(sys, 'monitoring')
+
+# .. reading /proc/<pid>/statm directly requires Linux and os.preadv ..
+has_procfs = hasattr(os, 'preadv') and os.path.exists('/proc/self/statm')
+if has_procfs:
+    _PAGESIZE = os.sysconf('SC_PAGE_SIZE')
+
 
 class MemitResult(object):
     """memit magic run details.
@@ -114,111 +132,592 @@ def _get_child_memory(process, meminfo_attr=None, memory_metric=0):
         yield (0, 0.0)
 
 
-def _get_memory(pid, backend, timestamps=False, include_children=False, filename=None):
-    # .. low function to get memory consumption ..
-    if pid == -1:
-        pid = os.getpid()
+class _StatmReader(object):
+    """Read the resident set size of a process from /proc/<pid>/statm.
+
+    The file descriptor is kept open and re-read with ``os.preadv`` into a
+    preallocated buffer, so sampling does not build a ``psutil.Process``.
+    It is closed when the process is gone, when a child leaves the child
+    tree of its sampler, or else when the reader is garbage collected,
+    e.g. with a sampler dropped from ``_sampler_cache``.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.fd = None
+        try:
+            self.fd = os.open('/proc/{0}/statm'.format(pid), os.O_RDONLY)
+        except OSError:
+            raise psutil.NoSuchProcess(pid)
+        self.buf = bytearray(256)
+        self.lock = threading.Lock()
+
+    def rss(self):
+        """Return the resident set size, in MiB."""
+        try:
+            with self.lock:
+                n = os.preadv(self.fd, [self.buf], 0)
+                resident = self.buf[:n].split(None, 2)[1]
+        except (OSError, IndexError, TypeError):
+            # the process is gone (ESRCH) or has been reaped
+            self.close()
+            raise psutil.NoSuchProcess(self.pid)
+        return int(resident) * _PAGESIZE / _TWO_20
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
+
+
+# .. the descendants of a sampled process are listed again at most once
+# .. per period, since listing them scans all of /proc: every
+# .. _CHILD_TREE_SAMPLES samples in a sampling loop, see _Sampler.set_interval,
+# .. and every _CHILD_TREE_REFRESH seconds otherwise ..
+_CHILD_TREE_REFRESH = 1.
+_CHILD_TREE_SAMPLES = 10
+
+
+class _ChildTree(object):
+    """The descendants of the process of ``sampler``, listed again every
+    ``sampler.children_refresh`` seconds only.
+
+    A handle is opened with the sampler for each child when it is found
+    and kept until the child exits, so that each sample only reads the
+    memory of the known children.
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.process = psutil.Process(sampler.pid)
+        self.handles = {}
+        self.listed_at = None
+
+    def update(self):
+        try:
+            children = self.process.children(recursive=True)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            children = []
+        handles = {}
+        for child in children:
+            handle = self.handles.pop(child.pid, None)
+            if handle is None:
+                try:
+                    handle = self.sampler.open_child(child)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            handles[child.pid] = handle
+        for handle in self.handles.values():
+            self.sampler.close_child(handle)
+        self.handles = handles
+        self.listed_at = time.monotonic()
+
+    def memory(self):
+        """Return the (pid, mem) of each child process, mem in MiB."""
+        if self.listed_at is None or time.monotonic() - self.listed_at >= \
+                self.sampler.children_refresh:
+            self.update()
+        result = []
+        for pid, handle in list(self.handles.items()):
+            try:
+                result.append((pid, self.sampler.child_memory(handle)))
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                del self.handles[pid]
+                self.sampler.close_child(handle)
+        return result
+
+
+class _Sampler(ABC):
+    """Memory sampler bound to a process, a backend and include_children.
+
+    Everything that does not depend on the sample itself (the process
+    handle, attribute lookups, open files) is resolved once when the sampler
+    is built, see ``_get_sampler``. Calling the sampler returns the memory
+    usage in MiB, or a ``(mem, timestamp)`` tuple if ``timestamps`` is True.
+
+    The memory of child processes is read through a ``_ChildTree``. With
+    include_children, the per-child memory summed by the last sample is
+    kept in ``last_children``.
+    """
+
+    def __init__(self, pid, include_children=False):
+        self.pid = pid
+        self.include_children = include_children
+        self.last_children = []
+        self.children_refresh = _CHILD_TREE_REFRESH
+        self._child_tree = None
+
+    def set_interval(self, interval):
+        """Set the interval of the sampling loop using this sampler, so that
+        the children are listed again every ``_CHILD_TREE_SAMPLES`` samples.
+        """
+        self.children_refresh = _CHILD_TREE_SAMPLES * interval
+
+    def children(self):
+        """Return the (pid, mem) of each child process, mem in MiB."""
+        if self._child_tree is None:
+            self._child_tree = _ChildTree(self)
+        return self._child_tree.memory()
+
+    def children_total(self):
+        """Sum the memory of the child processes, keeping the breakdown."""
+        self.last_children = self.children()
+        return sum([mem for (pid, mem) in self.last_children])
 
-    def tracemalloc_tool():
-        # .. cross-platform but but requires Python 3.4 or higher ..
-        stat = next(filter(lambda item: str(item).startswith(filename),
-                           tracemalloc.take_snapshot().statistics('filename')))
-        mem = stat.size / _TWO_20
-        if timestamps:
+    def open_child(self, process):
+        return process
+
+    def child_memory(self, process):
+        return process.memory_info()[0] / _TWO_20
+
+    def close_child(self, handle):
+        pass
+
+    def __call__(self, timestamps=False, filename=None):
+        try:
+            mem = self.sample(filename)
+        except psutil.NoSuchProcess:
+            _sampler_cache.pop(self.key, None)
+            raise
+        if timestamps and mem is not None:
             return mem, time.time()
-        else:
-            return mem
+        return mem
+
+    @abstractmethod
+    def sample(self, filename=None):
+        """Return the memory usage in MiB."""
 
-    def ps_util_tool():
-        # .. cross-platform but but requires psutil ..
-        process = psutil.Process(pid)
+    @property
+    def key(self):
+        return self.pid, self.backend, self.include_children
+
+
+class _PsutilSampler(_Sampler):
+    # .. cross-platform but but requires psutil ..
+    backend = 'psutil'
+
+    def __init__(self, pid, include_children=False):
+        super(_PsutilSampler, self).__init__(pid, include_children)
+        self.process = psutil.Process(pid)
+        # avoid using get_memory_info since it does not exists
+        # in psutil > 2.0 and accessing it will cause exception.
+        self.meminfo_attr = 'memory_info' if hasattr(self.process, 'memory_info') \
+            else 'get_memory_info'
+        self.meminfo = getattr(self.process, self.meminfo_attr)
+
+    def sample(self, filename=None):
         try:
-            # avoid using get_memory_info since it does not exists
-            # in psutil > 2.0 and accessing it will cause exception.
-            meminfo_attr = 'memory_info' if hasattr(process, 'memory_info') \
-                else 'get_memory_info'
-            mem = getattr(process, meminfo_attr)()[0] / _TWO_20
-            if include_children:
-                mem +=  sum([mem for (pid, mem) in _get_child_memory(process, meminfo_attr)])
-            if timestamps:
-                return mem, time.time()
-            else:
-                return mem
+            mem = self.meminfo()[0] / _TWO_20
+            if self.include_children:
+                mem += self.children_total()
+            return mem
         except psutil.AccessDenied:
             pass
             # continue and try to get this from ps
 
-    def _ps_util_full_tool(memory_metric):
+    def child_memory(self, process):
+        return getattr(process, self.meminfo_attr)()[0] / _TWO_20
 
-        # .. cross-platform but requires psutil > 4.0.0 ..
-        process = psutil.Process(pid)
-        try:
-            if not hasattr(process, 'memory_full_info'):
-                raise NotImplementedError("Backend `{}` requires psutil > 4.0.0".format(memory_metric))
 
-            meminfo_attr = 'memory_full_info'
-            meminfo = getattr(process, meminfo_attr)()
+class _PsutilFullSampler(_Sampler):
+    # .. cross-platform but requires psutil > 4.0.0 ..
+    memory_metric = None
+
+    def __init__(self, pid, include_children=False):
+        super(_PsutilFullSampler, self).__init__(pid, include_children)
+        self.process = psutil.Process(pid)
+        if not hasattr(self.process, 'memory_full_info'):
+            raise NotImplementedError(
+                "Backend `{}` requires psutil > 4.0.0".format(self.memory_metric))
+        self.meminfo = self.process.memory_full_info
+
+    def sample(self, filename=None):
+        try:
+            meminfo = self.meminfo()
 
-            if not hasattr(meminfo, memory_metric):
+            if not hasattr(meminfo, self.memory_metric):
                 raise NotImplementedError(
-                    "Metric `{}` not available. For details, see:".format(memory_metric) +
+                    "Metric `{}` not available. For details, see:".format(self.memory_metric) +
                     "https://psutil.readthedocs.io/en/latest/index.html?highlight=memory_info#psutil.Process.memory_full_info")
-            mem = getattr(meminfo, memory_metric) / _TWO_20
+            mem = getattr(meminfo, self.memory_metric) / _TWO_20
 
-            if include_children:
-                mem +=  sum([mem for (pid, mem) in _get_child_memory(process, meminfo_attr, memory_metric)])
+            if self.include_children:
+                mem += self.children_total()
+            return mem
 
-            if timestamps:
-                return mem, time.time()
-            else:
-                return mem
-        
         except psutil.AccessDenied:
             pass
             # continue and try to get this from ps
 
-    def posix_tool():
-        # .. scary stuff ..
+    def child_memory(self, process):
+        return getattr(process.memory_full_info(), self.memory_metric) / _TWO_20
+
+
+class _PsutilPssSampler(_PsutilFullSampler):
+    backend = 'psutil_pss'
+    memory_metric = 'pss'
+
+
+class _PsutilUssSampler(_PsutilFullSampler):
+    backend = 'psutil_uss'
+    memory_metric = 'uss'
+
+
+def _traced_file_memory(filename, snapshot=None):
+    """Memory allocated from ``filename`` and still traced by tracemalloc, in MiB.
+
+    This requires a full snapshot, whose cost grows with the number of live
+    allocations.
+    """
+    if snapshot is None:
+        snapshot = tracemalloc.take_snapshot()
+    for stat in snapshot.statistics('filename'):
+        if stat.traceback[0].filename.startswith(filename):
+            return stat.size / _TWO_20
+    return 0.0
+
+
+class _TracemallocSampler(_Sampler):
+    # .. cross-platform but but requires Python 3.4 or higher ..
+    backend = 'tracemalloc'
+
+    def sample(self, filename=None):
+        if filename is None or filename == '<unknown>':
+            raise RuntimeError(
+                'There is no access to source file of the profiled function'
+            )
+        return _traced_file_memory(filename)
+
+
+class _TracemallocTotalSampler(_Sampler):
+    # .. total memory traced by tracemalloc, no snapshot involved ..
+    backend = 'tracemalloc_total'
+
+    def __init__(self, pid, include_children=False):
+        if pid != os.getpid():
+            raise ValueError(
+                'The tracemalloc_total backend only measures the current '
+                'process, not pid {0}'.format(pid))
+        super(_TracemallocTotalSampler, self).__init__(pid, include_children)
+
+    def sample(self, filename=None):
+        return tracemalloc.get_traced_memory()[0] / _TWO_20
+
+
+class _ProcfsSampler(_Sampler):
+    # .. Linux only, reads /proc/<pid>/statm through a cached descriptor ..
+    backend = 'procfs'
+
+    def __init__(self, pid, include_children=False):
+        super(_ProcfsSampler, self).__init__(pid, include_children)
+        self.reader = _StatmReader(pid)
+
+    def sample(self, filename=None):
+        mem = self.reader.rss()
+        if self.include_children:
+            mem += self.children_total()
+        return mem
+
+    def open_child(self, process):
+        return _StatmReader(process.pid)
+
+    def child_memory(self, reader):
+        return reader.rss()
+
+    def close_child(self, reader):
+        reader.close()
+
+
+class _PosixSampler(_Sampler):
+    # .. scary stuff ..
+    backend = 'posix'
+
+    def __init__(self, pid, include_children=False):
         if include_children:
             raise NotImplementedError((
                 "The psutil module is required to monitor the "
                 "memory usage of child processes."
             ))
+        super(_PosixSampler, self).__init__(pid, include_children)
 
+    def sample(self, filename=None):
         warnings.warn("psutil module not found. memory_profiler will be slow")
         # ..
         # .. memory usage in MiB ..
         # .. this should work on both Mac and Linux ..
         # .. subprocess.check_output appeared in 2.7, using Popen ..
         # .. for backwards compatibility ..
-        out = subprocess.Popen(['ps', 'v', '-p', str(pid)],
+        out = subprocess.Popen(['ps', 'v', '-p', str(self.pid)],
                                stdout=subprocess.PIPE
                                ).communicate()[0].split(b'\n')
         try:
             vsz_index = out[0].split().index(b'RSS')
-            mem = float(out[1].split()[vsz_index]) / 1024
-            if timestamps:
-                return mem, time.time()
-            else:
-                return mem
+            return float(out[1].split()[vsz_index]) / 1024
         except:
-            if timestamps:
-                return -1, time.time()
-            else:
-                return -1
+            return -1
 
-    if backend == 'tracemalloc' and \
-            (filename is None or filename == '<unknown>'):
-        raise RuntimeError(
-            'There is no access to source file of the profiled function'
-        )
 
-    tools = {'tracemalloc': tracemalloc_tool,
-             'psutil': ps_util_tool,
-             'psutil_pss': lambda: _ps_util_full_tool(memory_metric="pss"),
-             'psutil_uss': lambda: _ps_util_full_tool(memory_metric="uss"),
-             'posix': posix_tool}
-    return tools[backend]()
+_SAMPLERS = {
+    'psutil': _PsutilSampler,
+    'psutil_pss': _PsutilPssSampler,
+    'psutil_uss': _PsutilUssSampler,
+    'posix': _PosixSampler,
+    'tracemalloc': _TracemallocSampler,
+    'tracemalloc_total': _TracemallocTotalSampler,
+    'procfs': _ProcfsSampler,
+}
+
+# .. backends that require tracemalloc to be tracing ..
+_TRACEMALLOC_BACKENDS = ('tracemalloc', 'tracemalloc_total')
+
+# .. samplers are cached per (pid, backend, include_children) ..
+_sampler_cache = {}
+_SAMPLER_CACHE_SIZE = 128
+
+
+class _SelfSampler(object):
+    """Sampler of the current process.
+
+    The sampler of the current pid is looked up again whenever the pid
+    changes, so that a sampler kept across ``os.fork`` measures the child
+    in the child process and not its parent.
+    """
+
+    def __init__(self, backend, include_children=False):
+        self.backend = backend
+        self.include_children = include_children
+        self.current_pid = None
+        self.sampler = None
+
+    def _current(self):
+        pid = os.getpid()
+        if pid != self.current_pid:
+            self.sampler = _get_sampler(pid, self.backend,
+                                        self.include_children)
+            self.current_pid = pid
+        return self.sampler
+
+    def __call__(self, timestamps=False, filename=None):
+        return self._current()(timestamps=timestamps, filename=filename)
+
+    def __getattr__(self, name):
+        return getattr(self._current(), name)
+
+
+def _get_sampler(pid, backend, include_children=False):
+    """Return the cached sampler for this process and backend.
+
+    pid -1 stands for the current process, see ``_SelfSampler``.
+    """
+    key = (pid, backend, include_children)
+    sampler = _sampler_cache.get(key)
+    if sampler is None:
+        if pid == -1:
+            sampler = _SelfSampler(backend, include_children)
+        else:
+            sampler = _SAMPLERS[backend](pid, include_children=include_children)
+        if len(_sampler_cache) >= _SAMPLER_CACHE_SIZE:
+            # drop the oldest entry, e.g. a pid that has exited long ago
+            _sampler_cache.pop(next(iter(_sampler_cache)))
+        _sampler_cache[key] = sampler
+    return sampler
+
+
+def _sampled_children(sampler):
+    """The (pid, mem) of the children of the sampled process, from the
+    last sample if it included them."""
+    if sampler.include_children:
+        return sampler.last_children
+    return sampler.children()
+
+
+def _get_memory(pid, backend, timestamps=False, include_children=False, filename=None):
+    # .. low function to get memory consumption ..
+    return _get_sampler(pid, backend, include_children)(
+        timestamps=timestamps, filename=filename)
+
+
+class MemoryRing(object):
+    """The last ``size`` memory samples, in a preallocated ``array('d')``.
+
+    Samples are appended like to the list returned by ``memory_usage``:
+    memory usage values, or (mem, timestamp) tuples if ``timestamps`` is
+    True. Once the ring is full, the oldest samples are overwritten, but
+    the aggregates ``peak``, ``min``, ``mean`` and ``slope`` cover every
+    appended sample. ``slope`` is the least squares fit of memory usage in
+    MiB per second, or per sample without timestamps.
+
+    Samples without a memory value (None, when the process could not be
+    read) are skipped.
+    """
+
+    def __init__(self, size, timestamps=False):
+        if size < 1:
+            raise ValueError('ring_size must be positive')
+        self.size = size
+        self.timestamps = timestamps
+        self.width = 2 if timestamps else 1
+        self.buffer = array('d', [0.]) * (size * self.width)
+        self.count = 0
+        self.peak = None
+        self.min = None
+        # .. running means and co-moments of time and memory ..
+        self._mean_t = 0.
+        self._mean_mem = 0.
+        self._var_t = 0.
+        self._cov = 0.
+
+    def append(self, sample):
+        if self.timestamps:
+            mem, t = sample
+        else:
+            mem, t = sample, float(self.count)
+        if mem is None:
+            return
+        i = (self.count % self.size) * self.width
+        self.buffer[i] = mem
+        if self.timestamps:
+            self.buffer[i + 1] = t
+        self.count += 1
+        if self.peak is None or mem > self.peak:
+            self.peak = mem
+        if self.min is None or mem < self.min:
+            self.min = mem
+        dt = t - self._mean_t
+        self._mean_t += dt / self.count
+        self._mean_mem += (mem - self._mean_mem) / self.count
+        self._var_t += dt * (t - self._mean_t)
+        self._cov += dt * (mem - self._mean_mem)
+
+    @property
+    def mean(self):
+        return self._mean_mem if self.count else None
+
+    @property
+    def slope(self):
+        return self._cov / self._var_t if self._var_t > 0 else None
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.tolist()[index]
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('MemoryRing index out of range')
+        i = (self.count - n + index) % self.size * self.width
+        if self.timestamps:
+            return self.buffer[i], self.buffer[i + 1]
+        return self.buffer[i]
+
+    def tolist(self):
+        """The samples kept, oldest first."""
+        n = len(self)
+        start = (self.count - n) % self.size * self.width
+        values = self.buffer[start:n * self.width] + self.buffer[:start]
+        if self.timestamps:
+            return list(zip(values[0::2], values[1::2]))
+        return values.tolist()
+
+
+class _Ticker(object):
+    """Fixed-rate schedule of the sampling loops.
+
+    Ticks are ``interval`` seconds apart on the monotonic clock, whatever
+    the time spent sampling and writing, so that samples stay evenly
+    spaced. ``begin`` marks the start of each sample, and ``advance`` its
+    end: it records the latency, the time spent in the sample itself, and
+    returns the number of intervals to the next tick: more than one when
+    ticks were missed because the sample took too long or the thread woke
+    up late, which are counted in ``missed``. ``delay`` is the time left
+    until the next tick.
+
+    With ``cpu_budget``, the fraction of time that may be spent sampling,
+    one tick out of ``stride`` is sampled, where ``stride`` doubles while
+    the sampling cost exceeds the budget and halves back when it is well
+    under it.
+    """
+
+    def __init__(self, interval, cpu_budget=None, clock=time.monotonic):
+        self.interval = interval
+        self.cpu_budget = cpu_budget
+        self.clock = clock
+        self.stride = 1
+        self.deadline = clock()
+        self.samples = 0
+        self.missed = 0
+        self.latency_max = 0.
+        self.latency_total = 0.
+        self._cost = None
+        self._began = None
+
+    def begin(self):
+        """Mark the start of a sample."""
+        self._began = self.clock()
+
+    def advance(self):
+        now = self.clock()
+        # .. the wake-up jitter is not a cost of sampling ..
+        latency = now - self._began if self._began is not None else 0.
+        self._began = None
+        self.samples += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if self.cpu_budget is not None:
+            self._adapt(latency)
+        n_ticks = self.stride
+        late = now - (self.deadline + n_ticks * self.interval)
+        if late >= 0:
+            missed = int(late // self.interval) + 1
+            self.missed += missed
+            n_ticks += missed
+        self.deadline += n_ticks * self.interval
+        return n_ticks
+
+    def _adapt(self, latency):
+        # .. moving average of the sampling cost ..
+        if self._cost is None:
+            self._cost = latency
+        else:
+            self._cost += .1 * (latency - self._cost)
+        period = self.stride * self.interval
+        if self._cost > self.cpu_budget * period:
+            self.stride *= 2
+        elif self.stride > 1 and self._cost < self.cpu_budget * period / 4:
+            self.stride //= 2
+
+    def delay(self):
+        return max(0., self.deadline - self.clock())
+
+    @property
+    def latency_mean(self):
+        return self.latency_total / self.samples if self.samples else 0.
+
+    def warn_missed(self):
+        """Warn if ticks were missed, since the samples are not evenly
+        spaced then."""
+        if self.missed:
+            warnings.warn(
+                'memory sampling missed {0} of {1} ticks of {2}s (mean latency '
+                '{3:.1f} ms, max {4:.1f} ms)'.format(
+                    self.missed, self.samples + self.missed, self.interval,
+                    1e3 * self.latency_mean, 1e3 * self.latency_max))
+
+
+def _sample_list(ring_size, timestamps, max_usage=False):
+    """The container of the samples returned by ``memory_usage``."""
+    if ring_size is None or max_usage:
+        return []
+    return MemoryRing(ring_size, timestamps=timestamps)
 
 
 class MemTimer(Process):
@@ -238,20 +737,27 @@ class MemTimer(Process):
 
         self.timestamps = kw.pop("timestamps", False)
         self.include_children = kw.pop("include_children", False)
+        self.cpu_budget = kw.pop("cpu_budget", None)
+        ring_size = kw.pop("ring_size", None)
 
         # get baseline memory usage
-        self.mem_usage = [
+        self.mem_usage = _sample_list(ring_size, self.timestamps, max_usage)
+        self.mem_usage.append(
             _get_memory(self.monitor_pid, self.backend, timestamps=self.timestamps,
-                        include_children=self.include_children)]
+                        include_children=self.include_children))
         super(MemTimer, self).__init__(*args, **kw)
 
     def run(self):
+        # .. resolved here since samplers are not meant to be pickled ..
+        sampler = _get_sampler(self.monitor_pid, self.backend,
+                               include_children=self.include_children)
+        sampler.set_interval(self.interval)
         self.pipe.send(0)  # we're ready
+        ticker = _Ticker(self.interval, self.cpu_budget)
         stop = False
         while True:
-            cur_mem = _get_memory(
-                self.monitor_pid, self.backend, timestamps=self.timestamps,
-                include_children=self.include_children,)
+            ticker.begin()
+            cur_mem = sampler(timestamps=self.timestamps)
             if not self.max_usage:
                 self.mem_usage.append(cur_mem)
             else:
@@ -259,16 +765,580 @@ class MemTimer(Process):
             self.n_measurements += 1
             if stop:
                 break
-            stop = self.pipe.poll(self.interval)
+            ticker.advance()
+            stop = self.pipe.poll(ticker.delay())
             # do one more iteration
 
         self.pipe.send(self.mem_usage)
         self.pipe.send(self.n_measurements)
 
 
+class MemTimerThread(threading.Thread):
+    """
+    Fetch memory consumption over a time interval from a thread of the
+    current process, which avoids starting a new process on each call
+    """
+
+    def __init__(self, monitor_pid, interval, backend, max_usage=False,
+                 timestamps=False, include_children=False, ring_size=None,
+                 cpu_budget=None):
+        super(MemTimerThread, self).__init__(name='memory_profiler MemTimer')
+        self.daemon = True
+        self.monitor_pid = monitor_pid
+        self.interval = interval
+        self.backend = backend
+        self.max_usage = max_usage
+        self.timestamps = timestamps
+        self.include_children = include_children
+        self.cpu_budget = cpu_budget
+        self.n_measurements = 1
+        self.stop_event = threading.Event()
+        self.ready = threading.Event()
+        self.sampler = _get_sampler(monitor_pid, backend,
+                                    include_children=include_children)
+        self.sampler.set_interval(interval)
+
+        # get baseline memory usage
+        self.mem_usage = _sample_list(ring_size, timestamps, max_usage)
+        self.mem_usage.append(self.sampler(timestamps=timestamps))
+
+    def run(self):
+        self.ready.set()
+        ticker = _Ticker(self.interval, self.cpu_budget)
+        stop = False
+        while True:
+            ticker.begin()
+            cur_mem = self.sampler(timestamps=self.timestamps)
+            if not self.max_usage:
+                self.mem_usage.append(cur_mem)
+            else:
+                self.mem_usage[0] = max(cur_mem, self.mem_usage[0])
+            self.n_measurements += 1
+            if stop:
+                break
+            ticker.advance()
+            stop = self.stop_event.wait(ticker.delay())
+            # do one more iteration
+
+    def start(self):
+        super(MemTimerThread, self).start()
+        self.ready.wait()  # we're ready
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class TextProfileWriter(object):
+    """Write profile records as the text lines read by ``mprof``.
+
+    Lines are buffered and appended to ``stream`` in a single write on
+    ``flush``, so that the lines appended by mprof and by the profiled
+    program to the same file do not interleave.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = []
+
+    def write_header(self, cmd_line, backend=None):
+        self.lines.append("CMDLINE {0}\n".format(cmd_line))
+
+    def write_mem(self, mem, timestamp):
+        self.lines.append("MEM {0:.6f} {1:.4f}\n".format(mem, timestamp))
+
+    def write_child(self, idx, mem, timestamp):
+        self.lines.append("CHLD {0} {1:.6f} {2:.4f}\n".format(idx, mem, timestamp))
+
+    def write_func(self, name, mem_start, start, mem_end, end, level):
+        self.lines.append("FUNC %s %.4f %.4f %.4f %.4f %d\n" % (
+            name, mem_start, start, mem_end, end, level))
+
+    def flush(self):
+        if self.lines:
+            self.stream.write(''.join(self.lines))
+            del self.lines[:]
+        self.stream.flush()
+
+
+# .. binary profile format: BINARY_MAGIC followed by chunks, each made of a
+# .. 4 bytes tag, the payload size in bytes and the payload. Numeric
+# .. payloads are little-endian float64 rows:
+# ..   b'MEM '  (mem, timestamp)
+# ..   b'CHLD'  (child pid, mem, timestamp)
+# ..   b'FUNC'  uint32 name length, the name padded to 8 bytes, then
+# ..            (mem_start, start, mem_end, end, stack level)
+# .. b'CMDL' and b'BKND' hold the command line and the backend as text ..
+# .. The compact variant replaces the numeric chunks with b'DMEM', b'DCHL'
+# .. and b'DFUN' (name as in b'FUNC', unpadded), whose payload starts with
+# .. DELTA_CHUNK_HEADER: the chunk base time and the number of time and
+# .. memory steps per second and per MiB. Values follow as zigzag varints,
+# .. times and memory in steps, each as the difference with the previous
+# .. one in the chunk (with the previous one of the same child for the
+# .. memory of children), starting from the base time and 0 MiB. As samples
+# .. are evenly spaced, b'DMEM' stores the difference of these differences
+# .. for times:
+# ..   b'DMEM'  (time, mem)
+# ..   b'DCHL'  (child pid, time, mem)
+# ..   b'DFUN'  (start, end - start, mem_start, mem_end - mem_start, level)
+BINARY_MAGIC = b'\x00MPROF\x01\n'
+BINARY_CHUNK_HEADER = struct.Struct('<4sI')
+DELTA_CHUNK_HEADER = struct.Struct('<3d')
+
+
+def _pad8(payload):
+    return payload + b'\x00' * (-len(payload) % 8)
+
+
+def _float64_bytes(values):
+    if sys.byteorder == 'big':
+        values = array('d', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _zigzag_varints(values):
+    """Encode integers as zigzag varints: 0, -1, 1, -2... are written as
+    0, 1, 2, 3... in 7 bits groups, least significant first."""
+    out = bytearray()
+    append = out.append
+    for value in values:
+        value = 2 * value if value >= 0 else -2 * value - 1
+        while value >= 0x80:
+            append(value & 0x7f | 0x80)
+            value >>= 7
+        append(value)
+    return bytes(out)
+
+
+def _deltas(values):
+    previous = 0
+    for value in values:
+        yield value - previous
+        previous = value
+
+
+class BinaryProfileWriter(object):
+    """Write profile records in the binary format read by ``mprof``.
+
+    Records are buffered in ``array('d')`` columns and appended to ``stream``
+    (a file opened in binary mode) as one chunk per record type on
+    ``flush``, in a single write.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        if stream.tell() == 0:
+            stream.write(BINARY_MAGIC)
+        self.mem = array('d')
+        self.children = array('d')
+        self.functions = {}
+
+    def write_header(self, cmd_line, backend=None):
+        chunks = [self._chunk(b'CMDL', _pad8(str(cmd_line).encode('utf-8')))]
+        if backend is not None:
+            chunks.append(self._chunk(b'BKND', _pad8(backend.encode('utf-8'))))
+        self._write(chunks)
+
+    def write_mem(self, mem, timestamp):
+        self.mem.append(mem)
+        self.mem.append(timestamp)
+
+    def write_child(self, idx, mem, timestamp):
+        self.children.extend((idx, mem, timestamp))
+
+    def write_func(self, name, mem_start, start, mem_end, end, level):
+        if name not in self.functions:
+            self.functions[name] = array('d')
+        self.functions[name].extend((mem_start, start, mem_end, end, level))
+
+    def flush(self):
+        chunks = []
+        if self.mem:
+            chunks.append(self._mem_chunk(self.mem))
+            del self.mem[:]
+        if self.children:
+            chunks.append(self._children_chunk(self.children))
+            del self.children[:]
+        for name, records in self.functions.items():
+            chunks.append(self._func_chunk(name.encode('utf-8'), records))
+        self.functions.clear()
+        self._write(chunks)
+
+    def _mem_chunk(self, mem):
+        return self._chunk(b'MEM ', _float64_bytes(mem))
+
+    def _children_chunk(self, children):
+        return self._chunk(b'CHLD', _float64_bytes(children))
+
+    def _func_chunk(self, name, records):
+        return self._chunk(b'FUNC', _pad8(struct.pack('<I', len(name)) + name) +
+                           _float64_bytes(records))
+
+    @staticmethod
+    def _chunk(tag, payload):
+        return BINARY_CHUNK_HEADER.pack(tag, len(payload)) + payload
+
+    def _write(self, chunks):
+        # a single write, so that the chunks appended by mprof and by the
+        # profiled program to the same file do not interleave
+        if chunks:
+            self.stream.write(b''.join(chunks))
+        self.stream.flush()
+
+
+def _positive_float(value):
+    """argparse type of the --time-quantum and --mem-quantum options."""
+    from argparse import ArgumentTypeError
+    value = float(value)
+    if not value > 0:
+        raise ArgumentTypeError('%r is not a positive number' % value)
+    return value
+
+
+class CompactProfileWriter(BinaryProfileWriter):
+    """Write profile records in the compact variant of the binary format.
+
+    Times and memory values are rounded to ``time_quantum`` seconds and
+    ``mem_quantum`` MiB, and stored as varint differences with the
+    previous record of their chunk, after the chunk base time. At a 10ms
+    interval, a sample takes 2 to 3 bytes instead of about 30 in the text
+    format and 16 in the binary one.
+    """
+
+    def __init__(self, stream, time_quantum=1e-4, mem_quantum=1. / 1024):
+        if not time_quantum > 0 or not mem_quantum > 0:
+            raise ValueError('time_quantum and mem_quantum must be positive')
+        super(CompactProfileWriter, self).__init__(stream)
+        self.time_scale = 1. / time_quantum
+        self.mem_scale = 1. / mem_quantum
+
+    def _delta_header(self, base):
+        return DELTA_CHUNK_HEADER.pack(base, self.time_scale, self.mem_scale)
+
+    def _times(self, timestamps, base):
+        scale = self.time_scale
+        return [int(round((t - base) * scale)) for t in timestamps]
+
+    def _mems(self, mem):
+        scale = self.mem_scale
+        return [int(round(m * scale)) for m in mem]
+
+    def _mem_chunk(self, mem):
+        base = mem[1]
+        times = _deltas(_deltas(self._times(mem[1::2], base)))
+        mems = _deltas(self._mems(mem[0::2]))
+        values = [v for row in zip(times, mems) for v in row]
+        return self._chunk(b'DMEM', self._delta_header(base) +
+                           _zigzag_varints(values))
+
+    def _children_chunk(self, children):
+        base = children[2]
+        times = _deltas(self._times(children[2::3], base))
+        previous = {}
+        values = []
+        for pid, t, m in zip(children[0::3], times,
+                             self._mems(children[1::3])):
+            pid = int(pid)
+            values.extend((pid, t, m - previous.get(pid, 0)))
+            previous[pid] = m
+        return self._chunk(b'DCHL', self._delta_header(base) +
+                           _zigzag_varints(values))
+
+    def _func_chunk(self, name, records):
+        base = records[1]
+        starts = self._times(records[1::5], base)
+        ends = self._times(records[3::5], base)
+        mem_starts = self._mems(records[0::5])
+        mem_ends = self._mems(records[2::5])
+        values = []
+        for row in zip(_deltas(starts), starts, ends, _deltas(mem_starts),
+                       mem_starts, mem_ends, records[4::5]):
+            d_start, start, end, d_mem, mem_start, mem_end, level = row
+            values.extend((d_start, end - start, d_mem, mem_end - mem_start,
+                           int(level)))
+        return self._chunk(b'DFUN', self._delta_header(base) +
+                           struct.pack('<I', len(name)) + name +
+                           _zigzag_varints(values))
+
+
+def _profile_writer(stream):
+    # .. plain file objects get the text format ..
+    if hasattr(stream, 'write_mem'):
+        return stream
+    return TextProfileWriter(stream)
+
+
+# .. compressions of profile files: name, file extension and magic bytes ..
+PROFILE_COMPRESSIONS = (
+    ('gzip', '.gz', b'\x1f\x8b'),
+    ('zstd', '.zst', b'\x28\xb5\x2f\xfd'),
+    ('lz4', '.lz4', b'\x04\x22\x4d\x18'),
+)
+
+
+def profile_compression(filename):
+    """Return the compression of a profile file from its extension, or
+    None if it is not compressed."""
+    for compression, extension, _ in PROFILE_COMPRESSIONS:
+        if filename.endswith(extension):
+            return compression
+    return None
+
+
+def profile_codec(compression):
+    """Return the ``compress`` and ``decompressobj`` functions of one of
+    PROFILE_COMPRESSIONS.
+
+    gzip is always available, zstd and lz4 need the zstandard and lz4
+    packages, an ImportError is raised if they are not installed.
+    """
+    if compression == 'gzip':
+        import gzip
+        import zlib
+        return (partial(gzip.compress, compresslevel=6),
+                partial(zlib.decompressobj, 16 + zlib.MAX_WBITS))
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('The zstandard package is needed for .zst '
+                              'profiles: pip install zstandard')
+        return (zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompressobj)
+    if compression == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError('The lz4 package is needed for .lz4 '
+                              'profiles: pip install lz4')
+        return lz4.frame.compress, lz4.frame.LZ4FrameDecompressor
+    raise ValueError('Unknown profile compression: %s' % compression)
+
+
+class CompressedProfileFile(object):
+    """Append compressed data to a profile file.
+
+    Writes are buffered, and each ``flush`` appends them to the file as a
+    complete gzip member (or zstd / lz4 frame) in a single write. As with
+    plain files, mprof and the profiled program can thus append to the
+    same profile, and a profile that is still being written can be read
+    up to its last flush.
+    """
+
+    def __init__(self, filename, compression, binary=False):
+        self.compress = profile_codec(compression)[0]
+        self.binary = binary
+        self.file = open(filename, 'ab', buffering=0)
+        self.buffer = []
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def write(self, data):
+        if not self.binary:
+            data = data.encode('utf-8')
+        self.buffer.append(data)
+        return len(data)
+
+    def tell(self):
+        """Return 0 if nothing was written to the profile yet, 1 otherwise.
+
+        Offsets in the compressed file and in the buffered data can not be
+        compared, so this is only meant for the ``tell() == 0`` check of the
+        profile writers.
+        """
+        return int(bool(self.file.tell() or any(self.buffer)))
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = memoryview(self.compress(b''.join(self.buffer)))
+        del self.buffer[:]
+        while data:
+            data = data[self.file.write(data):]
+
+    def close(self):
+        if not self.file.closed:
+            try:
+                self.flush()
+            finally:
+                self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_profile_output(filename, binary=False):
+    """Open a profile file for appending.
+
+    The file is compressed if its extension is one of
+    PROFILE_COMPRESSIONS, e.g. ``profile.dat.gz``, in which case data
+    only reaches the file on ``flush``.
+    """
+    compression = profile_compression(filename)
+    if compression is None:
+        return open(filename, 'ab' if binary else 'a')
+    return CompressedProfileFile(filename, compression, binary)
+
+
+class BackgroundProfileWriter(object):
+    """Write the records of a profile writer from a background thread.
+
+    Samples are stored in a preallocated ``array('d')`` buffer of
+    ``capacity`` rows. A writer thread swaps it with a spare one and
+    writes its rows in a batch every ``flush_interval`` seconds, or as
+    soon as it is half full, so that a slow disk does not stall the
+    sampling loop and a profile being followed lags by at most about
+    ``flush_interval``.
+
+    If the writer can not keep up and the buffer is full, samples are
+    dropped and counted in ``dropped``. Samples written more than twice
+    ``flush_interval`` after they were taken are counted in ``late``.
+    ``flush`` only wakes up the writer thread, ``close`` writes all the
+    records and stops it. ``reserve`` grows the buffers when more rows
+    are written per sample, e.g. when more processes are sampled.
+    """
+
+    def __init__(self, writer, capacity=65536, flush_interval=1.):
+        self.writer = _profile_writer(writer)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        # .. rows of (child pid or -1 for the main process, mem, timestamp) ..
+        self.buffer = array('d', [0.]) * (3 * capacity)
+        self.spare = array('d', [0.]) * (3 * capacity)
+        self.size = 0
+        # .. header and function records, which are rare ..
+        self.records = []
+        self.written = 0
+        self.dropped = 0
+        self.late = 0
+        self.error = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       name='memory_profiler writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write_header(self, cmd_line, backend=None):
+        with self.lock:
+            self.records.append(('write_header', (cmd_line, backend)))
+
+    def write_func(self, name, mem_start, start, mem_end, end, level):
+        with self.lock:
+            self.records.append(
+                ('write_func', (name, mem_start, start, mem_end, end, level)))
+
+    def write_mem(self, mem, timestamp):
+        self._push(-1., mem, timestamp)
+
+    def write_child(self, idx, mem, timestamp):
+        self._push(idx, mem, timestamp)
+
+    def _push(self, idx, mem, timestamp):
+        with self.lock:
+            if self.size == self.capacity:
+                self.dropped += 1
+                return
+            i = 3 * self.size
+            buffer = self.buffer
+            buffer[i] = idx
+            buffer[i + 1] = mem
+            buffer[i + 2] = timestamp
+            self.size += 1
+            half_full = self.size == self.capacity // 2
+        if half_full:
+            self.wakeup.set()
+
+    def reserve(self, capacity):
+        """Grow the buffers to at least ``capacity`` rows."""
+        with self.lock:
+            if capacity <= self.capacity or self.error is not None:
+                return
+            zeros = array('d', [0.]) * (3 * (capacity - self.capacity))
+            # .. new arrays, as the writer thread may be reading the spare ..
+            self.buffer = self.buffer + zeros
+            self.spare = array('d', [0.]) * (3 * capacity)
+            self.capacity = capacity
+
+    def flush(self):
+        self.wakeup.set()
+
+    def _run(self):
+        try:
+            while not self.closed:
+                self.wakeup.wait(self.flush_interval)
+                self.wakeup.clear()
+                self._drain()
+        except Exception as e:
+            # .. raised by close, samples are dropped from now on ..
+            self.error = e
+            with self.lock:
+                self.capacity = self.size = 0
+
+    def _drain(self):
+        with self.lock:
+            buffer, size, records = self.buffer, self.size, self.records
+            self.buffer, self.spare = self.spare, buffer
+            self.size = 0
+            self.records = []
+        writer = self.writer
+        for method, args in records:
+            getattr(writer, method)(*args)
+        write_mem, write_child = writer.write_mem, writer.write_child
+        max_delay = 2 * self.flush_interval
+        now = time.time()
+        late = 0
+        for i in range(0, 3 * size, 3):
+            idx, mem, timestamp = buffer[i], buffer[i + 1], buffer[i + 2]
+            if idx < 0:
+                write_mem(mem, timestamp)
+            else:
+                write_child(int(idx), mem, timestamp)
+            if now - timestamp > max_delay:
+                late += 1
+        writer.flush()
+        self.written += size
+        self.late += late
+
+    def close(self):
+        """Write the buffered records and stop the writer thread."""
+        if not self.closed:
+            self.closed = True
+            self.wakeup.set()
+            self.thread.join()
+            if self.error is None:
+                self._drain()
+        if self.error is not None:
+            raise self.error
+
+    def warn_lost(self):
+        """Warn if samples were dropped or written late."""
+        if self.dropped or self.late:
+            warnings.warn(
+                'profile writer dropped {0} and wrote late {1} of {2} '
+                'samples'.format(self.dropped, self.late,
+                                 self.written + self.dropped))
+
+
+def _writer_capacity(interval, rows_per_sample=1, flush_interval=1.):
+    """Rows of a BackgroundProfileWriter buffer sampling every ``interval``
+    seconds: four flush intervals of samples, as its writer thread wakes
+    up when the buffer is half full."""
+    samples = int(4 * flush_interval / interval) + 1
+    return max(samples * rows_per_sample, 256)
+
+
 def memory_usage(proc=-1, interval=.1, timeout=None, timestamps=False,
                  include_children=False, multiprocess=False, max_usage=False,
-                 retval=False, stream=None, backend=None, max_iterations=None):
+                 retval=False, stream=None, backend=None, max_iterations=None,
+                 monitor='process', ring_size=None, cpu_budget=None):
     """
     Return the memory usage of a process or piece of code
 
@@ -309,33 +1379,72 @@ def memory_usage(proc=-1, interval=.1, timeout=None, timestamps=False,
         if stream is a File opened with write access, then results are written
         to this file instead of stored in memory and returned at the end of
         the subprocess. Useful for long-running processes.
+        A BinaryProfileWriter can be given instead to write the binary format.
         Implies timestamps=True.
 
     backend : str, optional
-        Current supported backends: 'psutil', 'psutil_pss', 'psutil_uss', 'posix', 'tracemalloc'
+        Current supported backends: 'psutil', 'psutil_pss', 'psutil_uss', 'posix', 'tracemalloc',
+        'tracemalloc_total', 'procfs'
         If `backend=None` the default is "psutil" which measures RSS aka "Resident Set Size". 
         For more information on "psutil_pss" (measuring PSS) and "psutil_uss" please refer to:
         https://psutil.readthedocs.io/en/latest/index.html?highlight=memory_info#psutil.Process.memory_full_info 
+        "procfs" (Linux only) also measures RSS, but reads /proc/<pid>/statm
+        directly through a cached file descriptor, which is much cheaper per
+        sample than "psutil".
+        "tracemalloc" measures the memory allocated from the profiled file,
+        which requires a tracemalloc snapshot per sample, while
+        "tracemalloc_total" measures all the memory traced by tracemalloc,
+        in the current process only (e.g. with monitor='thread').
 
     max_iterations : int
         Limits the number of iterations (calls to the process being monitored). Relevant
         when the process is a python function.
 
+    monitor : {'process', 'thread'}, optional
+        How memory is sampled while a python function runs. 'process'
+        (default) starts a monitoring process on each call, 'thread' samples
+        from a thread of the current process, which is much cheaper to
+        start, in particular with the spawn start method. The
+        'tracemalloc_total' backend always uses 'thread', since a monitoring
+        process would only see its own copy of the traced memory.
+
+    ring_size : int, optional
+        Only keep the last ``ring_size`` samples, in a ``MemoryRing`` that
+        also has the peak, min, mean and slope of the whole session, so
+        that a long monitoring session uses a fixed amount of memory. Can
+        not be combined with multiprocess.
+
+    cpu_budget : float, optional
+        Fraction of the time that may be spent sampling. Samples are taken
+        at a fixed rate, on ticks ``interval`` seconds apart; when sampling
+        costs more than this budget, only one tick out of 2, 4... is
+        sampled. Without it, the rate is kept and a warning reports the
+        ticks missed because sampling took longer than ``interval``.
+
     Returns
     -------
     mem_usage : list of floating-point values
         memory usage, in MiB. It's length is always < timeout / interval
         if max_usage is given, returns the two elements maximum memory and
-        number of measurements effectuated
+        number of measurements effectuated. A ``MemoryRing`` if ring_size
+        is given
     ret : return value of the profiled function
         Only returned if retval is set to True
     """
     backend = choose_backend(backend)
     if stream is not None:
         timestamps = True
+        stream = _profile_writer(stream)
+    if monitor not in ('process', 'thread'):
+        raise ValueError('Unknown monitor {0!r}'.format(monitor))
+    if backend == 'tracemalloc_total':
+        # .. tracemalloc is not shared with a forked MemTimer ..
+        monitor = 'thread'
+    if ring_size is not None and multiprocess:
+        raise ValueError('ring_size can not be used with multiprocess')
 
     if not max_usage:
-        ret = []
+        ret = _sample_list(ring_size, timestamps)
     else:
         ret = -1
 
@@ -350,136 +1459,347 @@ def memory_usage(proc=-1, interval=.1, timeout=None, timestamps=False,
         if max_iterations is not None:
             max_iter = max_iterations
 
-    if callable(proc):
-        proc = (proc, (), {})
-    if isinstance(proc, (list, tuple)):
-        if len(proc) == 1:
-            f, args, kw = (proc[0], (), {})
-        elif len(proc) == 2:
-            f, args, kw = (proc[0], proc[1], {})
-        elif len(proc) == 3:
-            f, args, kw = (proc[0], proc[1], proc[2])
-        else:
-            raise ValueError
+    if stream is not None and not (callable(proc) or
+                                   isinstance(proc, (list, tuple))):
+        # .. samples are written in batches from a thread, see
+        # .. BackgroundProfileWriter. Python functions are sampled by
+        # .. MemTimer, which does not write to the stream ..
+        # .. grown once the number of children is known ..
+        stream = BackgroundProfileWriter(stream, _writer_capacity(interval))
+    try:
+        if callable(proc):
+            proc = (proc, (), {})
+        if isinstance(proc, (list, tuple)):
+            if len(proc) == 1:
+                f, args, kw = (proc[0], (), {})
+            elif len(proc) == 2:
+                f, args, kw = (proc[0], proc[1], {})
+            elif len(proc) == 3:
+                f, args, kw = (proc[0], proc[1], proc[2])
+            else:
+                raise ValueError
+
+            current_iter = 0
+            while True:
+                current_iter += 1
+                if monitor == 'thread':
+                    p = MemTimerThread(os.getpid(), interval, backend,
+                                       timestamps=timestamps,
+                                       max_usage=max_usage,
+                                       include_children=include_children,
+                                       ring_size=ring_size,
+                                       cpu_budget=cpu_budget)
+                    p.start()
+                    try:
+                        returned = f(*args, **kw)
+                    finally:
+                        p.stop()
+                    ret = p.mem_usage
+                    n_measurements = p.n_measurements
+                else:
+                    child_conn, parent_conn = Pipe()  # this will store MemTimer's results
+                    p = MemTimer(os.getpid(), interval, child_conn, backend,
+                                 timestamps=timestamps,
+                                 max_usage=max_usage,
+                                 include_children=include_children,
+                                 ring_size=ring_size,
+                                 cpu_budget=cpu_budget)
+                    p.start()
+                    parent_conn.recv()  # wait until we start getting memory
+
+                    # When there is an exception in the "proc" - the (spawned) monitoring processes don't get killed.
+                    # Therefore, the whole process hangs indefinitely. Here, we are ensuring that the process gets killed!
+                    try:
+                        returned = f(*args, **kw)
+                        parent_conn.send(0)  # finish timing
+                        ret = parent_conn.recv()
+                        n_measurements = parent_conn.recv()
+                    except Exception:
+                        parent = psutil.Process(os.getpid())
+                        for child in parent.children(recursive=True):
+                            os.kill(child.pid, SIGKILL)
+                        p.join(0)
+                        raise
+
+                    p.join(5 * interval)
 
-        current_iter = 0
-        while True:
-            current_iter += 1
-            child_conn, parent_conn = Pipe()  # this will store MemTimer's results
-            p = MemTimer(os.getpid(), interval, child_conn, backend,
-                         timestamps=timestamps,
-                         max_usage=max_usage,
-                         include_children=include_children)
-            p.start()
-            parent_conn.recv()  # wait until we start getting memory
-
-            # When there is an exception in the "proc" - the (spawned) monitoring processes don't get killed.
-            # Therefore, the whole process hangs indefinitely. Here, we are ensuring that the process gets killed!
-            try:
-                returned = f(*args, **kw)
-                parent_conn.send(0)  # finish timing
-                ret = parent_conn.recv()
-                n_measurements = parent_conn.recv()
                 if max_usage:
                     # Convert the one element list produced by MemTimer to a singular value
                     ret = ret[0]
                 if retval:
                     ret = ret, returned
-            except Exception:
-                parent = psutil.Process(os.getpid())
-                for child in parent.children(recursive=True):
-                    os.kill(child.pid, SIGKILL)
-                p.join(0)
-                raise
 
-            p.join(5 * interval)
-
-            if (n_measurements > 4) or (current_iter == max_iter) or (interval < 1e-6):
-                break
-            interval /= 10.
-    elif isinstance(proc, subprocess.Popen):
-        # external process, launched from Python
-        line_count = 0
-        while True:
-            if not max_usage:
-                mem_usage = _get_memory(
-                    proc.pid, backend, timestamps=timestamps,
-                    include_children=include_children)
-
-                if mem_usage and stream is not None:
-                    stream.write("MEM {0:.6f} {1:.4f}\n".format(*mem_usage))
-
-                    # Write children to the stream file
-                    if multiprocess:
-                        for idx, chldmem in _get_child_memory(proc.pid):
-                            stream.write("CHLD {0} {1:.6f} {2:.4f}\n".format(idx, chldmem, time.time()))
+                if (n_measurements > 4) or (current_iter == max_iter) or (interval < 1e-6):
+                    break
+                interval /= 10.
+        elif isinstance(proc, subprocess.Popen):
+            # external process, launched from Python
+            sampler = _get_sampler(proc.pid, backend, include_children=include_children)
+            sampler.set_interval(interval)
+            ticker = _Ticker(interval, cpu_budget)
+            while True:
+                ticker.begin()
+                if not max_usage:
+                    mem_usage = sampler(timestamps=timestamps)
+
+                    if mem_usage and stream is not None:
+                        stream.write_mem(*mem_usage)
+
+                        # Write children to the stream file
+                        if multiprocess:
+                            children = _sampled_children(sampler)
+                            for idx, chldmem in children:
+                                stream.write_child(idx, chldmem, time.time())
+                            stream.reserve(_writer_capacity(
+                                interval, len(children) + 1))
+                    else:
+                        # Create a nested list with the child memory
+                        if multiprocess:
+                            mem_usage = [mem_usage]
+                            for _, chldmem in _sampled_children(sampler):
+                                mem_usage.append(chldmem)
+
+                        # Append the memory usage to the return value
+                        ret.append(mem_usage)
                 else:
-                    # Create a nested list with the child memory
-                    if multiprocess:
-                        mem_usage = [mem_usage]
-                        for _, chldmem in _get_child_memory(proc.pid):
-                            mem_usage.append(chldmem)
-
-                    # Append the memory usage to the return value
-                    ret.append(mem_usage)
-            else:
-                ret = max(ret,
-                          _get_memory(
-                              proc.pid, backend, include_children=include_children))
-            time.sleep(interval)
-            line_count += 1
-            # flush every 50 lines. Make 'tail -f' usable on profile file
-            if line_count > 50:
-                line_count = 0
-                if stream is not None:
-                    stream.flush()
-            if timeout is not None:
-                max_iter -= 1
-                if max_iter == 0:
+                    ret = max(ret, sampler())
+                n_ticks = ticker.advance()
+                time.sleep(ticker.delay())
+                if timeout is not None:
+                    max_iter -= n_ticks
+                    if max_iter <= 0:
+                        break
+                if proc.poll() is not None:
                     break
-            if proc.poll() is not None:
-                break
-    else:
-        # external process
-        if max_iter == -1:
-            max_iter = 1
+            ticker.warn_missed()
+        else:
+            # external process
+            if max_iter == -1:
+                max_iter = 1
+            sampler = _get_sampler(proc, backend, include_children=include_children)
+            sampler.set_interval(interval)
+            ticker = _Ticker(interval, cpu_budget)
+            counter = 0
+            while counter < max_iter:
+                ticker.begin()
+                if not max_usage:
+                    mem_usage = sampler(timestamps=timestamps)
+                    if stream is not None:
+                        stream.write_mem(*mem_usage)
+
+                        # Write children to the stream file
+                        if multiprocess:
+                            children = _sampled_children(sampler)
+                            for idx, chldmem in children:
+                                stream.write_child(idx, chldmem, time.time())
+                            stream.reserve(_writer_capacity(
+                                interval, len(children) + 1))
+                    else:
+                        # Create a nested list with the child memory
+                        if multiprocess:
+                            mem_usage = [mem_usage]
+                            for _, chldmem in _sampled_children(sampler):
+                                mem_usage.append(chldmem)
+
+                        # Append the memory usage to the return value
+                        ret.append(mem_usage)
+                else:
+                    ret = max([ret, sampler()])
+
+                counter += ticker.advance()
+                if counter < max_iter:
+                    time.sleep(ticker.delay())
+            ticker.warn_missed()
+    finally:
+        if isinstance(stream, BackgroundProfileWriter):
+            # .. also keep the buffered samples on KeyboardInterrupt ..
+            stream.close()
+            stream.warn_lost()
+    if stream:
+        return None
+    return ret
+
+
+def _matching_pids(pattern):
+    """Pids of the processes whose name or command line match ``pattern``,
+    other than the current one."""
+    current = os.getpid()
+    for process in psutil.process_iter(['name', 'cmdline']):
+        if process.pid == current:
+            continue
+        name = process.info['name'] or ''
+        cmdline = ' '.join(process.info['cmdline'] or ())
+        if pattern.search(name) or pattern.search(cmdline):
+            yield process.pid
+
+
+def monitor_processes(pids=(), match=None, interval=.1, timeout=None,
+                      stream=None, backend=None, include_children=False,
+                      rescan=1., cpu_budget=None):
+    """
+    Sample the memory usage of several processes from a single loop
+
+    Every ``interval`` seconds, the memory of each process is read in one
+    pass, with the same timestamp, until ``timeout`` or until all of them
+    have exited. With the "procfs" backend, this is one read of an open
+    /proc/<pid>/statm file per process.
+
+    Parameters
+    ----------
+    pids : iterable of int
+        The processes to monitor.
+
+    match : str, optional
+        Regular expression, the processes whose name or command line match
+        it are monitored as well. Processes are matched again every
+        ``rescan`` seconds, so that new ones are followed.
+
+    stream : File, optional
+        If given, the memory of each process is written as a child record
+        of its pid, and the total of all processes as the main memory
+        usage. A BinaryProfileWriter can be given to write the binary
+        format.
+
+    The other parameters are the same as for ``memory_usage``.
+
+    Returns
+    -------
+    mem_usage : dict
+        For each pid, a list of (mem, timestamp), or None if stream is
+        given.
+    """
+    backend = choose_backend(backend)
+    pattern = re.compile(match) if match is not None else None
+    samplers = {}
+
+    def add(pid):
+        try:
+            samplers[pid] = _get_sampler(pid, backend,
+                                         include_children=include_children)
+            samplers[pid].set_interval(interval)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+
+    def scan():
+        for pid in _matching_pids(pattern):
+            if pid not in samplers:
+                add(pid)
+        if stream is not None:
+            # .. a row per process and one for the total ..
+            stream.reserve(_writer_capacity(interval, len(samplers) + 1))
+        return time.monotonic() + rescan
+
+    for pid in pids:
+        add(int(pid))
+    if stream is not None:
+        stream = BackgroundProfileWriter(
+            stream, _writer_capacity(interval, len(samplers) + 1))
+    try:
+        ret = {}
+        max_iter = None if timeout is None else int(round(timeout / interval))
+        rescan_at = scan() if pattern is not None else None
+        ticker = _Ticker(interval, cpu_budget)
         counter = 0
-        while counter < max_iter:
-            counter += 1
-            if not max_usage:
-                mem_usage = _get_memory(
-                    proc, backend, timestamps=timestamps,
-                    include_children=include_children)
-                if stream is not None:
-                    stream.write("MEM {0:.6f} {1:.4f}\n".format(*mem_usage))
+        while max_iter is None or counter < max_iter:
+            ticker.begin()
+            if pattern is not None:
+                if time.monotonic() >= rescan_at:
+                    rescan_at = scan()
+            elif not samplers:
+                break
 
-                    # Write children to the stream file
-                    if multiprocess:
-                        for idx, chldmem in _get_child_memory(proc):
-                            stream.write("CHLD {0} {1:.6f} {2:.4f}\n".format(idx, chldmem, time.time()))
+            t = time.time()
+            total = 0.
+            n_sampled = 0
+            for pid, sampler in list(samplers.items()):
+                try:
+                    mem = sampler()
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    del samplers[pid]
+                    continue
+                if mem is None:
+                    continue
+                total += mem
+                n_sampled += 1
+                if stream is not None:
+                    stream.write_child(pid, mem, t)
                 else:
-                    # Create a nested list with the child memory
-                    if multiprocess:
-                        mem_usage = [mem_usage]
-                        for _, chldmem in _get_child_memory(proc):
-                            mem_usage.append(chldmem)
-
-                    # Append the memory usage to the return value
-                    ret.append(mem_usage)
-            else:
-                ret = max([ret,
-                           _get_memory(proc, backend, include_children=include_children)
-                           ])
-
-            time.sleep(interval)
-            # Flush every 50 lines.
-            if counter % 50 == 0 and stream is not None:
-                stream.flush()
-    if stream:
+                    ret.setdefault(pid, []).append((mem, t))
+            if stream is not None and n_sampled:
+                stream.write_mem(total, t)
+
+            counter += ticker.advance()
+            if max_iter is None or counter < max_iter:
+                time.sleep(ticker.delay())
+        ticker.warn_missed()
+    finally:
+        if stream is not None:
+            stream.close()
+            stream.warn_lost()
+    if stream is not None:
         return None
     return ret
 
 
+async def async_memory_usage(coro, interval=.1, timestamps=False,
+                             include_children=False, max_usage=False,
+                             retval=False, backend=None, ring_size=None,
+                             cpu_budget=None):
+    """
+    Return the memory usage of the current process while a coroutine is
+    awaited
+
+    This is the asyncio counterpart of ``memory_usage`` for python
+    functions. The coroutine runs on the current event loop while memory
+    is sampled from a thread, so that the loop is never blocked.
+
+    Parameters
+    ----------
+    coro : {awaitable, callable, tuple}
+        The awaitable to measure. Can also be given by a coroutine function
+        or by a tuple (f, args, kw), in which case f(*args, **kw) is awaited.
+
+    The other parameters are the same as for ``memory_usage``.
+
+    Returns
+    -------
+    mem_usage : list of floating-point values
+        memory usage, in MiB, or the maximum memory usage if max_usage is
+        given
+    ret : return value of the awaited coroutine
+        Only returned if retval is set to True
+    """
+    backend = choose_backend(backend)
+    if isinstance(coro, (list, tuple)):
+        f = coro[0]
+        args = coro[1] if len(coro) > 1 else ()
+        kw = coro[2] if len(coro) > 2 else {}
+        coro = f(*args, **kw)
+    elif callable(coro):
+        coro = coro()
+
+    loop = asyncio.get_running_loop()
+    p = MemTimerThread(os.getpid(), interval, backend,
+                       timestamps=timestamps,
+                       max_usage=max_usage,
+                       include_children=include_children,
+                       ring_size=ring_size,
+                       cpu_budget=cpu_budget)
+    # starting and stopping the thread wait for it, do it off the loop
+    await loop.run_in_executor(None, p.start)
+    try:
+        returned = await coro
+    finally:
+        await loop.run_in_executor(None, p.stop)
+
+    ret = p.mem_usage
+    if max_usage:
+        ret = ret[0]
+    if retval:
+        ret = ret, returned
+    return ret
+
+
 # ..
 # .. utility functions for line-by-line ..
 
@@ -503,47 +1823,139 @@ def _find_script(script_name):
     raise SystemExit(1)
 
 
+_NAN = float('nan')
+
+
+class _CallRecords(object):
+    """Start and end memory usage and time, and stack level, of the calls
+    to a timestamped function, in ``array('d')`` columns. The end of a call
+    that has not returned yet is NaN."""
+    __slots__ = ('start_mem', 'start_t', 'end_mem', 'end_t', 'level')
+
+    def __init__(self):
+        self.start_mem = array('d')
+        self.start_t = array('d')
+        self.end_mem = array('d')
+        self.end_t = array('d')
+        self.level = array('d')
+
+    def __len__(self):
+        return len(self.level)
+
+    def start(self, mem, t, level):
+        """Record the start of a call and return its index."""
+        self.start_mem.append(mem)
+        self.start_t.append(t)
+        self.end_mem.append(_NAN)
+        self.end_t.append(_NAN)
+        self.level.append(level)
+        return len(self.level) - 1
+
+    def end(self, i, mem, t):
+        self.end_mem[i] = mem
+        self.end_t[i] = t
+
+    def __iter__(self):
+        """Iterate on the (mem_start, start, mem_end, end, level) of the
+        calls that returned."""
+        for i in range(len(self.level)):
+            if self.end_t[i] == self.end_t[i]:
+                yield (self.start_mem[i], self.start_t[i],
+                       self.end_mem[i], self.end_t[i], self.level[i])
+
+
+class _StreamedCalls(object):
+    """Write the calls to a timestamped function to the output of
+    ``timestamper`` as they return, instead of keeping them. Only the
+    calls that have not returned yet are kept, ``len`` is the number of
+    calls written."""
+    __slots__ = ('timestamper', 'name', 'started', 'ids', 'written')
+
+    def __init__(self, timestamper, name):
+        self.timestamper = timestamper
+        self.name = name
+        self.started = {}
+        self.ids = itertools.count()
+        self.written = 0
+
+    def __len__(self):
+        return self.written
+
+    def __iter__(self):
+        return iter(())
+
+    def start(self, mem, t, level):
+        i = next(self.ids)
+        self.started[i] = (mem, t, level)
+        return i
+
+    def end(self, i, mem, t):
+        mem_start, start, level = self.started.pop(i)
+        self.timestamper._write_call(self.name, mem_start, start, mem, t, level)
+        self.written += 1
+
+
 class _TimeStamperCM(object):
     """Time-stamping context manager."""
 
-    def __init__(self, timestamps, filename, backend, timestamper=None, func=None,
+    def __init__(self, records, filename, backend, timestamper=None,
                  include_children=False):
-        self.timestamps = timestamps
+        self.records = records
         self.filename = filename
         self.backend = backend
         self.ts = timestamper
-        self.func = func
         self.include_children = include_children
+        self.sampler = _get_sampler(-1, backend, include_children=include_children)
+        self._index = None
 
     def __enter__(self):
+        level = 0
         if self.ts is not None:
-            self.ts.current_stack_level += 1
-            self.ts.stack[self.func].append(self.ts.current_stack_level)
+            level = self.ts.current_stack_level + 1
 
-        self.timestamps.append(
-            _get_memory(os.getpid(), self.backend, timestamps=True,
-                        include_children=self.include_children, filename=self.filename))
+        mem, t = self.sampler(timestamps=True, filename=self.filename)
+        self._index = self.records.start(mem, t, level)
+        # .. only once started, as __exit__ is not called if this raises ..
+        if self.ts is not None:
+            self.ts.current_stack_level = level
 
     def __exit__(self, *args):
         if self.ts is not None:
             self.ts.current_stack_level -= 1
 
-        self.timestamps.append(
-            _get_memory(os.getpid(), self.backend, timestamps=True,
-                        include_children=self.include_children, filename=self.filename))
+        mem, t = self.sampler(timestamps=True, filename=self.filename)
+        self.records.end(self._index, mem, t)
 
 
 class TimeStamper:
     """ A profiler that just records start and end execution times for
     any decorated function.
+
+    The calls of each function are kept in a ``_CallRecords``, 40 bytes
+    per call, until ``show_results``. If ``stream`` is given (a file or a
+    profile writer), calls are instead written to it as they return, and
+    flushed every ``flush_records`` calls, and by a background thread at
+    most ``flush_interval`` seconds after they return.
     """
 
-    def __init__(self, backend, include_children=False):
+    def __init__(self, backend, include_children=False, stream=None,
+                 flush_records=1000, flush_interval=1.):
         self.functions = {}
         self.backend = backend
         self.include_children = include_children
         self.current_stack_level = -1
-        self.stack = {}
+        self.sampler = _get_sampler(-1, backend, include_children=include_children)
+        self.writer = None if stream is None else _profile_writer(stream)
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        if self.writer is not None:
+            flusher = threading.Thread(target=self._run_flusher,
+                                       name='memory_profiler timestamper')
+            flusher.daemon = True
+            flusher.start()
 
     def __call__(self, func=None, precision=None):
         if func is not None:
@@ -570,77 +1982,323 @@ class TimeStamper:
         func.__module__ = ""
         func.__name__ = name
         self.add_function(func)
-        timestamps = []
-        self.functions[func].append(timestamps)
         # A new object is required each time, since there can be several
         # nested context managers.
-        try:
-            filename = inspect.getsourcefile(func)
-        except TypeError:
-            filename = '<unknown>'
         return _TimeStamperCM(
-            timestamps,
-            filename,
+            self.functions[func],
+            _source_filename(func),
             self.backend,
             timestamper=self,
-            func=func
         )
 
     def add_function(self, func):
         if func not in self.functions:
-            self.functions[func] = []
-            self.stack[func] = []
+            if self.writer is None:
+                self.functions[func] = _CallRecords()
+            else:
+                self.functions[func] = _StreamedCalls(
+                    self, "%s.%s" % (func.__module__, func.__name__))
 
     def wrap_function(self, func):
         """ Wrap a function to timestamp it.
         """
+        self.add_function(func)
+        filename = _source_filename(func)
+        records = self.functions[func]
+        sampler = self.sampler
 
         def f(*args, **kwds):
             # Start time
+            level = self.current_stack_level + 1
+            mem, t = sampler(timestamps=True, filename=filename)
+            i = records.start(mem, t, level)
+            # .. only once started, so that a failed sample does not leave
+            # .. the level raised ..
+            self.current_stack_level = level
             try:
-                filename = inspect.getsourcefile(func)
-            except TypeError:
-                filename = '<unknown>'
-            timestamps = [
-                _get_memory(os.getpid(), self.backend, timestamps=True,
-                            include_children=self.include_children, filename=filename)]
-            self.functions[func].append(timestamps)
-            try:
-                with self.call_on_stack(func, *args, **kwds) as result:
-                    return result
+                return func(*args, **kwds)
             finally:
+                self.current_stack_level -= 1
                 # end time
-                timestamps.append(_get_memory(os.getpid(), self.backend, timestamps=True,
-                                              include_children=self.include_children,
-                                              filename=filename))
+                mem, t = sampler(timestamps=True, filename=filename)
+                records.end(i, mem, t)
 
         return f
 
-    @contextmanager
-    def call_on_stack(self, func, *args, **kwds):
-        self.current_stack_level += 1
-        self.stack[func].append(self.current_stack_level)
+    def _write_call(self, name, mem_start, start, mem_end, end, level):
+        with self._lock:
+            self.writer.write_func(name, mem_start, start, mem_end, end, level)
+            self._unflushed += 1
+            if self._unflushed >= self.flush_records:
+                self._flush()
+
+    def _run_flusher(self):
+        # .. the calls of an idle program are flushed too ..
+        while not self._stopped.wait(self.flush_interval):
+            with self._lock:
+                if self._unflushed:
+                    self._flush()
 
-        yield func(*args, **kwds)
+    def _flush(self):
+        self.writer.flush()
+        self._unflushed = 0
 
-        self.current_stack_level -= 1
+    def flush(self):
+        """Write the buffered calls to the output stream."""
+        if self.writer is not None:
+            with self._lock:
+                self._flush()
 
     def show_results(self, stream=None):
         if stream is None:
+            if self.writer is not None:
+                # .. the calls were already written ..
+                self._stopped.set()
+                self.flush()
+                return
             stream = sys.stdout
+        writer = _profile_writer(stream)
 
-        for func, timestamps in self.functions.items():
+        for func, records in self.functions.items():
             function_name = "%s.%s" % (func.__module__, func.__name__)
-            for ts, level in zip(timestamps, self.stack[func]):
-                stream.write("FUNC %s %.4f %.4f %.4f %.4f %d\n" % (
-                    (function_name,) + ts[0] + ts[1] + (level,)))
+            for record in records:
+                writer.write_func(function_name, *record)
+        writer.flush()
+
+
+def _source_filename(func):
+    try:
+        return inspect.getsourcefile(func)
+    except TypeError:
+        return '<unknown>'
+
+
+class _TaskStepMeter(Coroutine):
+    """Wrap the coroutine of a task and measure each of its steps.
+
+    A step is a ``send`` or ``throw`` into the coroutine, which runs it
+    until its next suspension point. The memory traced by tracemalloc
+    before and after the step gives the memory retained by the task
+    during that step.
+    """
+
+    def __init__(self, coro, profiler):
+        self._coro = coro
+        self._profiler = profiler
+        self._stats = None
+        profiler._active += 1
+        # .. also released if the task is collected without finishing ..
+        self._finish = weakref.finalize(self, profiler._meter_done)
+
+    def _step(self, method, *args):
+        if self._stats is None:
+            # the task is fully set up, e.g. named, once it runs
+            self._stats = self._profiler._task_stats(self._coro)
+        start = tracemalloc.get_traced_memory()[0]
+        finished = False
+        try:
+            return method(*args)
+        except BaseException:
+            # .. StopIteration included: the coroutine is done ..
+            finished = True
+            raise
+        finally:
+            delta = tracemalloc.get_traced_memory()[0] - start
+            stats = self._stats
+            stats[0] += delta
+            if delta > 0:
+                stats[1] += delta
+            stats[2] += 1
+            if finished:
+                self._finish()
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        try:
+            return self._coro.close()
+        finally:
+            self._finish()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def __getattr__(self, name):
+        # cr_frame, cr_running, __qualname__, ... of the wrapped coroutine
+        return getattr(self._coro, name)
+
+
+class TaskProfiler(object):
+    """ A profiler that attributes memory allocations to asyncio tasks
+
+    A task factory is installed on the event loop to measure, with
+    tracemalloc, the memory retained by every step of every task, i.e. by
+    the code run between two suspension points of the task. Measures are
+    accumulated per coroutine qualified name (``by='coroutine'``) or per
+    task name (``by='name'``).
+
+    If the profiler started tracemalloc, it is stopped once the profiler
+    is disabled and the tasks it measures are done.
+    """
+
+    def __init__(self, by='coroutine'):
+        if by not in ('coroutine', 'name'):
+            raise ValueError('Unknown grouping {0!r}'.format(by))
+        self.by = by
+        # key -> [retained bytes, sum of the step increases, steps, tasks]
+        self.stats = {}
+        self.loop = None
+        self._previous_factory = None
+        self._started_tracemalloc = False
+        # number of measured tasks that are not done
+        self._active = 0
+
+    def _task_stats(self, coro):
+        if self.by == 'name':
+            key = asyncio.current_task().get_name()
+        else:
+            key = getattr(coro, '__qualname__', type(coro).__name__)
+        stats = self.stats.setdefault(key, [0, 0, 0, 0])
+        stats[3] += 1
+        return stats
+
+    def _task_factory(self, loop, coro, **kwargs):
+        meter = _TaskStepMeter(coro, self)
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, meter, **kwargs)
+        else:
+            task = asyncio.Task(meter, loop=loop, **kwargs)
+        # .. e.g. cancelled before its first step ..
+        finish = meter._finish
+        task.add_done_callback(lambda task: finish())
+        return task
+
+    def enable(self, loop=None):
+        """Install the task factory on ``loop``, the running loop by default.
+
+        Tasks created before are not measured.
+        """
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        if has_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.loop = loop
+        self._previous_factory = loop.get_task_factory()
+        loop.set_task_factory(self._task_factory)
+
+    def disable(self):
+        """Restore the previous task factory."""
+        if self.loop is not None:
+            self.loop.set_task_factory(self._previous_factory)
+            self.loop = None
+        self._stop_tracemalloc()
+
+    def _meter_done(self):
+        self._active -= 1
+        self._stop_tracemalloc()
+
+    def _stop_tracemalloc(self):
+        # .. not while measured tasks still run ..
+        if self._started_tracemalloc and self.loop is None and \
+                not self._active:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disable()
+
+    def show_results(self, stream=None, top=10, precision=1):
+        """Print the ``top`` tasks that retained the most memory."""
+        if stream is None:
+            stream = sys.stdout
+        template = '{0:>12} {1:>12} {2:>8} {3:>8}   {4:<}'
+        header = template.format('Retained', 'Growth', 'Steps', 'Tasks',
+                                 'Task')
+        stream.write(header + u'\n')
+        stream.write(u'=' * len(header) + '\n')
+        ranked = sorted(self.stats.items(), key=lambda item: item[1][0],
+                        reverse=True)
+        float_format = u'{0}.{1}f'.format(precision + 4, precision)
+        for key, (retained, growth, steps, tasks) in ranked[:top]:
+            stream.write(template.format(
+                (u'{0:' + float_format + '} MiB').format(retained / _TWO_20),
+                (u'{0:' + float_format + '} MiB').format(growth / _TWO_20),
+                steps, tasks, key) + u'\n')
+        stream.write(u'\n')
+
+
+def _thread_name(ident):
+    """Name of the running thread whose ident is ``ident``."""
+    for thread in threading.enumerate():
+        if thread.ident == ident:
+            return thread.name
+    return str(ident)
+
+
+class _LineMeasures(object):
+    """Measures of the lines of a toplevel code object recorded by one
+    thread, in arrays indexed by ``lineno - first_line``, so that recording
+    an event allocates nothing."""
+    __slots__ = ('first_line', 'inc', 'mem', 'occ')
+
+    def __init__(self, first_line, n_lines):
+        self.first_line = first_line
+        self.inc = array('d', [0.]) * n_lines
+        self.mem = array('d', [0.]) * n_lines
+        self.occ = array('q', [0]) * n_lines
+
+    def memory(self, lineno):
+        """Maximum memory usage of ``lineno``, 0 if it was not executed."""
+        if lineno:
+            i = lineno - self.first_line
+            if 0 <= i < len(self.occ) and self.occ[i]:
+                return self.mem[i]
+        return 0
+
+    def add(self, lineno, increment, memory):
+        i = lineno - self.first_line
+        if 0 <= i < len(self.occ):
+            self.inc[i] += increment
+            if memory > self.mem[i]:
+                self.mem[i] = memory
+            self.occ[i] += 1
+
+    def items(self):
+        """Iterate on the (lineno, (inc, mem, occ)) of the executed lines."""
+        for i, occ in enumerate(self.occ):
+            if occ:
+                yield self.first_line + i, (self.inc[i], self.mem[i], occ)
 
 
 class CodeMap(dict):
+    """Line measures of the profiled code objects.
+
+    Each thread records its measures separately, in ``threads``, so that
+    the increments of a line only depend on the previous line executed by
+    the same thread. ``self[code]`` holds the measures of all threads,
+    combined by ``merge``.
+    """
+
     def __init__(self, include_children, backend):
         self.include_children = include_children
         self._toplevel = []
+        self._toplevel_of = {}
+        self._linenos = {}
         self.backend = backend
+        self.sampler = _get_sampler(-1, backend, include_children=include_children)
+        self._resumed = {}
+        # thread ident -> {toplevel code: _LineMeasures}
+        self.threads = {}
+        self.thread_names = {}
 
     def add(self, code, toplevel_code=None):
         if code in self:
@@ -663,41 +2321,235 @@ class CodeMap(dict):
             linenos = range(start_line,
                             start_line + len(sub_lines))
             self._toplevel.append((filename, code, linenos))
+            self._linenos[code] = linenos
             self[code] = {}
         else:
             self[code] = self[toplevel_code]
+        self._toplevel_of[code] = toplevel_code
 
         for subcode in filter(inspect.iscode, code.co_consts):
             self.add(subcode, toplevel_code=toplevel_code)
 
+    def _measures(self, code, thread=None):
+        """Measures of ``code`` recorded by ``thread`` (default: current)."""
+        if thread is None:
+            thread = threading.get_ident()
+        try:
+            measures_by_code = self.threads[thread]
+        except KeyError:
+            measures_by_code = self.threads[thread] = {}
+            if thread == threading.get_ident():
+                self.thread_names[thread] = threading.current_thread().name
+            else:
+                self.thread_names[thread] = _thread_name(thread)
+        toplevel_code = self._toplevel_of[code]
+        try:
+            return measures_by_code[toplevel_code]
+        except KeyError:
+            linenos = self._linenos[toplevel_code]
+            measures = measures_by_code[toplevel_code] = _LineMeasures(
+                linenos.start, len(linenos))
+            return measures
+
     def trace(self, code, lineno, prev_lineno):
-        memory = _get_memory(-1, self.backend, include_children=self.include_children,
-                             filename=code.co_filename)
-        prev_value = self[code].get(lineno, None)
-        previous_memory = prev_value[1] if prev_value else 0
-        previous_inc = prev_value[0] if prev_value else 0
-
-        prev_line_value = self[code].get(prev_lineno, None) if prev_lineno else None
-        prev_line_memory = prev_line_value[1] if prev_line_value else 0
-        occ_count = self[code][lineno][2] + 1 if lineno in self[code] else 1
-        self[code][lineno] = (
-            previous_inc + (memory - prev_line_memory),
-            max(memory, previous_memory),
-            occ_count,
-        )
+        memory = self.sampler(filename=code.co_filename)
+        thread = threading.get_ident()
+        measures = self._measures(code, thread)
+        prev_line_memory = None
+        # .. no key to build unless a coroutine was resumed ..
+        if self._resumed:
+            prev_line_memory = self._resumed.pop((thread, code), None)
+        if prev_line_memory is None:
+            prev_line_memory = measures.memory(prev_lineno)
+        measures.add(lineno, memory - prev_line_memory, memory)
+
+    def resume(self, code):
+        """Measure the next increment of ``code`` from the current memory.
+
+        Called when a coroutine is resumed, so that the memory allocated
+        by other tasks while it was suspended is not credited to the line
+        it was awaiting on.
+        """
+        self._resumed[threading.get_ident(), code] = \
+            self.sampler(filename=code.co_filename)
 
-    def items(self):
-        """Iterate on the toplevel code blocks."""
+    def sample(self, code, lineno, memory, prev_memory, thread=None):
+        """Credit the change since the previous sample to ``lineno``."""
+        self._measures(code, thread).add(lineno, memory - prev_memory, memory)
+
+    def merge(self):
+        """Combine the measures of all threads into ``self[code]``.
+
+        Increments and occurrences are summed, memory usage is the maximum.
+        """
+        for (filename, code, linenos) in self._toplevel:
+            merged = self[code]
+            merged.clear()
+            for measures_by_code in list(self.threads.values()):
+                measures = measures_by_code.get(code)
+                if measures is None:
+                    continue
+                for lineno, (inc, mem, occ) in measures.items():
+                    prev_value = merged.get(lineno)
+                    if prev_value is not None:
+                        inc += prev_value[0]
+                        mem = max(mem, prev_value[1])
+                        occ += prev_value[2]
+                    merged[lineno] = (inc, mem, occ)
+
+    def items(self, thread=None):
+        """Iterate on the toplevel code blocks.
+
+        The measures of all threads are merged, unless ``thread`` is the
+        ident of the thread whose measures are wanted.
+        """
+        if thread is None:
+            self.merge()
         for (filename, code, linenos) in self._toplevel:
-            measures = self[code]
+            if thread is None:
+                measures = self[code]
+            else:
+                measures = self.threads.get(thread, {}).get(code)
+                measures = dict(measures.items()) if measures else None
             if not measures:
                 continue  # skip if no measurement
             line_iterator = ((line, measures.get(line)) for line in linenos)
             yield (filename, line_iterator)
 
 
+class _LineSampler(threading.Thread):
+    """
+    Sample memory at a fixed interval from a background thread and credit
+    the change to the profiled line the target thread is executing
+
+    The baseline is sampled when the sampler is built, i.e. when profiling
+    is enabled, and a last sample is taken when it stops, credited to the
+    last sampled line, or to the first line of the first profiled function
+    if it returned within one interval.
+    """
+
+    def __init__(self, code_map, thread_id, interval):
+        super(_LineSampler, self).__init__(name='memory_profiler line sampler')
+        self.daemon = True
+        self.code_map = code_map
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.last_line = None
+        self.prev_memory = None
+        first_line = self._first_line()
+        if first_line is not None:
+            self.prev_memory = code_map.sampler(
+                filename=first_line[0].co_filename)
+
+    def _first_line(self):
+        for (filename, code, linenos) in self.code_map._toplevel:
+            return code, code.co_firstlineno
+        return None
+
+    def _sample(self, code, lineno):
+        memory = self.code_map.sampler(filename=code.co_filename)
+        if self.prev_memory is None:
+            self.prev_memory = memory
+        self.code_map.sample(code, lineno, memory, self.prev_memory,
+                             self.thread_id)
+        self.prev_memory = memory
+        self.last_line = (code, lineno)
+
+    def run(self):
+        code_map = self.code_map
+        ticker = _Ticker(self.interval)
+        ticker.advance()
+        while not self.stop_event.wait(ticker.delay()):
+            ticker.advance()
+            frame = sys._current_frames().get(self.thread_id)
+            # .. innermost frame of a profiled function, so that memory
+            # .. allocated by unprofiled callees goes to the calling line ..
+            while frame is not None and frame.f_code not in code_map:
+                frame = frame.f_back
+            if frame is None:
+                continue
+            code, lineno = frame.f_code, frame.f_lineno
+            del frame
+            self._sample(code, lineno)
+        # .. the change since the last tick ..
+        line = self.last_line or self._first_line()
+        if line is not None:
+            self._sample(*line)
+
+    def stop(self):
+        # .. the thread takes the last sample before it exits ..
+        self.stop_event.set()
+        self.join()
+
+
+if has_monitoring:
+    _MONITORING_TOOL_ID = sys.monitoring.PROFILER_ID
+    _MONITORING_LOCAL_EVENTS = (
+        sys.monitoring.events.PY_START | sys.monitoring.events.PY_RESUME |
+        sys.monitoring.events.LINE | sys.monitoring.events.JUMP |
+        sys.monitoring.events.PY_RETURN | sys.monitoring.events.PY_YIELD)
+
+
+# .. coroutines, whose increments are reset when they are resumed ..
+_CO_ASYNC = inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+_RESUME = dis.opmap.get('RESUME')
+
+
+def _is_resumed(frame):
+    """Whether the "call" trace event of ``frame`` resumes it after a
+    ``yield`` or ``await``, rather than starting it."""
+    if _RESUME is None:
+        # .. before Python 3.11, a new frame has not run any instruction ..
+        return frame.f_lasti >= 0
+    # .. the RESUME instruction tells where execution starts again ..
+    code = frame.f_code.co_code
+    return code[frame.f_lasti] == _RESUME and code[frame.f_lasti + 1] & 3 > 0
+
+
+def _offset_to_lineno(code, offset):
+    """Line number of the instruction at ``offset`` in ``code``."""
+    for start, end, lineno in code.co_lines():
+        if start <= offset < end:
+            return lineno
+    return None
+
+
+class _ThreadState(object):
+    """Trace state of one thread: the current line of each profiled frame
+    on its stack and the previously traced line."""
+    __slots__ = ('prevlines', 'prev_lineno', 'enable_count', 'original_trace')
+
+    def __init__(self):
+        self.prevlines = []
+        self.prev_lineno = None
+        self.enable_count = 0
+        self.original_trace = None
+
+
 class LineProfiler(object):
-    """ A profiler that records the amount of memory for each line """
+    """ A profiler that records the amount of memory for each line
+
+    Line events are received either through ``sys.settrace`` or, with
+    ``engine='monitoring'`` (the default on Python 3.12+), through
+    ``sys.monitoring`` events registered only on the profiled code objects,
+    so that the rest of the program runs untraced.
+
+    With ``mode='sampling'`` no line event is traced: a background thread
+    reads memory every ``interval`` seconds and credits the change to the
+    line being executed, so the overhead depends on the sampling rate
+    rather than on the number of executed lines.
+
+    With the ``tracemalloc_total`` backend, a single tracemalloc snapshot is
+    taken when profiling stops and kept in ``snapshot``, to find out where
+    the traced memory was allocated.
+
+    Profiled functions can run in several threads: each thread keeps its
+    own trace state and measures, which ``show_results`` merges. With
+    ``sys.settrace``, the trace function is installed in the threads that
+    call a decorated function and, through ``threading.settrace``, in the
+    threads started while profiling.
+    """
 
     def __init__(self, **kw):
         include_children = kw.get('include_children', False)
@@ -706,9 +2558,41 @@ class LineProfiler(object):
             include_children=include_children, backend=backend)
         self.enable_count = 0
         self.max_mem = kw.get('max_mem', None)
-        self.prevlines = []
         self.backend = choose_backend(kw.get('backend', None))
-        self.prev_lineno = None
+        self.sampler = _get_sampler(-1, self.backend)
+        self.engine = choose_engine(kw.get('engine', None))
+        self._monitoring = False
+        self.mode = kw.get('mode', 'trace')
+        if self.mode not in ('trace', 'sampling'):
+            raise ValueError('Unknown mode {0!r}'.format(self.mode))
+        self.interval = kw.get('interval', 0.01)
+        self._line_sampler = None
+        self.snapshot = None
+        self._jump_lines = {}
+        # per-thread _ThreadState
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tracing = False
+        self._thread_hook = None
+
+    def _state(self):
+        """Trace state of the current thread."""
+        try:
+            return self._local.state
+        except AttributeError:
+            state = self._local.state = _ThreadState()
+            # .. the trace function a thread started while profiling would
+            # have had otherwise ..
+            state.original_trace = self._thread_hook
+            return state
+
+    @property
+    def prevlines(self):
+        return self._state().prevlines
+
+    @property
+    def prev_lineno(self):
+        return self._state().prev_lineno
 
     def __call__(self, func=None, precision=1):
         if func is not None:
@@ -736,6 +2620,8 @@ class LineProfiler(object):
                           % func)
         else:
             self.code_map.add(code)
+            if self._monitoring:
+                self._set_local_events(_MONITORING_LOCAL_EVENTS)
 
     @contextmanager
     def _count_ctxmgr(self):
@@ -749,7 +2635,12 @@ class LineProfiler(object):
         """ Wrap a function to profile it.
         """
 
-        if iscoroutinefunction(func):
+        if inspect.iscoroutinefunction(func):
+            async def f(*args, **kwargs):
+                with self._count_ctxmgr():
+                    return await func(*args, **kwargs)
+        elif iscoroutinefunction(func):
+            # generator-based coroutine
             @coroutine
             def f(*args, **kwargs):
                 with self._count_ctxmgr():
@@ -775,45 +2666,189 @@ class LineProfiler(object):
     def enable_by_count(self):
         """ Enable the profiler if it hasn't been enabled before.
         """
-        if self.enable_count == 0:
-            self.enable()
-        self.enable_count += 1
+        with self._lock:
+            if self.enable_count == 0:
+                self.enable()
+            elif self._tracing:
+                self._enable_thread()
+            self.enable_count += 1
 
     def disable_by_count(self):
         """ Disable the profiler if the number of disable requests matches the
         number of enable requests.
         """
-        if self.enable_count > 0:
-            self.enable_count -= 1
-            if self.enable_count == 0:
-                self.disable()
+        with self._lock:
+            if self.enable_count > 0:
+                self.enable_count -= 1
+                if self.enable_count == 0:
+                    self.disable()
+                elif self._tracing:
+                    self._disable_thread()
+
+    def _enable_thread(self):
+        """Install the trace function in the current thread."""
+        state = self._state()
+        if state.enable_count == 0:
+            original = sys.gettrace()
+            # .. already installed by threading.settrace ..
+            if original == self.trace_memory_usage:
+                original = None
+            state.original_trace = original
+            sys.settrace(self.trace_memory_usage)
+        state.enable_count += 1
+
+    def _disable_thread(self):
+        """Restore the trace function of the current thread."""
+        state = self._state()
+        if state.enable_count > 0:
+            state.enable_count -= 1
+            if state.enable_count == 0:
+                sys.settrace(state.original_trace)
+                state.original_trace = None
 
     def trace_memory_usage(self, frame, event, arg):
         """Callback for sys.settrace"""
+        state = self._state()
+        if not self._tracing:
+            # .. a thread started while profiling which outlived it, or a
+            # thread still traced when profiling was disabled from another
+            # one: restore its own trace function ..
+            if sys.gettrace() == self.trace_memory_usage:
+                original = state.original_trace
+                state.enable_count = 0
+                state.original_trace = None
+                sys.settrace(original)
+                if event == 'call' and original is not None:
+                    return original(frame, event, arg)
+            return None
         if frame.f_code in self.code_map:
+            prevlines = state.prevlines
             if event == 'call':
                 # "call" event just saves the lineno but not the memory
-                self.prevlines.append(frame.f_lineno)
+                prevlines.append(frame.f_lineno)
+                if frame.f_code.co_flags & _CO_ASYNC and _is_resumed(frame):
+                    self.code_map.resume(frame.f_code)
             elif event == 'line':
                 # trace needs current line and previous line
-                self.code_map.trace(frame.f_code, self.prevlines[-1], self.prev_lineno)
+                self.code_map.trace(frame.f_code, prevlines[-1], state.prev_lineno)
                 # saving previous line
-                self.prev_lineno = self.prevlines[-1]
-                self.prevlines[-1] = frame.f_lineno
+                state.prev_lineno = prevlines[-1]
+                prevlines[-1] = frame.f_lineno
             elif event == 'return':
-                lineno = self.prevlines.pop()
-                self.code_map.trace(frame.f_code, lineno, self.prev_lineno)
-                self.prev_lineno = lineno
+                lineno = prevlines.pop()
+                self.code_map.trace(frame.f_code, lineno, state.prev_lineno)
+                state.prev_lineno = lineno
 
-        if self._original_trace_function is not None:
-            self._original_trace_function(frame, event, arg)
+        if state.original_trace is not None:
+            state.original_trace(frame, event, arg)
 
         return self.trace_memory_usage
 
+    def _monitor_call(self, code, instruction_offset, depth=1):
+        """Callback for the PY_START monitoring event"""
+        if code in self.code_map:
+            # "call" event just saves the lineno but not the memory,
+            # ``depth`` is the number of frames above the profiled one
+            self._state().prevlines.append(sys._getframe(depth).f_lineno)
+            return True
+        return False
+
+    def _monitor_resume(self, code, instruction_offset):
+        """Callback for the PY_RESUME monitoring event"""
+        if self._monitor_call(code, instruction_offset, depth=2) and \
+                code.co_flags & _CO_ASYNC:
+            self.code_map.resume(code)
+
+    def _monitor_throw(self, code, instruction_offset, exception):
+        """Callback for the PY_THROW monitoring event"""
+        self._monitor_call(code, instruction_offset, depth=2)
+
+    def _monitor_line(self, code, line_number):
+        """Callback for the LINE monitoring event"""
+        state = self._state()
+        # .. ignore the frames entered before profiling started ..
+        if state.prevlines:
+            # trace needs current line and previous line
+            self.code_map.trace(code, state.prevlines[-1], state.prev_lineno)
+            # saving previous line
+            state.prev_lineno = state.prevlines[-1]
+            state.prevlines[-1] = line_number
+
+    def _monitor_jump(self, code, instruction_offset, destination_offset):
+        """Callback for the JUMP monitoring event"""
+        # settrace reports a "line" event when jumping backwards within the
+        # same line (e.g. a loop in a comprehension), sys.monitoring does not
+        key = (code, instruction_offset, destination_offset)
+        lineno = self._jump_lines.get(key)
+        if lineno is None:
+            if destination_offset > instruction_offset:
+                return sys.monitoring.DISABLE
+            lineno = _offset_to_lineno(code, destination_offset)
+            if lineno is None or lineno != _offset_to_lineno(code, instruction_offset):
+                return sys.monitoring.DISABLE
+            self._jump_lines[key] = lineno
+        self._monitor_line(code, lineno)
+
+    def _monitor_return(self, code, instruction_offset, arg):
+        """Callback for the PY_RETURN, PY_YIELD and PY_UNWIND monitoring events"""
+        # like settrace, ignore frames that were entered before profiling
+        # started, e.g. a suspended generator being closed
+        if code in self.code_map:
+            state = self._state()
+            if state.prevlines:
+                lineno = state.prevlines.pop()
+                self.code_map.trace(code, lineno, state.prev_lineno)
+                state.prev_lineno = lineno
+
+    def _set_local_events(self, event_set):
+        for code in self.code_map:
+            sys.monitoring.set_local_events(_MONITORING_TOOL_ID, code, event_set)
+
+    def _start_monitoring(self):
+        """Install the sys.monitoring callbacks.
+
+        Returns False if the tool id is already taken by another profiler,
+        in which case the caller falls back to sys.settrace.
+        """
+        monitoring = sys.monitoring
+        events = monitoring.events
+        if monitoring.get_tool(_MONITORING_TOOL_ID) is not None:
+            return False
+        monitoring.use_tool_id(_MONITORING_TOOL_ID, 'memory_profiler')
+        for event, callback in (
+                (events.PY_START, self._monitor_call),
+                (events.PY_RESUME, self._monitor_resume),
+                (events.PY_THROW, self._monitor_throw),
+                (events.JUMP, self._monitor_jump),
+                (events.LINE, self._monitor_line),
+                (events.PY_RETURN, self._monitor_return),
+                (events.PY_YIELD, self._monitor_return),
+                (events.PY_UNWIND, self._monitor_return)):
+            monitoring.register_callback(_MONITORING_TOOL_ID, event, callback)
+        # PY_THROW and PY_UNWIND can not be set locally, the callbacks
+        # filter on code_map
+        monitoring.set_events(_MONITORING_TOOL_ID,
+                              events.PY_THROW | events.PY_UNWIND)
+        self._set_local_events(_MONITORING_LOCAL_EVENTS)
+        self._monitoring = True
+        return True
+
+    def _stop_monitoring(self):
+        monitoring = sys.monitoring
+        self._set_local_events(monitoring.events.NO_EVENTS)
+        monitoring.set_events(_MONITORING_TOOL_ID, monitoring.events.NO_EVENTS)
+        for event in (monitoring.events.PY_START, monitoring.events.PY_RESUME,
+                      monitoring.events.PY_THROW, monitoring.events.LINE,
+                      monitoring.events.JUMP, monitoring.events.PY_RETURN,
+                      monitoring.events.PY_YIELD, monitoring.events.PY_UNWIND):
+            monitoring.register_callback(_MONITORING_TOOL_ID, event, None)
+        monitoring.free_tool_id(_MONITORING_TOOL_ID)
+        self._monitoring = False
+
     def trace_max_mem(self, frame, event, arg):
         # run into PDB as soon as memory is higher than MAX_MEM
         if event in ('line', 'return') and frame.f_code in self.code_map:
-            c = _get_memory(-1, self.backend, filename=frame.f_code.co_filename)
+            c = self.sampler(filename=frame.f_code.co_filename)
             if c >= self.max_mem:
                 t = ('Current memory {0:.2f} MiB exceeded the '
                      'maximum of {1:.2f} MiB\n'.format(c, self.max_mem))
@@ -842,21 +2877,65 @@ class LineProfiler(object):
     def enable(self):
         self._original_trace_function = sys.gettrace()
         if self.max_mem is not None:
+            # stepping into pdb requires a trace function
             sys.settrace(self.trace_max_mem)
+        elif self.mode == 'sampling':
+            self._line_sampler = _LineSampler(
+                self.code_map, threading.get_ident(), self.interval)
+            self._line_sampler.start()
+        elif self.engine == 'monitoring' and self._start_monitoring():
+            pass
         else:
-            sys.settrace(self.trace_memory_usage)
+            self._thread_hook = getattr(threading, 'gettrace', lambda: None)()
+            threading.settrace(self.trace_memory_usage)
+            self._tracing = True
+            self._enable_thread()
 
     def disable(self):
-        sys.settrace(self._original_trace_function)
+        if self.backend == 'tracemalloc_total' and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+        if self._line_sampler is not None:
+            self._line_sampler.stop()
+            self._line_sampler = None
+        elif self._monitoring:
+            self._stop_monitoring()
+        elif self._tracing:
+            self._disable_thread()
+            threading.settrace(self._thread_hook)
+            self._thread_hook = None
+            self._tracing = False
+        else:
+            sys.settrace(self._original_trace_function)
+        self.code_map.merge()
+
 
+def show_results(prof, stream=None, precision=1, threads=False):
+    """Print the line measures of ``prof``, merged over all threads.
 
-def show_results(prof, stream=None, precision=1):
+    With ``threads=True`` and measures from more than one thread, the
+    measures of each thread are printed afterwards.
+    """
     if stream is None:
         stream = sys.stdout
     template = '{0:>6} {1:>12} {2:>12}  {3:>10}   {4:<}'
+    # .. in sampling mode the count is a number of samples ..
+    if getattr(prof, 'mode', 'trace') == 'sampling':
+        count_header = 'Samples'
+    else:
+        count_header = 'Occurrences'
+
+    _show_code_map(prof.code_map.items(), stream, template, count_header,
+                   precision)
+    if threads and len(prof.code_map.threads) > 1:
+        for thread, name in list(prof.code_map.thread_names.items()):
+            stream.write(u'Thread: ' + name + '\n\n')
+            _show_code_map(prof.code_map.items(thread), stream, template,
+                           count_header, precision)
 
-    for (filename, lines) in prof.code_map.items():
-        header = template.format('Line #', 'Mem usage', 'Increment', 'Occurrences',
+
+def _show_code_map(items, stream, template, count_header, precision):
+    for (filename, lines) in items:
+        header = template.format('Line #', 'Mem usage', 'Increment', count_header,
                                  'Line Contents')
 
         stream.write(u'Filename: ' + filename + '\n\n')
@@ -1057,6 +3136,9 @@ class MemoryProfilerMagics(Magics):
 
         -c: If present, add the memory usage of any children process to the report.
 
+        -T: If present, sample memory from a thread of the current process
+        instead of starting a monitoring process for each repetition.
+
         -o: If present, return a object containing memit run details
 
         -q: If present, be quiet and do not output a result.
@@ -1078,7 +3160,7 @@ class MemoryProfilerMagics(Magics):
 
         """
         from memory_profiler import memory_usage, _func_exec
-        opts, stmt = self.parse_options(line, 'r:t:i:coq', posix=False,
+        opts, stmt = self.parse_options(line, 'r:t:i:coqT', posix=False,
                                         strict=False)
 
         if cell is None:
@@ -1097,6 +3179,7 @@ class MemoryProfilerMagics(Magics):
         include_children = 'c' in opts
         return_result = 'o' in opts
         quiet = 'q' in opts
+        monitor = 'thread' if 'T' in opts else 'process'
 
         # I've noticed we get less noisier measurements if we run
         # a garbage collection first
@@ -1113,7 +3196,8 @@ class MemoryProfilerMagics(Magics):
             tmp = memory_usage((_func_exec, (stmt, self.shell.user_ns)),
                                timeout=timeout, interval=interval,
                                max_usage=True, max_iterations=1,
-                               include_children=include_children)
+                               include_children=include_children,
+                               monitor=monitor)
             mem_usage.append(tmp)
 
         result = MemitResult(mem_usage, baseline, repeat, timeout, interval,
@@ -1165,7 +3249,7 @@ def profile(func=None, stream=None, precision=1, backend='psutil'):
     Decorator that will run the function and print a line-by-line profile
     """
     backend = choose_backend(backend)
-    if backend == 'tracemalloc' and has_tracemalloc:
+    if backend in _TRACEMALLOC_BACKENDS and has_tracemalloc:
         if not tracemalloc.is_tracing():
             tracemalloc.start()
     if func is not None:
@@ -1173,7 +3257,15 @@ def profile(func=None, stream=None, precision=1, backend='psutil'):
         show_results_bound = partial(
             show_results, stream=stream, precision=precision
         )
-        if iscoroutinefunction(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(wrapped=func)
+            async def wrapper(*args, **kwargs):
+                prof = get_prof()
+                val = await prof(func)(*args, **kwargs)
+                show_results_bound(prof)
+                return val
+        elif iscoroutinefunction(func):
+            # generator-based coroutine
             @wraps(wrapped=func)
             @coroutine
             def wrapper(*args, **kwargs):
@@ -1198,6 +3290,22 @@ def profile(func=None, stream=None, precision=1, backend='psutil'):
         return inner_wrapper
 
 
+def choose_engine(new_engine=None):
+    """
+    Function that selects how LineProfiler receives line events: 'monitoring'
+    (sys.monitoring, Python 3.12+) if available, 'settrace' otherwise
+    """
+    if new_engine is None:
+        return 'monitoring' if has_monitoring else 'settrace'
+    if new_engine not in ('monitoring', 'settrace'):
+        raise ValueError('Unknown engine {0!r}'.format(new_engine))
+    if new_engine == 'monitoring' and not has_monitoring:
+        warnings.warn('{0} can not be used, {1} used instead'.format(
+            new_engine, 'settrace'))
+        return 'settrace'
+    return new_engine
+
+
 def choose_backend(new_backend=None):
     """
     Function that tries to setup backend, chosen by user, and if failed,
@@ -1211,6 +3319,8 @@ def choose_backend(new_backend=None):
         ('psutil_uss', True),
         ('posix', os.name == 'posix'),
         ('tracemalloc', has_tracemalloc),
+        ('tracemalloc_total', has_tracemalloc),
+        ('procfs', has_procfs),
     ]
     backends_indices = dict((b[0], i) for i, b in enumerate(all_backends))
 
@@ -1246,7 +3356,7 @@ def exec_with_profiler(filename, profiler, backend, passed_args=[]):
     _backend = choose_backend(backend)
     sys.argv = [filename] + passed_args
     try:
-        if _backend == 'tracemalloc' and has_tracemalloc:
+        if _backend in _TRACEMALLOC_BACKENDS and has_tracemalloc:
             tracemalloc.start()
         with io.open(filename, encoding='utf-8') as f:
             exec(compile(f.read(), filename, 'exec'), ns, ns)
@@ -1261,7 +3371,7 @@ def run_module_with_profiler(module, profiler, backend, passed_args=[]):
     ns = dict(_CLEAN_GLOBALS, profile=profiler)
     _backend = choose_backend(backend)
     sys.argv = [module] + passed_args
-    if _backend == 'tracemalloc' and has_tracemalloc:
+    if _backend in _TRACEMALLOC_BACKENDS and has_tracemalloc:
         tracemalloc.start()
     try:
         run_module(module, run_name="__main__", init_globals=ns)
@@ -1325,10 +3435,29 @@ if __name__ == '__main__':
     parser.add_argument('--include-children', dest='include_children',
         default=False, action='store_true',
         help='also include memory used by child processes')
+    parser.add_argument('--sampling', dest='sampling', default=False,
+        action='store_true',
+        help='''sample memory from a background thread instead of measuring
+        it on every executed line''')
+    parser.add_argument('--sampling-interval', dest='sampling_interval',
+        type=float, action='store', default=0.01,
+        help='interval in seconds between two samples with --sampling')
     parser.add_argument('--backend', dest='backend', type=str, action='store',
-        choices=['tracemalloc', 'psutil', 'psutil_pss', 'psutil_uss', 'posix'], default='psutil',
+        choices=['tracemalloc', 'tracemalloc_total', 'psutil', 'psutil_pss', 'psutil_uss',
+                 'posix', 'procfs'],
+        default='psutil',
         help='backend using for getting memory info '
-             '(one of the {tracemalloc, psutil, posix, psutil_pss, psutil_uss, posix})')
+             '(one of the {tracemalloc, tracemalloc_total, psutil, posix, psutil_pss, '
+             'psutil_uss, posix, procfs})')
+    parser.add_argument('--format', dest='format',
+        choices=['text', 'binary', 'compact'], default='text',
+        help='format of the function timestamps written with --timestamp -o')
+    parser.add_argument('--time-quantum', dest='time_quantum', type=_positive_float,
+        action='store', default=1e-4,
+        help='resolution in seconds of the times of the compact format')
+    parser.add_argument('--mem-quantum', dest='mem_quantum', type=_positive_float,
+        action='store', default=1. / 1024,
+        help='resolution in MiB of the memory of the compact format')
     parser.add_argument("program", nargs=REMAINDER,
         help='python script or module followed by command line arguments to run')
     args = parser.parse_args()
@@ -1341,9 +3470,24 @@ if __name__ == '__main__':
     script_args = args.program[1:]
     _backend = choose_backend(args.backend)
     if args.timestamp:
-        prof = TimeStamper(_backend, include_children=args.include_children)
+        # .. calls are written to the output file as they return ..
+        stream = None
+        if args.out_filename is not None:
+            if args.format == 'binary':
+                stream = BinaryProfileWriter(
+                    open_profile_output(args.out_filename, binary=True))
+            elif args.format == 'compact':
+                stream = CompactProfileWriter(
+                    open_profile_output(args.out_filename, binary=True),
+                    args.time_quantum, args.mem_quantum)
+            else:
+                stream = open_profile_output(args.out_filename)
+        prof = TimeStamper(_backend, include_children=args.include_children,
+                           stream=stream)
     else:
-        prof = LineProfiler(max_mem=args.max_mem, backend=_backend)
+        prof = LineProfiler(max_mem=args.max_mem, backend=_backend,
+                            mode='sampling' if args.sampling else 'trace',
+                            interval=args.sampling_interval)
 
     try:
         if args.program[0].endswith('.py'):
@@ -1352,12 +3496,13 @@ if __name__ == '__main__':
         else:
             run_module_with_profiler(target, prof, args.backend, script_args)
     finally:
-        if args.out_filename is not None:
-            out_file = open(args.out_filename, "a")
-        else:
-            out_file = sys.stdout
-
         if args.timestamp:
-            prof.show_results(stream=out_file)
+            prof.show_results()
         else:
+            if args.out_filename is not None:
+                out_file = open_profile_output(args.out_filename)
+            else:
+                out_file = sys.stdout
             show_results(prof, precision=args.precision, stream=out_file)
+            if out_file is not sys.stdout:
+                out_file.close()
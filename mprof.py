@@ -1,4 +1,6 @@
+import bisect
 import glob
+import io
 import os
 import os.path as osp
 import sys
@@ -7,7 +9,9 @@ import copy
 import time
 import math
 import logging
+import struct
 import itertools
+from array import array
 from ast import literal_eval
 
 from collections import defaultdict
@@ -54,6 +58,17 @@ def get_action():
     return sys.argv.pop(1)
 
 
+def _existing_profiles():
+    """Return the sorted profiles of the current directory, including
+    compressed ones."""
+    pattern = "mprofile_??????????????.dat"
+    profiles = glob.glob(pattern)
+    for _, extension, _ in mp.PROFILE_COMPRESSIONS:
+        profiles.extend(glob.glob(pattern + extension))
+    profiles.sort()
+    return profiles
+
+
 def get_profile_filenames(args):
     """Return list of profile filenames.
 
@@ -71,8 +86,7 @@ def get_profile_filenames(args):
         list of existing memory profile filenames. It is guaranteed
         that an given file name will not appear twice in this list.
     """
-    profiles = glob.glob("mprofile_??????????????.dat")
-    profiles.sort()
+    profiles = _existing_profiles()
 
     if args == "all":
         filenames = copy.copy(profiles)
@@ -150,7 +164,15 @@ def rm_action():
             print(filename)
     else:
         for filename in filenames:
-            os.remove(filename)
+            remove_profile(filename)
+
+
+def remove_profile(filename):
+    """Remove a profile file and its cached index, if any."""
+    os.remove(filename)
+    index_filename = _index_filename(filename)
+    if osp.exists(index_filename):
+        os.remove(index_filename)
 
 
 def clean_action():
@@ -170,7 +192,7 @@ def clean_action():
             print(filename)
     else:
         for filename in filenames:
-            os.remove(filename)
+            remove_profile(filename)
 
 
 def get_cmd_line(args):
@@ -213,10 +235,32 @@ def run_action():
                         default="mprofile_%s.dat" % time.strftime("%Y%m%d%H%M%S", time.localtime()),
                         help="""File to store results in, defaults to 'mprofile_<YYYYMMDDhhmmss>.dat' in the current directory,
 (where <YYYYMMDDhhmmss> is the date-time of the program start).
-This file contains the process memory consumption, in Mb (one value per line).""")
-    parser.add_argument("--backend", dest="backend", choices=["psutil", "psutil_pss", "psutil_uss", "posix", "tracemalloc"],
+This file contains the process memory consumption, in Mb (one value per line).
+It is compressed as it is written if its name ends with .gz, .zst or .lz4
+(the last two need the zstandard or lz4 package).""")
+    parser.add_argument("--backend", dest="backend", choices=["psutil", "psutil_pss", "psutil_uss", "posix", "tracemalloc",
+                                                              "procfs"],
                         default="psutil",
-                        help="Current supported backends: 'psutil', 'psutil_pss', 'psutil_uss', 'posix', 'tracemalloc'. Defaults to 'psutil'.")
+                        help="Current supported backends: 'psutil', 'psutil_pss', 'psutil_uss', 'posix', 'tracemalloc', 'procfs'. Defaults to 'psutil'.")
+    parser.add_argument("--format", dest="format", choices=["text", "binary", "compact"], default="text",
+                        help="""Format of the output file: 'text' (default) or 'binary', which is
+several times smaller and much faster to load for long profiles. 'compact' is the
+binary format with times and memory rounded to --time-quantum and --mem-quantum,
+stored as differences with the previous sample: about 10 times smaller than text.""")
+    parser.add_argument("--time-quantum", dest="time_quantum", default=1e-4, type=mp._positive_float,
+                        help="Resolution of the times of the compact format, in seconds, defaults to 0.0001")
+    parser.add_argument("--mem-quantum", dest="mem_quantum", default=1. / 1024, type=mp._positive_float,
+                        help="Resolution of the memory of the compact format, in MiB, defaults to 1/1024")
+    parser.add_argument("--cpu-budget", dest="cpu_budget", default=None, type=float,
+                        help="""Fraction of the time that may be spent sampling, e.g. 0.05. Samples
+are taken at a fixed rate; above this budget, only one tick out of 2, 4... is sampled.""")
+    parser.add_argument("--pids", dest="pids", default=None,
+                        help="""Comma-separated pids of existing processes to monitor together,
+from a single sampling loop. Each process is recorded as a child of the profile,
+whose main line is their total.""")
+    parser.add_argument("--match", dest="match", default=None,
+                        help="""Also monitor the existing and new processes whose name or
+command line match this regular expression, like --pids.""")
     parser.add_argument("program", nargs=REMAINDER,
                         help='Option 1: "<EXECUTABLE> <ARG1> <ARG2>..." - profile executable\n'
                              'Option 2: "<PYTHON_SCRIPT> <ARG1> <ARG2>..." - profile python script\n'
@@ -225,6 +269,18 @@ This file contains the process memory consumption, in Mb (one value per line).""
                         )
     args = parser.parse_args()
 
+    compression = mp.profile_compression(args.filename)
+    if compression is not None:
+        try:
+            mp.profile_codec(compression)
+        except ImportError as e:
+            print(e)
+            sys.exit(1)
+
+    if args.pids is not None or args.match is not None:
+        monitor_pids(args)
+        return
+
     if len(args.program) == 0:
         print("A program to run must be provided. Use -h for help")
         sys.exit(1)
@@ -269,7 +325,11 @@ This file contains the process memory consumption, in Mb (one value per line).""
             if not program[0].startswith("python"):
                 program.insert(0, sys.executable)
             cmd_line = get_cmd_line(program)
-            extra_args = ["-m", "memory_profiler", "--timestamp", "-o", mprofile_output]
+            extra_args = ["-m", "memory_profiler", "--timestamp", "-o", mprofile_output,
+                          "--format", args.format]
+            if args.format == "compact":
+                extra_args += ["--time-quantum", repr(args.time_quantum),
+                               "--mem-quantum", repr(args.mem_quantum)]
             if args.include_children:
                 extra_args.append("--include-children")
             program[1:1] = extra_args
@@ -278,11 +338,18 @@ This file contains the process memory consumption, in Mb (one value per line).""
             cmd_line = get_cmd_line(program)
             p = subprocess.Popen(program)
 
-    with open(mprofile_output, "a") as f:
-        f.write("CMDLINE {0}\n".format(cmd_line))
-        mp.memory_usage(proc=p, interval=args.interval, timeout=args.timeout, timestamps=True,
-                        include_children=args.include_children,
-                        multiprocess=args.multiprocess, stream=f, backend=args.backend)
+    f, writer = open_profile_writer(mprofile_output, args.format,
+                                    args.time_quantum, args.mem_quantum)
+    with f:
+        writer.write_header(cmd_line, args.backend)
+        try:
+            mp.memory_usage(proc=p, interval=args.interval, timeout=args.timeout, timestamps=True,
+                            include_children=args.include_children,
+                            multiprocess=args.multiprocess, stream=writer, backend=args.backend,
+                            cpu_budget=args.cpu_budget)
+        finally:
+            # .. keep the buffered samples on KeyboardInterrupt ..
+            writer.flush()
 
     if args.exit_code:
         if p.returncode != 0:
@@ -290,6 +357,50 @@ This file contains the process memory consumption, in Mb (one value per line).""
         sys.exit(p.returncode)
 
 
+def open_profile_writer(filename, format="text", time_quantum=1e-4,
+                        mem_quantum=1. / 1024):
+    """Open a profile for appending and return it with its writer.
+
+    The profile is compressed if its extension is one of
+    memory_profiler.PROFILE_COMPRESSIONS, e.g. profile.dat.gz. The
+    quanta are those of the "compact" format.
+    """
+    f = mp.open_profile_output(filename, binary=format != "text")
+    if format == "binary":
+        return f, mp.BinaryProfileWriter(f)
+    if format == "compact":
+        return f, mp.CompactProfileWriter(f, time_quantum, mem_quantum)
+    return f, mp.TextProfileWriter(f)
+
+
+def monitor_pids(args):
+    """Record the memory of the processes given by --pids and --match."""
+    pids = []
+    if args.pids is not None:
+        try:
+            pids = [int(pid) for pid in args.pids.split(",") if pid.strip()]
+        except ValueError:
+            print("--pids must be a comma-separated list of pids")
+            sys.exit(1)
+    if args.timeout is None:
+        args.timeout = 3600
+
+    print("{1}: Sampling memory every {0}s".format(
+        args.interval, osp.basename(sys.argv[0])))
+    f, writer = open_profile_writer(args.filename, args.format,
+                                    args.time_quantum, args.mem_quantum)
+    with f:
+        writer.write_header(get_cmd_line(["mprof"] + sys.argv[1:]), args.backend)
+        try:
+            mp.monitor_processes(pids, match=args.match, interval=args.interval,
+                                 timeout=args.timeout, stream=writer,
+                                 backend=args.backend,
+                                 include_children=args.include_children,
+                                 cpu_budget=args.cpu_budget)
+        finally:
+            writer.flush()
+
+
 def add_brackets(xloc, yloc, xshift=0, color="r", label=None, options=None):
     """Add two brackets on the memory line plot.
 
@@ -337,27 +448,794 @@ def add_brackets(xloc, yloc, xshift=0, color="r", label=None, options=None):
         ## pl.plot(xloc[1], yloc[1], ">"+color, markersize=7)
 
 
-def read_mprofile_file(filename):
-    """Read an mprofile file and return its content.
+# Bytes read at once from a compressed profile
+_COMPRESSED_READ_SIZE = 1 << 16
+
+
+def _compression_of(head):
+    """Return the compression of a profile from its first bytes, or None."""
+    for compression, _, magic in mp.PROFILE_COMPRESSIONS:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _decompress_members(decompressobj, data):
+    """Decompress the complete members at the start of data.
+
+    Returns the decompressed content and the number of bytes of data it
+    was decompressed from. A truncated last member is left out.
+    """
+    pieces = []
+    consumed = 0
+    while consumed < len(data):
+        d = decompressobj()
+        piece = d.decompress(data[consumed:])
+        if not d.eof:
+            break
+        pieces.append(piece)
+        consumed = len(data) - len(d.unused_data)
+    return b''.join(pieces), consumed
+
+
+class CompressedProfileReader(io.RawIOBase):
+    """Seekable, read-only view of the decompressed content of a profile
+    written through memory_profiler.CompressedProfileFile.
+
+    Such a profile is a sequence of complete members (gzip members, or
+    zstd / lz4 frames). Their compressed and decompressed offsets are
+    found as the profile is read, or given by ``members``, the table
+    saved in the profile index, in which case only the members holding
+    the bytes read are decompressed. A truncated last member, still being
+    written, is ignored.
+    """
+
+    def __init__(self, file, compression, members=None):
+        super(CompressedProfileReader, self).__init__()
+        self.file = file
+        self.decompressobj = mp.profile_codec(compression)[1]
+        self.pos = 0
+        # .. the last decompressed member, as (index, content) ..
+        self.current = None
+        if members is None:
+            # .. offsets of the members found so far, and of the next one ..
+            self.offsets = [0]
+            self.starts = [0]
+            self.complete = False
+        else:
+            self.offsets = [int(row[0]) for row in members]
+            self.starts = [int(row[1]) for row in members]
+            self.complete = True
+
+    @property
+    def members(self):
+        """(compressed offset, decompressed offset) of each member, and of
+        the end of the profile."""
+        while self._scan():
+            pass
+        return list(zip(self.offsets, self.starts))
+
+    def _scan(self):
+        """Find the next member, return False at the end of the profile."""
+        if self.complete:
+            return False
+        if self._decompress(len(self.offsets) - 1) is None:
+            self.complete = True
+        return not self.complete
+
+    def _decompress(self, i):
+        self.file.seek(self.offsets[i])
+        d = self.decompressobj()
+        pieces = []
+        size = 0
+        while not d.eof:
+            data = self.file.read(_COMPRESSED_READ_SIZE)
+            if not data:
+                return None
+            size += len(data)
+            pieces.append(d.decompress(data))
+        content = b''.join(pieces)
+        if i == len(self.offsets) - 1:
+            self.offsets.append(self.offsets[i] + size - len(d.unused_data))
+            self.starts.append(self.starts[i] + len(content))
+        self.current = (i, content)
+        return content
+
+    def _member_at(self, pos):
+        """Return the offset and content of the member holding pos."""
+        while self.starts[-1] <= pos and self._scan():
+            pass
+        i = bisect.bisect_right(self.starts, pos) - 1
+        if i >= len(self.starts) - 1:
+            return None
+        if self.current is None or self.current[0] != i:
+            if self._decompress(i) is None:
+                return None
+        return self.starts[i], self.current[1]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            while self._scan():
+                pass
+            offset += self.starts[-1]
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            member = self._member_at(self.pos)
+            if member is None:
+                break
+            start, content = member
+            piece = content[self.pos - start:]
+            if size > 0:
+                piece = piece[:size]
+                size -= len(piece)
+            pieces.append(piece)
+            self.pos += len(piece)
+        return b''.join(pieces)
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super(CompressedProfileReader, self).close()
+
+
+def open_profile(filename, members=None):
+    """Open a profile for reading in binary mode.
+
+    Compressed profiles are decompressed on the fly, and offsets are
+    those of their decompressed content. ``members`` is the table of
+    CompressedProfileReader.members, if known.
+    """
+    f = open(filename, "rb")
+    compression = _compression_of(f.peek(4))
+    if compression is None:
+        return f
+    try:
+        return io.BufferedReader(
+            CompressedProfileReader(f, compression, members))
+    except ImportError:
+        f.close()
+        raise
+
+
+def is_binary_mprofile(filename):
+    """Return True if the file was written in the binary format."""
+    with open_profile(filename) as f:
+        return f.read(len(mp.BINARY_MAGIC)) == mp.BINARY_MAGIC
+
+
+def _float64_array(payload):
+    values = array('d')
+    values.frombytes(payload)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _zigzag_values(data):
+    """Decode a sequence of zigzag varints, see memory_profiler."""
+    values = []
+    append = values.append
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            append((value >> 1) ^ -(value & 1))
+            value = shift = 0
+        else:
+            shift += 7
+    return values
+
+
+def _zigzag_array(np, data):
+    """Decode a sequence of zigzag varints into an int64 array."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    # .. the last byte of each varint has its high bit clear ..
+    ends = np.flatnonzero(buf < 0x80)
+    if not len(ends):
+        return np.empty(0, dtype=np.int64)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    buf = buf[:ends[-1] + 1]
+    shifts = np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)
+    groups = (buf & 0x7f).astype(np.uint64) << (7 * shifts).astype(np.uint64)
+    values = np.add.reduceat(groups, starts)
+    return (values >> np.uint64(1)).astype(np.int64) ^ \
+        -(values & np.uint64(1)).astype(np.int64)
+
+
+def _split_delta_chunk(payload):
+    """Return the base time, the scales and the data of a compact chunk."""
+    base, time_scale, mem_scale = mp.DELTA_CHUNK_HEADER.unpack_from(payload)
+    return base, time_scale, mem_scale, payload[mp.DELTA_CHUNK_HEADER.size:]
+
+
+def _delta_func_header(data):
+    """Split the data of a b'DFUN' chunk into the b'FUNC' payload header
+    and the varints."""
+    name_len = struct.unpack('<I', data[:4])[0]
+    return mp._pad8(data[:4 + name_len]), data[4 + name_len:]
+
+
+def _expand_delta_chunk(tag, payload):
+    """Return the tag and payload of the plain chunk with the same records
+    as a chunk of the compact format."""
+    base, time_scale, mem_scale, data = _split_delta_chunk(payload)
+    rows = array('d')
+    if tag == b'DFUN':
+        header, data = _delta_func_header(data)
+        values = _zigzag_values(data)
+        starts = itertools.accumulate(values[0::5])
+        mem_starts = itertools.accumulate(values[2::5])
+        for start, duration, mem_start, growth, level in zip(
+                starts, values[1::5], mem_starts, values[3::5], values[4::5]):
+            rows.extend((mem_start / mem_scale, base + start / time_scale,
+                         (mem_start + growth) / mem_scale,
+                         base + (start + duration) / time_scale, level))
+        return b'FUNC', header + mp._float64_bytes(rows)
+
+    values = _zigzag_values(data)
+    if tag == b'DMEM':
+        times = itertools.accumulate(itertools.accumulate(values[0::2]))
+        mems = itertools.accumulate(values[1::2])
+        for t, m in zip(times, mems):
+            rows.extend((m / mem_scale, base + t / time_scale))
+        return b'MEM ', mp._float64_bytes(rows)
+
+    times = itertools.accumulate(values[1::3])
+    mem = {}
+    for pid, t, delta in zip(values[0::3], times, values[2::3]):
+        mem[pid] = m = mem.get(pid, 0) + delta
+        rows.extend((pid, m / mem_scale, base + t / time_scale))
+    return b'CHLD', mp._float64_bytes(rows)
+
+
+def _expand_delta_chunk_arrays(np, tag, payload):
+    """Same as _expand_delta_chunk, with the varints decoded in bulk."""
+    base, time_scale, mem_scale, data = _split_delta_chunk(payload)
+    header = b''
+    if tag == b'DFUN':
+        header, data = _delta_func_header(data)
+        values = _zigzag_array(np, data).reshape(-1, 5)
+        starts = np.cumsum(values[:, 0])
+        mem_starts = np.cumsum(values[:, 2])
+        rows = np.column_stack((
+            mem_starts / mem_scale, base + starts / time_scale,
+            (mem_starts + values[:, 3]) / mem_scale,
+            base + (starts + values[:, 1]) / time_scale, values[:, 4]))
+        tag = b'FUNC'
+    elif tag == b'DMEM':
+        values = _zigzag_array(np, data).reshape(-1, 2)
+        times = np.cumsum(np.cumsum(values[:, 0]))
+        rows = np.column_stack((np.cumsum(values[:, 1]) / mem_scale,
+                                base + times / time_scale))
+        tag = b'MEM '
+    else:
+        values = _zigzag_array(np, data).reshape(-1, 3)
+        pids = values[:, 0]
+        mem = values[:, 2].copy()
+        for pid in np.unique(pids):
+            selected = pids == pid
+            mem[selected] = np.cumsum(mem[selected])
+        rows = np.column_stack((pids, mem / mem_scale,
+                                base + np.cumsum(values[:, 1]) / time_scale))
+        tag = b'CHLD'
+    return tag, header + rows.astype('<f8').tobytes()
+
+
+def _iter_binary_chunks(f, end=None, np=None):
+    """Yield (offset, tag, payload) for each complete chunk of a binary
+    profile, from the current position of f up to the end offset.
+
+    Chunks of the compact format are expanded to the plain chunks with
+    the same records, using NumPy if the np module is given. A truncated
+    last chunk is left unread.
+    """
+    while end is None or f.tell() < end:
+        offset = f.tell()
+        header = f.read(mp.BINARY_CHUNK_HEADER.size)
+        if len(header) < mp.BINARY_CHUNK_HEADER.size:
+            f.seek(offset)
+            return
+        tag, size = mp.BINARY_CHUNK_HEADER.unpack(header)
+        payload = f.read(size)
+        if len(payload) < size:
+            # truncated chunk, e.g. the profile is still being written
+            f.seek(offset)
+            return
+        if tag in (b'DMEM', b'DCHL', b'DFUN'):
+            if np is None:
+                tag, payload = _expand_delta_chunk(tag, payload)
+            else:
+                tag, payload = _expand_delta_chunk_arrays(np, tag, payload)
+        yield offset, tag, payload
+
+
+def _split_func_chunk(payload):
+    """Return the function name and the float64 rows of a FUNC chunk."""
+    name_len = struct.unpack('<I', payload[:4])[0]
+    f_name = payload[4:4 + name_len].decode('utf-8')
+    offset = 4 + name_len + (-(4 + name_len) % 8)
+    return f_name, payload[offset:]
+
+
+def read_mprofile_binary_file(filename):
+    """Read an mprofile file written in the binary format.
+
+    Returns the same content as read_mprofile_file.
+    """
+    func_ts = {}
+    mem = array('d')
+    chld = array('d')
+    cmd_line = None
+    backend = None
+    with open_profile(filename) as f:
+        f.seek(len(mp.BINARY_MAGIC))
+        for _, tag, payload in _iter_binary_chunks(f):
+            if tag == b'MEM ':
+                mem.extend(_float64_array(payload))
+            elif tag == b'CHLD':
+                chld.extend(_float64_array(payload))
+            elif tag == b'FUNC':
+                f_name, rows = _split_func_chunk(payload)
+                values = _float64_array(rows)
+                ts = func_ts.setdefault(f_name, [])
+                for i in range(0, len(values), 5):
+                    mem_start, start, mem_end, end, level = values[i:i + 5]
+                    ts.append([start, end, mem_start, mem_end, int(level)])
+            elif tag == b'CMDL':
+                cmd_line = payload.rstrip(b'\x00').decode('utf-8')
+            elif tag == b'BKND':
+                backend = payload.rstrip(b'\x00').decode('utf-8')
+
+    children = defaultdict(list)
+    for i in range(0, len(chld), 3):
+        children[str(int(chld[i]))].append((chld[i + 1], chld[i + 2]))
+
+    return {"mem_usage": mem[0::2].tolist(), "timestamp": mem[1::2].tolist(),
+            "func_timestamp": func_ts, 'filename': filename,
+            'cmd_line': cmd_line, 'children': children, 'backend': backend}
+
+
+def _read_binary_arrays(filename, ranges=None, members=None):
+    import numpy as np
+
+    if ranges is None:
+        ranges = [(len(mp.BINARY_MAGIC), None)]
+
+    def chunks(f):
+        for start, end in ranges:
+            f.seek(start)
+            for chunk in _iter_binary_chunks(f, end, np):
+                yield chunk
+
+    with open_profile(filename, members) as f:
+        return _decode_binary_chunks(chunks(f), filename)
+
+
+def _decode_binary_chunks(chunks, filename):
+    import numpy as np
+
+    func_ts = {}
+    mem = []
+    chld = []
+    cmd_line = None
+    backend = None
+    for _, tag, payload in chunks:
+        if tag == b'MEM ':
+            mem.append(np.frombuffer(payload, dtype='<f8'))
+        elif tag == b'CHLD':
+            chld.append(np.frombuffer(payload, dtype='<f8'))
+        elif tag == b'FUNC':
+            f_name, rows = _split_func_chunk(payload)
+            values = np.frombuffer(rows, dtype='<f8').reshape(-1, 5)
+            # stored as mem_start, start, mem_end, end, level
+            values = values[:, [1, 3, 0, 2, 4]].tolist()
+            for row in values:
+                row[4] = int(row[4])
+            func_ts.setdefault(f_name, []).extend(values)
+        elif tag == b'CMDL':
+            cmd_line = payload.rstrip(b'\x00').decode('utf-8')
+        elif tag == b'BKND':
+            backend = payload.rstrip(b'\x00').decode('utf-8')
+
+    mem = np.concatenate(mem).reshape(-1, 2) if mem else np.empty((0, 2))
+    chld = np.concatenate(chld).reshape(-1, 3) if chld else np.empty((0, 3))
+    return {"mem_usage": mem[:, 0], "timestamp": mem[:, 1],
+            "func_timestamp": func_ts, 'filename': filename,
+            'cmd_line': cmd_line, 'children': _group_children(chld),
+            'backend': backend}
+
+
+def _group_children(chld):
+    """Split an (n, 3) array of pid, mem, timestamp rows by pid."""
+    import numpy as np
+
+    children = {}
+    if len(chld) == 0:
+        return children
+    pids, first = np.unique(chld[:, 0], return_index=True)
+    # keep the order in which children first appeared in the file
+    for pid in pids[np.argsort(first)]:
+        children[str(int(pid))] = chld[chld[:, 0] == pid, 1:]
+    return children
+
+
+def _load_columns(np, block, usecols):
+    """Parse the numeric columns of a block of same-tag lines."""
+    if not block:
+        return np.empty((0, len(usecols)))
+    return np.loadtxt(io.BytesIO(block), usecols=usecols, ndmin=2,
+                      comments=None)
+
+
+def _split_text_lines(np, data):
+    """Return the buffer, line starts, line lengths and line tags of data.
+
+    Lines are classified on their first two bytes (ME, CH, FU, CM).
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n'))
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+    if (lengths == 0).any():
+        raise ValueError('Sampling time was too short')
+    # every line has at least one byte plus its newline
+    tags = buf[starts].astype(np.uint16) << 8 | buf[starts + 1]
+    return buf, starts, lengths, tags
+
+
+def _text_tag(tag):
+    return ord(tag[0]) << 8 | ord(tag[1])
+
+
+def _select_lines(np, buf, lengths, selected):
+    """Return the selected lines of buf, joined together."""
+    if not selected.any():
+        return b''
+    return buf[np.repeat(selected, lengths + 1)].tobytes()
+
+
+def _read_text_arrays(filename, ranges=None, members=None):
+    with open_profile(filename, members) as f:
+        if ranges is None:
+            data = f.read()
+        else:
+            pieces = []
+            for start, end in ranges:
+                f.seek(start)
+                pieces.append(f.read(end - start))
+            data = b''.join(pieces)
+    return _parse_text_arrays(data, filename)
+
+
+def _parse_text_arrays(data, filename):
+    import numpy as np
+
+    if data and not data.endswith(b'\n'):
+        data += b'\n'
+
+    # Partition the file by record tag, then parse each block at once
+    buf, starts, lengths, tags = _split_text_lines(np, data)
+
+    def block(tag):
+        return _select_lines(np, buf, lengths, tags == _text_tag(tag))
+
+    mem = _load_columns(np, block('ME'), (1, 2))
+    chld = _load_columns(np, block('CH'), (1, 2, 3))
+
+    func_ts = {}
+    func_block = block('FU')
+    if func_block:
+        lines = func_block.splitlines()
+        names = [l.split(b' ', 2)[1].decode('utf-8') for l in lines]
+        n_fields = len(lines[0].split(b' '))
+        try:
+            values = _load_columns(np, func_block,
+                                   tuple(range(2, n_fields)))
+        except ValueError:
+            # lines with and without the stack level field
+            values = None
+        if values is None:
+            rows = [[float(v) for v in l.split(b' ')[2:]] for l in lines]
+        else:
+            rows = values.tolist()
+        for f_name, row in zip(names, rows):
+            mem_start, start, mem_end, end = row[:4]
+            to_append = [start, end, mem_start, mem_end]
+            if len(row) >= 5:
+                # There is a stack level field
+                to_append.append(int(row[4]))
+            func_ts.setdefault(f_name, []).append(to_append)
+
+    cmd_line = None
+    cmd_block = block('CM')
+    if cmd_block:
+        cmd_line = cmd_block.decode('utf-8').splitlines(True)[-1]
+        cmd_line = cmd_line.split(' ', 1)[1]
+
+    return {"mem_usage": mem[:, 0], "timestamp": mem[:, 1],
+            "func_timestamp": func_ts, 'filename': filename,
+            'cmd_line': cmd_line, 'children': _group_children(chld)}
+
+
+# Byte distance between two entries of a profile index
+_INDEX_STRIDE = 1 << 16
+
+
+def _profile_start(mem_start, func_ts):
+    """Return the first timestamp of a profile, the origin of plots."""
+    starts = [v[0] for values in func_ts.values() for v in values]
+    if mem_start is not None:
+        starts.append(mem_start)
+    return min(starts) if starts else None
+
+
+def _merge_ranges(starts, ends):
+    """Merge contiguous [start, end) byte ranges."""
+    ranges = []
+    for start, end in zip(starts, ends):
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def _sparse_index(np, offsets, first_ts, last_ts):
+    """Keep about one record every _INDEX_STRIDE bytes.
+
+    Records are sample lines or chunks, sorted by offset, and carry the
+    timestamps of their first and last samples. MEM and CHLD records are
+    interleaved, so timestamps are not sorted. Each entry stores the
+    largest timestamp found before it and the smallest one found after
+    it, both sorted, which bound where a time window can start and end.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keep = np.ones(len(offsets), dtype=bool)
+    keep[1:] = np.diff(offsets // _INDEX_STRIDE) > 0
+    max_before = np.empty(len(offsets))
+    max_before[:1] = -np.inf
+    max_before[1:] = np.maximum.accumulate(np.asarray(last_ts))[:-1]
+    min_after = np.minimum.accumulate(np.asarray(first_ts)[::-1])[::-1]
+    return offsets[keep], max_before[keep], min_after[keep]
+
+
+def _build_text_index(np, f):
+    data = f.read()
+    # ignore a partially written last line
+    data = data[:data.rfind(b'\n') + 1]
+    buf, starts, lengths, tags = _split_text_lines(np, data)
+
+    is_mem = tags == _text_tag('ME')
+    is_chld = tags == _text_tag('CH')
+    is_sample = is_mem | is_chld
+    timestamps = np.empty(len(starts))
+    timestamps[is_mem] = _load_columns(
+        np, _select_lines(np, buf, lengths, is_mem), (2,))[:, 0]
+    timestamps[is_chld] = _load_columns(
+        np, _select_lines(np, buf, lengths, is_chld), (3,))[:, 0]
+    timestamps = timestamps[is_sample]
+    entries = _sparse_index(np, starts[is_sample], timestamps, timestamps)
+
+    extra = np.flatnonzero(~is_sample)
+    ranges = _merge_ranges(starts[extra].tolist(),
+                           (starts[extra] + lengths[extra] + 1).tolist())
+
+    mem_start = None
+    if is_mem.any():
+        mem_start = timestamps[np.flatnonzero(is_mem[is_sample])[0]]
+    func_ts = {}
+    for i in np.flatnonzero(tags == _text_tag('FU')).tolist():
+        o = int(starts[i])
+        values = data[o:o + int(lengths[i])].split(b' ')
+        func_ts.setdefault(values[1], []).append([float(values[3])])
+    return entries, ranges, _profile_start(mem_start, func_ts)
+
+
+def _build_binary_index(np, f):
+    offsets = []
+    first_ts = []
+    last_ts = []
+    extra_starts = []
+    extra_ends = []
+    mem_start = None
+    func_ts = {}
+    f.seek(len(mp.BINARY_MAGIC))
+    for offset, tag, payload in _iter_binary_chunks(f, np=np):
+        if tag in (b'MEM ', b'CHLD'):
+            # rows of (mem, ts) or (pid, mem, ts)
+            width = 2 if tag == b'MEM ' else 3
+            timestamps = _float64_array(payload)[width - 1::width]
+            if not timestamps:
+                continue
+            if tag == b'MEM ' and mem_start is None:
+                mem_start = timestamps[0]
+            offsets.append(offset)
+            first_ts.append(min(timestamps))
+            last_ts.append(max(timestamps))
+        else:
+            extra_starts.append(offset)
+            extra_ends.append(f.tell())
+            if tag == b'FUNC':
+                f_name, rows = _split_func_chunk(payload)
+                starts = _float64_array(rows)[1::5]
+                func_ts[f_name] = [[start] for start in starts]
+    return (_sparse_index(np, offsets, first_ts, last_ts),
+            _merge_ranges(extra_starts, extra_ends),
+            _profile_start(mem_start, func_ts))
+
+
+def _index_filename(filename):
+    return filename + '.idx'
+
+
+def _load_profile_index(filename):
+    """Return the sparse timestamp to byte offset index of a profile.
+
+    The index is built on first use and cached next to the profile, in
+    a file with an additional .idx extension. It is rebuilt whenever the
+    profile changes. Offsets are those of the decompressed content of
+    compressed profiles, whose table of members is kept in the index so
+    that a window is read without decompressing the whole profile.
+    """
+    import numpy as np
+
+    st = os.stat(filename)
+    info = np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+    index_filename = _index_filename(filename)
+    try:
+        with np.load(index_filename) as index:
+            if (np.array_equal(index['info'], info)
+                    and 'members' in index.files):
+                return {k: index[k] for k in index.files}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with open_profile(filename) as f:
+        if f.read(len(mp.BINARY_MAGIC)) == mp.BINARY_MAGIC:
+            entries, ranges, start = _build_binary_index(np, f)
+        else:
+            f.seek(0)
+            entries, ranges, start = _build_text_index(np, f)
+        size = f.seek(0, io.SEEK_END)
+        members = getattr(f.raw, 'members', [])
+    index = {
+        'info': info,
+        'size': np.asarray(size),
+        'members': np.asarray(members, dtype=np.int64).reshape(-1, 2),
+        'offsets': entries[0],
+        'max_before': entries[1],
+        'min_after': entries[2],
+        'extra': np.asarray(ranges, dtype=np.int64).reshape(-1, 2),
+        'start': np.asarray(np.nan if start is None else start),
+    }
+    try:
+        tmp_filename = index_filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, **index)
+        os.replace(tmp_filename, index_filename)
+    except OSError:
+        # e.g. read-only directory, the index is only a cache
+        pass
+    return index
+
+
+def _read_window_arrays(filename, window):
+    import numpy as np
+
+    index = _load_profile_index(filename)
+    start = float(index['start'])
+    if np.isnan(start):
+        start = None
+    lo = hi = None
+    ranges = [tuple(r) for r in index['extra'].tolist()]
+    if start is not None and len(index['offsets']):
+        lo, hi = start + window[0], start + window[1]
+        offsets = index['offsets']
+        # last entry with every earlier sample before the window, and
+        # first entry with every later sample after it
+        i = max(np.searchsorted(index['max_before'], lo, 'left') - 1, 0)
+        j = np.searchsorted(index['min_after'], hi, 'right')
+        lo_offset = int(offsets[i])
+        hi_offset = int(offsets[j]) if j < len(offsets) else int(index['size'])
+        ranges = [(s, e) for s, e in ranges if e <= lo_offset or s >= hi_offset]
+        ranges.append((lo_offset, hi_offset))
+        ranges.sort()
+
+    members = index['members'] if len(index['members']) else None
+    if is_binary_mprofile(filename):
+        prof = _read_binary_arrays(filename, ranges, members)
+    else:
+        prof = _read_text_arrays(filename, ranges, members)
+    prof['start'] = start
+    if lo is None:
+        return prof
+
+    t = prof['timestamp']
+    selected = (t >= lo) & (t <= hi)
+    prof['mem_usage'] = prof['mem_usage'][selected]
+    prof['timestamp'] = t[selected]
+    for pid, values in list(prof['children'].items()):
+        values = values[(values[:, 1] >= lo) & (values[:, 1] <= hi)]
+        if len(values):
+            prof['children'][pid] = values
+        else:
+            del prof['children'][pid]
+    for f_name, values in list(prof['func_timestamp'].items()):
+        values = [v for v in values if v[0] <= hi and v[1] >= lo]
+        if values:
+            prof['func_timestamp'][f_name] = values
+        else:
+            del prof['func_timestamp'][f_name]
+    return prof
+
+
+def read_mprofile_arrays(filename, window=None):
+    """Read an mprofile file into NumPy arrays.
+
+    Each record type is parsed in bulk instead of line by line. For text
+    profiles, converting the numbers dominates and the gain is modest
+    (about 1.4x); binary profiles are decoded with np.frombuffer and load
+    an order of magnitude faster. Both formats are supported, compressed
+    or not.
+
+    Parameters
+    ==========
+    window: tuple with 2 values, optional
+        only read the records between these times, in seconds since the
+        start of the profile. A sparse index is used to seek directly to
+        them, see _load_profile_index.
 
     Returns
     =======
     content: dict
-        Keys:
-
-        - "mem_usage": (list) memory usage values, in MiB
-        - "timestamp": (list) time instant for each memory usage value, in
-            second
-        - "func_timestamp": (dict) for each function, timestamps and memory
-            usage upon entering and exiting.
-        - 'cmd_line': (str) command-line ran for this profile.
+        Same keys as read_mprofile_file, except that "mem_usage" and
+        "timestamp" are 1-D float arrays, and "children" maps each child
+        pid to an (n, 2) array of memory usage and timestamp rows.
     """
+    if window is not None:
+        return _read_window_arrays(filename, window)
+    if is_binary_mprofile(filename):
+        prof = _read_binary_arrays(filename)
+    else:
+        prof = _read_text_arrays(filename)
+    mem_start = prof['timestamp'][0] if len(prof['timestamp']) else None
+    prof['start'] = _profile_start(mem_start, prof['func_timestamp'])
+    return prof
+
+
+def _read_mprofile_text_file(filename):
     func_ts = {}
     mem_usage = []
     timestamp = []
     children  = defaultdict(list)
     cmd_line = None
-    f = open(filename, "r")
+    f = io.TextIOWrapper(open_profile(filename), encoding="utf-8")
     for l in f:
         if l == '\n':
             raise ValueError('Sampling time was too short')
@@ -398,6 +1276,122 @@ def read_mprofile_file(filename):
             'cmd_line': cmd_line, 'children': children}
 
 
+def read_mprofile_file(filename, window=None):
+    """Read an mprofile file and return its content.
+
+    Both the text and the binary formats are supported, compressed or
+    not (see memory_profiler.PROFILE_COMPRESSIONS). This is a
+    list-based view over read_mprofile_arrays, which is used directly
+    when NumPy is available.
+
+    Parameters
+    ==========
+    window: tuple with 2 values, optional
+        only return the records between these times, in seconds since
+        the start of the profile.
+
+    Returns
+    =======
+    content: dict
+        Keys:
+
+        - "mem_usage": (list) memory usage values, in MiB
+        - "timestamp": (list) time instant for each memory usage value, in
+            second
+        - "func_timestamp": (dict) for each function, timestamps and memory
+            usage upon entering and exiting.
+        - 'cmd_line': (str) command-line ran for this profile.
+        - 'start': (float) first timestamp of the profile, the origin of
+            the window.
+    """
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        if is_binary_mprofile(filename):
+            prof = read_mprofile_binary_file(filename)
+        else:
+            prof = _read_mprofile_text_file(filename)
+        return _clip_mprofile(prof, window)
+
+    prof = read_mprofile_arrays(filename, window=window)
+    prof["mem_usage"] = prof["mem_usage"].tolist()
+    prof["timestamp"] = prof["timestamp"].tolist()
+    children = defaultdict(list)
+    for pid, values in prof["children"].items():
+        children[pid] = [tuple(row) for row in values.tolist()]
+    prof["children"] = children
+    return prof
+
+
+def _clip_mprofile(prof, window):
+    """Restrict a list-based profile to a time window, without NumPy."""
+    mem_start = prof["timestamp"][0] if prof["timestamp"] else None
+    prof["start"] = _profile_start(mem_start, prof["func_timestamp"])
+    if window is None or prof["start"] is None:
+        return prof
+    lo, hi = prof["start"] + window[0], prof["start"] + window[1]
+    samples = [(m, t) for m, t in zip(prof["mem_usage"], prof["timestamp"])
+               if lo <= t <= hi]
+    prof["mem_usage"] = [m for m, _ in samples]
+    prof["timestamp"] = [t for _, t in samples]
+    children = defaultdict(list)
+    for pid, values in prof["children"].items():
+        values = [v for v in values if lo <= v[1] <= hi]
+        if values:
+            children[pid] = values
+    prof["children"] = children
+    func_ts = {}
+    for f_name, values in prof["func_timestamp"].items():
+        values = [v for v in values if v[0] <= hi and v[1] >= lo]
+        if values:
+            func_ts[f_name] = values
+    prof["func_timestamp"] = func_ts
+    return prof
+
+
+def downsample(x, y, max_points):
+    """Reduce a series to at most max_points points for plotting.
+
+    The series is split into buckets of consecutive points and only the
+    minimum and the maximum of each bucket, plus both ends of the series,
+    are kept in their original order, so that peaks remain visible.
+    """
+    import numpy as np
+
+    n = len(y)
+    n_buckets = max((max_points - 2) // 2, 1)
+    if n <= max_points or n <= 2:
+        return x, y
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+    # pad the last bucket with its last value
+    padded = np.empty(n_buckets * size)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    padded = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    keep = np.concatenate((offsets + padded.argmin(axis=1),
+                           offsets + padded.argmax(axis=1), [0, n - 1]))
+    keep = np.unique(np.minimum(keep, n - 1))
+    return x[keep], y[keep]
+
+
+def plot_max_points(options):
+    """Return the number of points to plot per series, or None for all.
+
+    Defaults to two points per horizontal pixel of the current axes.
+    """
+    if getattr(options, 'no_downsample', False):
+        return None
+    max_points = getattr(options, 'max_points', None)
+    if max_points is not None:
+        return max_points
+    import pylab as pl
+    fig = pl.gcf()
+    width = fig.get_figwidth() * fig.dpi * pl.gca().get_position().width
+    return 2 * int(width)
+
+
 def plot_file(filename, index=0, timestamps=True, children=True, options=None):
     try:
         import pylab as pl
@@ -406,7 +1400,8 @@ def plot_file(filename, index=0, timestamps=True, children=True, options=None):
         print(e)
         sys.exit(1)
     import numpy as np  # pylab requires numpy anyway
-    mprofile = read_mprofile_file(filename)
+    window = getattr(options, 'xlim', None)
+    mprofile = read_mprofile_arrays(filename, window=window)
 
     if len(mprofile['timestamp']) == 0:
         print('** No memory usage values have been found in the profile '
@@ -423,19 +1418,17 @@ def plot_file(filename, index=0, timestamps=True, children=True, options=None):
     chld = mprofile['children']
 
     if len(ts) > 0:
-        for values in ts.values():
-            for v in values:
-                t.extend(v[:2])
-                mem.extend(v[2:4])
+        func_values = np.asarray([v[:4] for values in ts.values()
+                                  for v in values])
+        t = np.concatenate((t, func_values[:, :2].ravel()))
+        mem = np.concatenate((mem, func_values[:, 2:4].ravel()))
 
-    mem = np.asarray(mem)
-    t = np.asarray(t)
     ind = t.argsort()
     mem = mem[ind]
     t = t[ind]
 
     # Plot curves
-    global_start = float(t[0])
+    global_start = mprofile['start']
     t = t - global_start
 
     max_mem = mem.max()
@@ -446,9 +1439,7 @@ def plot_file(filename, index=0, timestamps=True, children=True, options=None):
 
     show_trend_slope = options is not None and hasattr(options, 'slope') and options.slope is True
 
-    mem_line_label = time.strftime("%d / %m / %Y - start at %H:%M:%S",
-                                   time.localtime(global_start)) \
-                     + ".{0:03d}".format(int(round(math.modf(global_start)[0] * 1000)))
+    mem_line_label = _start_label(global_start)
 
     mem_trend = None
     if show_trend_slope:
@@ -458,7 +1449,13 @@ def plot_file(filename, index=0, timestamps=True, children=True, options=None):
         # Append slope to label
         mem_line_label = mem_line_label + " slope {0:.5f}".format(mem_trend[0])
 
-    pl.plot(t, mem, "+-" + mem_line_colors[index % len(mem_line_colors)],
+    # peaks and trends use all the samples, only the curves are reduced
+    max_points = plot_max_points(options)
+    if max_points is not None:
+        plot_t, plot_mem = downsample(t, mem, max_points)
+    else:
+        plot_t, plot_mem = t, mem
+    pl.plot(plot_t, plot_mem, "+-" + mem_line_colors[index % len(mem_line_colors)],
             label=mem_line_label)
 
     if show_trend_slope:
@@ -474,9 +1471,9 @@ def plot_file(filename, index=0, timestamps=True, children=True, options=None):
         cmpoint = (0,0) # maximal child memory
 
         for idx, (proc, data) in enumerate(chld.items()):
-            # Create the numpy arrays from the series data
-            cts  = np.asarray([item[1] for item in data]) - global_start
-            cmem = np.asarray([item[0] for item in data])
+            # Split the series data into time and memory columns
+            cts  = data[:, 1] - global_start
+            cmem = data[:, 0]
 
             cmem_trend = None
             child_mem_trend_label = ""
@@ -487,7 +1484,11 @@ def plot_file(filename, index=0, timestamps=True, children=True, options=None):
                 child_mem_trend_label = " slope {0:.5f}".format(cmem_trend[0])
 
             # Plot the line to the figure
-            pl.plot(cts, cmem, "+-" + mem_line_colors[(idx + 1) % len(mem_line_colors)],
+            if max_points is not None:
+                plot_cts, plot_cmem = downsample(cts, cmem, max_points)
+            else:
+                plot_cts, plot_cmem = cts, cmem
+            pl.plot(plot_cts, plot_cmem, "+-" + mem_line_colors[(idx + 1) % len(mem_line_colors)],
                     label="child {}{}".format(proc, child_mem_trend_label))
 
             if show_trend_slope:
@@ -525,6 +1526,251 @@ def plot_file(filename, index=0, timestamps=True, children=True, options=None):
 
 
 
+class ProfileTail(object):
+    """Read the records appended to a profile since the previous read.
+
+    The file is kept open and only the new bytes are parsed, so following
+    a profile that is still being written does not get slower as it
+    grows. Incomplete lines or chunks, and incomplete members of
+    compressed profiles, are kept for the next read.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.binary = None
+        self.buffer = b''
+        # .. None until known, False for uncompressed profiles ..
+        self.decompressobj = None
+        self.compressed = b''
+
+    def close(self):
+        self.file.close()
+
+    def _read_new(self):
+        data = self.file.read()
+        if self.decompressobj is None:
+            self.compressed += data
+            head = self.compressed
+            if any(len(head) < len(magic) and magic.startswith(head)
+                   for _, _, magic in mp.PROFILE_COMPRESSIONS):
+                return b''
+            compression = _compression_of(head)
+            self.decompressobj = False
+            if compression is not None:
+                self.decompressobj = mp.profile_codec(compression)[1]
+            data, self.compressed = self.compressed, b''
+        if self.decompressobj:
+            self.compressed += data
+            data, consumed = _decompress_members(self.decompressobj,
+                                                 self.compressed)
+            self.compressed = self.compressed[consumed:]
+        return data
+
+    def read(self):
+        """Return the new complete records, in the format of
+        read_mprofile_arrays, or None if there are none."""
+        self.buffer += self._read_new()
+        if self.binary is None:
+            magic = mp.BINARY_MAGIC
+            if len(self.buffer) < len(magic) and magic.startswith(self.buffer):
+                return None
+            self.binary = self.buffer.startswith(magic)
+            if self.binary:
+                self.buffer = self.buffer[len(magic):]
+
+        if self.binary:
+            f = io.BytesIO(self.buffer)
+            import numpy as np
+            chunks = list(_iter_binary_chunks(f, np=np))
+            if not chunks:
+                return None
+            consumed = f.tell()
+            prof = _decode_binary_chunks(chunks, self.filename)
+        else:
+            consumed = self.buffer.rfind(b'\n') + 1
+            if not consumed:
+                return None
+            prof = _parse_text_arrays(self.buffer[:consumed], self.filename)
+        self.buffer = self.buffer[consumed:]
+        return prof
+
+
+class MinMaxSeries(object):
+    """A growing series, downsampled as it grows for live plots.
+
+    Samples are grouped in buckets of consecutive samples, of which only
+    the minimum and the maximum are kept, as in downsample. When there
+    are more than max_points points, pairs of buckets are merged and the
+    bucket size doubles, so that adding samples only costs in proportion
+    to their number. With max_points=None, every sample is kept.
+    """
+
+    def __init__(self, max_points=None):
+        import numpy as np
+
+        self.max_buckets = None
+        if max_points is not None:
+            self.max_buckets = max((max_points - 2) // 2, 1)
+        self.size = 1
+        # two rows of (time, value) per complete bucket
+        self.points = np.empty((0, 2))
+        # samples of the last, incomplete bucket
+        self.pending = np.empty((0, 2))
+        self.peak = None
+
+    @staticmethod
+    def _min_max(buckets):
+        import numpy as np
+
+        values = buckets[:, :, 1]
+        rows = np.arange(len(buckets))
+        first = np.minimum(values.argmin(axis=1), values.argmax(axis=1))
+        last = np.maximum(values.argmin(axis=1), values.argmax(axis=1))
+        return np.stack((buckets[rows, first], buckets[rows, last]),
+                        axis=1).reshape(-1, 2)
+
+    def extend(self, t, values):
+        import numpy as np
+
+        if len(values) == 0:
+            return
+        new = np.column_stack((t, values))
+        i = np.argmax(values)
+        if self.peak is None or values[i] > self.peak[1]:
+            self.peak = (t[i], values[i])
+        if self.max_buckets is None:
+            self.points = np.concatenate((self.points, new))
+            return
+
+        data = np.concatenate((self.pending, new))
+        n_full = len(data) // self.size
+        full = data[:n_full * self.size].reshape(n_full, self.size, 2)
+        self.points = np.concatenate((self.points, self._min_max(full)))
+        self.pending = data[n_full * self.size:]
+        while len(self.points) > 2 * self.max_buckets:
+            # with an odd number of buckets the last one is kept as is
+            n_pairs = len(self.points) // 4
+            merged = self._min_max(
+                self.points[:4 * n_pairs].reshape(n_pairs, 4, 2))
+            self.points = np.concatenate((merged, self.points[4 * n_pairs:]))
+            self.size *= 2
+
+    def data(self):
+        """Return the times and values to plot."""
+        import numpy as np
+
+        points = np.concatenate((self.points, self.pending))
+        return points[:, 0], points[:, 1]
+
+
+def _start_label(global_start):
+    """Label of the memory line of a profile starting at global_start."""
+    return time.strftime("%d / %m / %Y - start at %H:%M:%S",
+                         time.localtime(global_start)) \
+        + ".{0:03d}".format(int(round(math.modf(global_start)[0] * 1000)))
+
+
+def follow_file(filename, index=0, options=None, refresh=1.):
+    """Plot a profile while it is being written.
+
+    The plot is refreshed every `refresh` seconds until the figure is
+    closed. Only the bytes appended since the previous refresh are
+    parsed, and the existing lines are updated in place. Function calls
+    are bracketed as the profiled program writes them.
+
+    Times are relative to the same origin as in plot_file, the first
+    sample or function call: if a call written later started before it,
+    the plot is shifted to the new origin.
+    """
+    import pylab as pl
+
+    mem_line_colors = ("k", "b", "r", "g", "c", "y", "m")
+    all_colors = ("c", "y", "g", "r", "b")
+    show_functions = options is not None and not getattr(options, 'no_timestamps', False)
+    func_colors = {}
+    max_points = plot_max_points(options)
+    fig = pl.gcf()
+    ax = pl.gca()
+    scalex = getattr(options, 'xlim', None) is None
+
+    tail = ProfileTail(filename)
+    series = MinMaxSeries(max_points)
+    line, = ax.plot([], [], "+-" + mem_line_colors[index % len(mem_line_colors)])
+    children = {}
+    peak_lines = None
+    mem_start = None
+    global_start = None
+    calls = []
+    bracket_lines = []
+    try:
+        while pl.fignum_exists(fig.number):
+            prof = tail.read()
+            if prof is None:
+                pl.pause(refresh)
+                continue
+            if prof['cmd_line'] and getattr(options, 'title', None) is None:
+                ax.set_title(prof['cmd_line'])
+            if mem_start is None and len(prof['timestamp']):
+                mem_start = float(prof['timestamp'][0])
+            new_calls = [(f_name, call)
+                         for f_name, values in prof['func_timestamp'].items()
+                         for call in values]
+            calls.extend(new_calls)
+            start = _profile_start(mem_start, prof['func_timestamp'])
+            if start is not None and (global_start is None or start < global_start):
+                # .. a new origin, the existing brackets are drawn again ..
+                global_start = start
+                line.set_label(_start_label(global_start))
+                for bracket in bracket_lines:
+                    bracket.remove()
+                bracket_lines = []
+                new_calls = calls
+            if global_start is None:
+                pl.pause(refresh)
+                continue
+
+            series.extend(prof['timestamp'], prof['mem_usage'])
+            t, mem = series.data()
+            line.set_data(t - global_start, mem)
+            for proc, data in prof['children'].items():
+                if proc not in children:
+                    color = mem_line_colors[(len(children) + index + 1) % len(mem_line_colors)]
+                    child_line, = ax.plot([], [], "+-" + color,
+                                          label="child {}".format(proc))
+                    children[proc] = (MinMaxSeries(max_points), child_line)
+                children[proc][0].extend(data[:, 1], data[:, 0])
+            for child_series, child_line in children.values():
+                t, mem = child_series.data()
+                child_line.set_data(t - global_start, mem)
+
+            if series.peak is not None:
+                peak_t, peak_mem = series.peak
+                peak_t -= global_start
+                if peak_lines is None:
+                    peak_lines = (ax.axhline(peak_mem, color="r", linestyle="--"),
+                                  ax.axvline(peak_t, color="r", linestyle="--"))
+                else:
+                    peak_lines[0].set_ydata([peak_mem, peak_mem])
+                    peak_lines[1].set_xdata([peak_t, peak_t])
+            ax.relim()
+            ax.autoscale_view(scalex=scalex)
+            if show_functions:
+                n_lines = len(ax.lines)
+                for f_name, call in new_calls:
+                    if f_name not in func_colors:
+                        func_colors[f_name] = all_colors[len(func_colors) % len(all_colors)]
+                    add_brackets(call[:2], call[2:], xshift=global_start,
+                                 color=func_colors[f_name],
+                                 label=f_name + " %.3fs" % (call[1] - call[0]),
+                                 options=options)
+                bracket_lines.extend(ax.lines[n_lines:])
+            ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+            pl.pause(refresh)
+    finally:
+        tail.close()
+
+
 FLAME_PLOTTER_VARS = {
     'hovered_rect': None,
     'hovered_text': None,
@@ -539,7 +1785,8 @@ def flame_plotter(filename, index=0, timestamps=True, children=True, options=Non
         print(e)
         sys.exit(1)
     import numpy as np  # pylab requires numpy anyway
-    mprofile = read_mprofile_file(filename)
+    window = getattr(options, 'xlim', None)
+    mprofile = read_mprofile_arrays(filename, window=window)
 
     if len(mprofile['timestamp']) == 0:
         print('** No memory usage values have been found in the profile '
@@ -556,13 +1803,11 @@ def flame_plotter(filename, index=0, timestamps=True, children=True, options=Non
     chld = mprofile['children']
 
     if len(ts) > 0:
-        for values in ts.values():
-            for v in values:
-                t.extend(v[:2])
-                mem.extend(v[2:4])
+        func_values = np.asarray([v[:4] for values in ts.values()
+                                  for v in values])
+        t = np.concatenate((t, func_values[:, :2].ravel()))
+        mem = np.concatenate((mem, func_values[:, 2:4].ravel()))
 
-    mem = np.asarray(mem)
-    t = np.asarray(t)
     ind = t.argsort()
     mem = mem[ind]
     t = t[ind]
@@ -582,7 +1827,7 @@ def flame_plotter(filename, index=0, timestamps=True, children=True, options=Non
     ]
 
     # Plot curves
-    global_start = float(t[0])
+    global_start = mprofile['start']
     t = t - global_start
 
     max_mem = mem.max()
@@ -590,11 +1835,14 @@ def flame_plotter(filename, index=0, timestamps=True, children=True, options=Non
 
     # cmap = pl.cm.get_cmap('gist_rainbow')
     mem_line_colors = ("k", "b", "r", "g", "c", "y", "m")
-    mem_line_label = time.strftime("%d / %m / %Y - start at %H:%M:%S",
-                                   time.localtime(global_start)) \
-                     + ".{0:03d}".format(int(round(math.modf(global_start)[0] * 1000)))
+    mem_line_label = _start_label(global_start)
 
-    pl.plot(t, mem, "-" + mem_line_colors[index % len(mem_line_colors)],
+    max_points = plot_max_points(options)
+    if max_points is not None:
+        plot_t, plot_mem = downsample(t, mem, max_points)
+    else:
+        plot_t, plot_mem = t, mem
+    pl.plot(plot_t, plot_mem, "-" + mem_line_colors[index % len(mem_line_colors)],
             label=mem_line_label)
 
     bottom, top = pl.ylim()
@@ -613,12 +1861,16 @@ def flame_plotter(filename, index=0, timestamps=True, children=True, options=Non
         cmpoint = (0,0) # maximal child memory
 
         for idx, (proc, data) in enumerate(chld.items()):
-            # Create the numpy arrays from the series data
-            cts  = np.asarray([item[1] for item in data]) - global_start
-            cmem = np.asarray([item[0] for item in data])
+            # Split the series data into time and memory columns
+            cts  = data[:, 1] - global_start
+            cmem = data[:, 0]
 
             # Plot the line to the figure
-            pl.plot(cts, cmem, "+-"  + mem_line_colors[(idx+1) % len(mem_line_colors)],
+            if max_points is not None:
+                plot_cts, plot_cmem = downsample(cts, cmem, max_points)
+            else:
+                plot_cts, plot_cmem = cts, cmem
+            pl.plot(plot_cts, plot_cmem, "+-"  + mem_line_colors[(idx+1) % len(mem_line_colors)],
                      label="child {}".format(proc))
 
             # Detect the maximal child memory point
@@ -782,6 +2034,18 @@ such file in the current directory."""
                         help="Plot a trend line and its numerical slope")
     parser.add_argument("--backend",
                       help="Specify the Matplotlib backend to use")
+    parser.add_argument("--max-points", dest="max_points", type=int,
+                        help="Plot at most this many points per curve, keeping the "
+                             "minimum and maximum of each group of samples. "
+                             "Defaults to two points per horizontal pixel")
+    parser.add_argument("--no-downsample", dest="no_downsample", action="store_true",
+                        help="Plot every sample, however long the profile")
+    parser.add_argument("--follow", dest="follow", action="store_true",
+                        help="Keep plotting the profile while it is being written, "
+                             "until the window is closed")
+    parser.add_argument("--refresh", dest="refresh", type=float, default=1.,
+                        help="Seconds between two updates of the plot with --follow "
+                             "(default 1)")
     parser.add_argument("profiles", nargs="*",
                         help="profiles made by mprof run")
     args = parser.parse_args()
@@ -799,6 +2063,9 @@ such file in the current directory."""
     pl.ioff()
 
     filenames = get_profiles(args)
+    if args.follow and (len(filenames) > 1 or args.flame_mode or args.output):
+        parser.error("--follow shows a single profile on screen, "
+                     "it can not be used with --flame or --output")
 
     fig = pl.figure(figsize=(14, 6), dpi=90)
     if not args.flame_mode:
@@ -808,6 +2075,15 @@ such file in the current directory."""
     if args.xlim is not None:
         pl.xlim(args.xlim[0], args.xlim[1])
 
+    if args.follow:
+        pl.xlabel("time (in seconds)")
+        pl.ylabel("memory used (in MiB)")
+        if args.title is not None:
+            pl.title(args.title)
+        pl.grid()
+        follow_file(filenames[0], options=args, refresh=args.refresh)
+        return
+
     if len(filenames) > 1 or args.no_timestamps:
         timestamps = False
     else:
@@ -838,6 +2114,80 @@ such file in the current directory."""
     else:
         pl.show()
 
+def _merge_intervals(np, intervals):
+    """Merge overlapping [start, end] intervals, sorted by start."""
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+    # a new group starts where the interval begins after all previous ends
+    ends = np.maximum.accumulate(intervals[:, 1])
+    new_group = np.ones(len(intervals), dtype=bool)
+    new_group[1:] = intervals[1:, 0] > ends[:-1]
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.append(group_starts[1:], len(intervals)) - 1
+    return np.column_stack((intervals[group_starts, 0], ends[group_ends]))
+
+
+def function_index(prof, functions=None):
+    """Index the samples of a profile by the function running at that time.
+
+    The samples are sorted by time and the calls of each function are
+    merged into disjoint ranges, so that the samples of a function are
+    found with a binary search per range instead of a scan of every
+    sample for every call. Only the given functions are indexed if
+    functions is not None.
+
+    Returns
+    =======
+    index: dict
+        Keys "timestamp" and "mem_usage" (sorted arrays) and "functions",
+        mapping each function name to its merged (start, end) ranges and
+        its number of calls.
+    """
+    import numpy as np
+
+    t = np.asarray(prof["timestamp"], dtype=float)
+    mem = np.asarray(prof["mem_usage"], dtype=float)
+    order = np.argsort(t, kind='stable')
+    if functions is None:
+        functions = prof["func_timestamp"]
+    ranges = {}
+    for f_name in functions:
+        calls = prof["func_timestamp"][f_name]
+        intervals = np.asarray([call[:2] for call in calls], dtype=float)
+        ranges[f_name] = (_merge_intervals(np, intervals.reshape(-1, 2)),
+                          len(calls))
+    return {"timestamp": t[order], "mem_usage": mem[order],
+            "functions": ranges}
+
+
+def function_samples(index, func):
+    """Return the memory samples taken while func was running."""
+    import numpy as np
+
+    if func not in index["functions"]:
+        raise ValueError(str(func) + " was not found.")
+    ranges, _ = index["functions"][func]
+    t = index["timestamp"]
+    first = np.searchsorted(t, ranges[:, 0], 'left')
+    last = np.searchsorted(t, ranges[:, 1], 'right')
+    # ranges are disjoint, so are the [first, last) slices
+    in_func = np.zeros(len(t) + 1, dtype=np.int64)
+    np.add.at(in_func, first, 1)
+    np.add.at(in_func, last, -1)
+    return index["mem_usage"][np.cumsum(in_func[:-1]) > 0]
+
+
+def function_stats(index, func):
+    """Return the peak and mean memory usage while func was running, in
+    MiB, the time spent in it, in seconds, and its number of calls."""
+    ranges, calls = index["functions"][func]
+    samples = function_samples(index, func)
+    nan = float('nan')
+    return {"peak": float(samples.max()) if len(samples) else nan,
+            "mean": float(samples.mean()) if len(samples) else nan,
+            "time": float((ranges[:, 1] - ranges[:, 0]).sum()),
+            "calls": calls, "samples": len(samples)}
+
+
 def filter_mprofile_mem_usage_by_function(prof, func):
     if func is None:
         return prof["mem_usage"]
@@ -845,6 +2195,13 @@ def filter_mprofile_mem_usage_by_function(prof, func):
     if func not in prof["func_timestamp"]:
         raise ValueError(str(func) + " was not found.")
 
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        return function_samples(function_index(prof, [func]), func).tolist()
+
     time_ranges = prof["func_timestamp"][func]
     filtered_memory = []
     
@@ -855,6 +2212,7 @@ def filter_mprofile_mem_usage_by_function(prof, func):
         for rng in time_ranges:
             if rng[0] <= ts <= rng[1]:
                 filtered_memory.append(mib)
+                break
 
     return filtered_memory
 
@@ -867,6 +2225,9 @@ such file in the current directory."""
                     help="profiles made by mprof run")
     parser.add_argument("--func", dest="func", default=None,
                         help="""Show the peak for this function. Does not support child processes.""")
+    parser.add_argument("--functions", dest="functions", action="store_true",
+                        help="""Also show the peak and mean memory usage, the time spent
+and the number of calls of every profiled function.""")
     args = parser.parse_args()
     filenames = get_profiles(args)
 
@@ -875,6 +2236,8 @@ such file in the current directory."""
         try:
             mem_usage = filter_mprofile_mem_usage_by_function(prof, args.func)
         except ValueError:
+            mem_usage = []
+        if not mem_usage:
             print("{}\tNaN MiB".format(prof["filename"]))
             continue
 
@@ -882,11 +2245,23 @@ such file in the current directory."""
         for child, values in prof["children"].items():
             child_peak = max([ mem_ts[0] for mem_ts in values ])
             print("  Child {}\t\t\t{:.3f} MiB".format(child, child_peak))
+
+        if args.functions and prof["func_timestamp"]:
+            try:
+                index = function_index(prof)
+            except ImportError:
+                print("  --functions requires numpy: pip install numpy")
+                continue
+            for func in sorted(index["functions"]):
+                stats = function_stats(index, func)
+                print("  {}\tpeak {:.3f} MiB\tmean {:.3f} MiB\t"
+                      "time {:.3f} s\tcalls {}".format(
+                          func, stats["peak"], stats["mean"],
+                          stats["time"], stats["calls"]))
         
 
 def get_profiles(args):
-    profiles = glob.glob("mprofile_??????????????.dat")
-    profiles.sort()
+    profiles = _existing_profiles()
 
     if len(args.profiles) == 0:
         if len(profiles) == 0:
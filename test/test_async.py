@@ -1,7 +1,10 @@
 import asyncio
+import gc
+import io
 import sys
 
-from memory_profiler import profile
+from memory_profiler import profile, async_memory_usage, LineProfiler, TaskProfiler
+from memory_profiler import _is_resumed
 
 
 @profile
@@ -19,9 +22,185 @@ async def main_legacy():
     future = asyncio.ensure_future(my_func())
     res = await asyncio.gather(future)
 
+
+async def waiter():
+    await asyncio.sleep(0.2)
+    return 1
+
+
+async def allocator():
+    await asyncio.sleep(0.05)
+    data = [3] * (2 * 10 ** 7)
+    await asyncio.sleep(0.3)
+    return len(data)
+
+
+def test_suspension_attribution():
+    # memory allocated by another task while waiter is suspended must not
+    # be credited to the line it is awaiting on
+    for engine in ('settrace', None):
+        prof = LineProfiler(engine=engine)
+
+        async def run():
+            return await asyncio.gather(prof(waiter)(), allocator())
+
+        asyncio.run(run())
+        code = waiter.__code__
+        inc = prof.code_map[code][code.co_firstlineno + 1][0]
+        assert inc < 50, (engine, inc)
+
+
+def test_resumed_frames():
+    resumed = []
+
+    def trace(frame, event, arg):
+        if event == 'call' and frame.f_code is waiter.__code__:
+            resumed.append(_is_resumed(frame))
+        return None
+
+    async def run():
+        # .. a second frame of the same code, possibly at the same address ..
+        await waiter()
+        await waiter()
+
+    sys.settrace(trace)
+    try:
+        asyncio.run(run())
+    finally:
+        sys.settrace(None)
+    assert resumed == [False, True, False, True], resumed
+
+
+def test_async_memory_usage():
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        task = asyncio.create_task(ticker())
+        try:
+            return await async_memory_usage(allocator, interval=0.01,
+                                            max_usage=True, retval=True)
+        finally:
+            task.cancel()
+
+    mem, ret = asyncio.run(run())
+    assert ret == 2 * 10 ** 7
+    assert isinstance(mem, float)
+    # the event loop kept running while memory was measured
+    assert len(ticks) > 10, len(ticks)
+
+    mem = asyncio.run(async_memory_usage((asyncio.sleep, (0.05,)),
+                                         interval=0.01))
+    assert len(mem) > 2
+
+
+leaked = []
+
+
+async def leaky():
+    for _ in range(3):
+        leaked.append(bytearray(10 ** 6))
+        await asyncio.sleep(0.01)
+
+
+async def clean():
+    for _ in range(3):
+        data = bytearray(10 ** 6)
+        await asyncio.sleep(0.01)
+
+
+def test_task_profiler():
+    async def run(by):
+        with TaskProfiler(by=by) as prof:
+            await asyncio.gather(leaky(), clean(), clean(),
+                                 asyncio.create_task(leaky(), name='named'))
+        return prof
+
+    prof = asyncio.run(run('coroutine'))
+    retained, growth, steps, tasks = prof.stats['leaky']
+    assert retained >= 6 * 10 ** 6, retained
+    assert tasks == 2 and steps == 8, (tasks, steps)
+    retained, growth, steps, tasks = prof.stats['clean']
+    assert retained < 10 ** 6 <= growth, (retained, growth)
+
+    prof = asyncio.run(run('name'))
+    assert prof.stats['named'][0] >= 3 * 10 ** 6
+    assert len(prof.stats) == 4
+    stream = io.StringIO()
+    prof.show_results(stream, top=2)
+    lines = stream.getvalue().splitlines()
+    assert lines[0].split() == ['Retained', 'Growth', 'Steps', 'Tasks', 'Task']
+    assert len(lines) == 5
+
+
+def test_task_profiler_disable():
+    # tracemalloc is only stopped once the measured tasks are done
+    import tracemalloc
+
+    async def run():
+        prof = TaskProfiler()
+        prof.enable()
+        task = asyncio.create_task(leaky())
+        await asyncio.sleep(0)
+        prof.disable()
+        assert tracemalloc.is_tracing()
+        await task
+        assert not tracemalloc.is_tracing()
+        return prof
+
+    async def cancelled():
+        # .. tasks that never run a step are done too ..
+        prof = TaskProfiler()
+        prof.enable()
+        task = asyncio.create_task(leaky())
+        task.cancel()
+        prof.disable()
+        assert tracemalloc.is_tracing()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert not tracemalloc.is_tracing()
+
+    def collected():
+        # .. and so are tasks collected while pending ..
+        loop = asyncio.new_event_loop()
+        # .. "Task was destroyed but it is pending!" is expected ..
+        loop.set_exception_handler(lambda loop, context: None)
+        try:
+            prof = TaskProfiler()
+            prof.enable(loop)
+            coro = leaky()
+            loop.create_task(coro)
+            prof.disable()
+            assert tracemalloc.is_tracing()
+        finally:
+            loop.close()
+        coro.close()
+        del loop, coro
+        gc.collect()
+        assert not tracemalloc.is_tracing()
+
+    if not tracemalloc.is_tracing():
+        prof = asyncio.run(run())
+        retained, growth, steps, tasks = prof.stats['leaky']
+        assert retained >= 3 * 10 ** 6 and steps == 4, (retained, steps)
+        asyncio.run(cancelled())
+        collected()
+
+
 if __name__ == '__main__':
     if sys.version_info >= (3, 7):
         asyncio.run(main())  # main loop
     else:
         loop = asyncio.get_event_loop()
         loop.run_until_complete(main_legacy())
+    test_suspension_attribution()
+    test_resumed_frames()
+    test_async_memory_usage()
+    test_task_profiler()
+    test_task_profiler_disable()
@@ -0,0 +1,61 @@
+import unittest
+
+from memory_profiler import LineProfiler, has_monitoring
+
+
+def loop_and_gen():
+    total = 0
+    for i in range(12):
+        total += i
+    total += sum(x for x in range(3))
+    return total
+
+
+def gen():
+    yield 1
+    for i in range(3):
+        yield i
+
+
+def raises():
+    a = 1
+    raise KeyError(a)
+
+
+def _occurrences(engine):
+    profiler = LineProfiler(engine=engine)
+    profiler.add_function(gen)
+    profiler(loop_and_gen)()
+    with profiler:
+        list(gen())
+    try:
+        profiler(raises)()
+    except KeyError:
+        pass
+    return [(code.co_name, sorted((line, mem[2]) for line, mem in lines.items()))
+            for code, lines in dict.items(profiler.code_map)]
+
+
+class TestEngine(unittest.TestCase):
+    """sys.monitoring and settrace report the same line events"""
+
+    @unittest.skipUnless(has_monitoring, "sys.monitoring requires Python 3.12+")
+    def test_same_occurrences(self):
+        self.assertEqual(_occurrences('settrace'), _occurrences('monitoring'))
+
+    @unittest.skipUnless(has_monitoring, "sys.monitoring requires Python 3.12+")
+    def test_tool_released(self):
+        import sys
+        profiler = LineProfiler(engine='monitoring')
+        profiler(loop_and_gen)()
+        self.assertEqual(len(profiler.prevlines), 0)
+        self.assertIsNone(sys.monitoring.get_tool(sys.monitoring.PROFILER_ID))
+
+    def test_settrace(self):
+        profiler = LineProfiler(engine='settrace')
+        self.assertEqual(profiler(loop_and_gen)(), 69)
+        self.assertTrue(_occurrences('settrace')[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
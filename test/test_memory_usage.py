@@ -1,5 +1,13 @@
-from memory_profiler import memory_usage
+from memory_profiler import (memory_usage, has_procfs, _get_sampler, MemoryRing,
+                             monitor_processes, _Ticker, BackgroundProfileWriter,
+                             TextProfileWriter, _writer_capacity,
+                             _CHILD_TREE_SAMPLES, _StatmReader)
+import io
+import threading
 import os
+import subprocess
+import sys
+import time
 
 
 def some_func(*args, **kwargs):
@@ -40,7 +48,281 @@ def test_return_value_consistency():
     assert type(func_mem_max) == float, "Max memory usage of callable should be a number"
 
 
+def test_procfs_backend():
+    # The procfs backend measures RSS, same as psutil.
+    if not has_procfs:
+        return
+    procfs_mem = memory_usage(timeout=.5, interval=.1, backend='procfs')
+    psutil_mem = memory_usage(timeout=.5, interval=.1, backend='psutil')
+    assert len(procfs_mem) > 0
+    assert abs(max(procfs_mem) - max(psutil_mem)) < 5, (procfs_mem, psutil_mem)
+    func_mem = memory_usage((some_func, (42,), dict(a=42)), backend='procfs',
+                            max_usage=True)
+    assert type(func_mem) == float, "Max memory usage of callable should be a number"
+
+
+def test_sampler_cache():
+    # Samplers are resolved once per (pid, backend, include_children).
+    sampler = _get_sampler(-1, 'psutil')
+    assert _get_sampler(-1, 'psutil') is sampler
+    assert _get_sampler(-1, 'psutil', include_children=True) is not sampler
+    mem, ts = sampler(timestamps=True)
+    assert mem > 0 and ts > 0
+    # pid -1 is bound to the current process when sampling
+    assert sampler.pid == os.getpid()
+    assert sampler.sampler is _get_sampler(os.getpid(), 'psutil')
+
+
+def test_sampler_fork():
+    # After a fork, a sampler of the current process measures the child.
+    if not hasattr(os, 'fork'):
+        return
+    sampler = _get_sampler(-1, 'psutil')
+    sampler()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            # resident memory of the child only
+            data = bytearray(200 * 2 ** 20)
+            ok = sampler.pid == os.getpid() and sampler() >= 200
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert sampler.pid == os.getpid()
+
+
+def test_thread_monitor():
+    # Sampling from a thread gives the same kind of results as a process.
+    mem, ret = memory_usage((some_func, (1, 2), dict(a=1)), retval=True,
+                            monitor='thread')
+    assert ret == ((1, 2), dict(a=1))
+    assert type(mem) == list and len(mem) >= 2
+    mem_max = memory_usage((some_func, (42,), dict(a=42)), max_usage=True,
+                           monitor='thread')
+    assert type(mem_max) == float, "Max memory usage of callable should be a number"
+
+
+def test_ring_size():
+    # Only the last samples are kept, the aggregates cover all of them.
+    ring = MemoryRing(3)
+    for mem in [5., 1., 7., 2., 3.]:
+        ring.append(mem)
+    assert ring.tolist() == [7., 2., 3.] and len(ring) == 3
+    assert [ring[i] for i in range(-3, 3)] == ring.tolist() * 2
+    assert ring[1:] == [2., 3.]
+    try:
+        ring[3]
+    except IndexError:
+        pass
+    else:
+        assert False, 'ring[3] should raise IndexError'
+    ring.append(None)
+    assert ring.count == 5 and ring[-1] == 3.
+    assert (ring.peak, ring.min, ring.mean) == (7., 1., 3.6)
+    assert abs(ring.slope + 0.3) < 1e-12
+    ring = MemoryRing(2, timestamps=True)
+    for i, mem in enumerate([1., 2., 4.]):
+        ring.append((mem, 100. + i))
+    ring.append((None, 103.))
+    assert list(ring) == [(2., 101.), (4., 102.)]
+    assert ring[0] == (2., 101.)
+    assert abs(ring.slope - 1.5) < 1e-12
+
+    mem = memory_usage(timeout=.5, interval=.05, ring_size=4)
+    assert len(mem) == 4 and mem.count > 4
+    mem = memory_usage((some_func, (42,), dict(a=42)), ring_size=1,
+                       monitor='thread')
+    assert len(mem) == 1 and mem.count >= 2
+
+
+def test_child_tree():
+    # Children are listed once per refresh period, and the memory summed
+    # by a sample is kept per child.
+    code = ("import subprocess, sys, time; "
+            "children = [subprocess.Popen([sys.executable, '-c', "
+            "'import time; time.sleep(3)']) for i in range(2)]; "
+            "time.sleep(3)")
+    proc = subprocess.Popen([sys.executable, '-c', code])
+    try:
+        time.sleep(1)
+        sampler = _get_sampler(proc.pid, 'psutil', include_children=True)
+        total = sampler()
+        listed_at = sampler._child_tree.listed_at
+        assert len(sampler.last_children) == 2
+        assert total > sum(mem for _, mem in sampler.last_children) > 0
+        sampler()
+        assert sampler._child_tree.listed_at == listed_at
+        assert [pid for pid, _ in sampler.children()] == \
+            [pid for pid, _ in sampler.last_children]
+        # .. in a sampling loop, every few samples ..
+        sampler.set_interval(.01)
+        assert sampler.children_refresh == _CHILD_TREE_SAMPLES * .01
+        time.sleep(_CHILD_TREE_SAMPLES * .01)
+        sampler()
+        assert sampler._child_tree.listed_at > listed_at
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_monitor_processes():
+    # Several processes are sampled from one loop, with shared timestamps.
+    code = "import time; time.sleep(2)  # test_monitor_processes"
+    procs = [subprocess.Popen([sys.executable, '-c', code]) for i in range(2)]
+    try:
+        mem = monitor_processes([procs[0].pid], match='test_monitor_processes',
+                                interval=.05, timeout=.5)
+        assert set(proc.pid for proc in procs) <= set(mem)
+        first, second = [mem[proc.pid] for proc in procs]
+        assert len(first) > 1 and first[-1][1] == second[-1][1]
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+
+def test_procfs_child_fds():
+    # The statm descriptors of the children are closed once they exit.
+    if not has_procfs:
+        return
+    code = ("import subprocess, sys, time; "
+            "child = subprocess.Popen([sys.executable, '-c', "
+            "'import time; time.sleep(1)']); "
+            "child.wait(); time.sleep(3)")
+    proc = subprocess.Popen([sys.executable, '-c', code])
+    try:
+        sampler = _get_sampler(proc.pid, 'procfs', include_children=True)
+        sampler.set_interval(.01)
+        deadline = time.monotonic() + 3
+        while not sampler.children() and time.monotonic() < deadline:
+            time.sleep(.1)
+        [reader] = sampler._child_tree.handles.values()
+        fd = reader.fd
+        assert fd is not None and os.fstat(fd)
+        while sampler.children() and time.monotonic() < deadline:
+            time.sleep(.1)
+        assert sampler._child_tree.handles == {}
+        assert reader.fd is None
+        del sampler, reader
+        # .. and that of an evicted sampler when it is collected ..
+        reader = _StatmReader(proc.pid)
+        fd = reader.fd
+        del reader
+        try:
+            os.fstat(fd)
+        except OSError:
+            pass
+        else:
+            assert False, 'the descriptor is still open'
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_ticker():
+    # Ticks stay on a fixed schedule, slow samples skip ticks.
+    now = [100.]
+    clock = lambda: now[0]
+
+    def run(ticker, sample_time, late=0.):
+        now[0] += ticker.delay() + late
+        ticker.begin()
+        now[0] += sample_time
+        return ticker.advance()
+
+    ticker = _Ticker(.02, clock=clock)
+    start = ticker.deadline
+    for i in range(5):
+        n_ticks = run(ticker, .05 if i == 2 else .001)
+        assert n_ticks == (3 if i == 2 else 1), (i, n_ticks)
+    assert ticker.missed == 2
+    assert abs(ticker.deadline - start - 7 * .02) < 1e-9
+    assert abs(ticker.latency_max - .05) < 1e-9
+    # .. over the budget, fewer ticks are sampled ..
+    ticker = _Ticker(.01, cpu_budget=.1, clock=clock)
+    for i in range(10):
+        run(ticker, .005)
+    assert ticker.stride > 1
+    # .. but waking up late is not a sampling cost ..
+    ticker = _Ticker(.01, cpu_budget=.1, clock=clock)
+    for i in range(10):
+        run(ticker, .0001, late=.005)
+    assert ticker.stride == 1 and ticker.missed == 0
+    assert ticker.latency_max < .001
+
+
+def test_background_writer():
+    # Samples are written in order by the writer thread, and dropped
+    # rather than blocking the sampler when the writer is stuck.
+    out = io.StringIO()
+    writer = BackgroundProfileWriter(TextProfileWriter(out), capacity=1000)
+    writer.write_header('cmd')
+    for i in range(100):
+        writer.write_mem(10. + i, 1000. + i)
+        writer.write_child(42, 1., 1000. + i)
+    writer.close()
+    lines = out.getvalue().splitlines()
+    assert lines[0] == 'CMDLINE cmd' and len(lines) == 201
+    assert lines[1] == 'MEM 10.000000 1000.0000'
+    assert lines[2] == 'CHLD 42 1.000000 1000.0000'
+    assert writer.written == 200 and writer.dropped == 0
+
+    class StuckWriter(TextProfileWriter):
+        def flush(self):
+            release.wait()
+            TextProfileWriter.flush(self)
+
+    release = threading.Event()
+    out = io.StringIO()
+    writer = BackgroundProfileWriter(StuckWriter(out), capacity=10)
+    for i in range(30):
+        writer.write_mem(1., time.time())
+        time.sleep(.001)
+    release.set()
+    writer.close()
+    assert writer.dropped > 0
+    assert out.getvalue().count('MEM') == writer.written == 30 - writer.dropped
+
+    # .. buffers grow when more rows are written per sample ..
+    out = io.StringIO()
+    writer = BackgroundProfileWriter(StuckWriter(out), capacity=10)
+    writer.reserve(5)
+    assert writer.capacity == 10
+    for i in range(5):
+        writer.write_mem(1., time.time())
+    writer.reserve(30)
+    for i in range(25):
+        writer.write_child(7, 1., time.time())
+    writer.close()
+    assert writer.capacity == 30 and writer.dropped == 0
+    assert out.getvalue().count('\n') == writer.written == 30
+
+    # Buffers are sized from the interval, and Python functions, whose
+    # samples are not streamed, get no writer thread.
+    assert _writer_capacity(.01) == 401
+    assert _writer_capacity(.01, rows_per_sample=3) == 1203
+    assert _writer_capacity(1.) == 256
+
+    threads = []
+    memory_usage((lambda: threads.extend(threading.enumerate()), (), {}),
+                 stream=io.StringIO(), monitor='thread')
+    assert threads
+    assert 'memory_profiler writer' not in [t.name for t in threads]
+
+
 if __name__ == "__main__":
     test_memory_usage()
     test_max_iterations()
     test_return_value_consistency()
+    test_procfs_backend()
+    test_sampler_cache()
+    test_sampler_fork()
+    test_thread_monitor()
+    test_ring_size()
+    test_child_tree()
+    test_monitor_processes()
+    test_procfs_child_fds()
+    test_ticker()
+    test_background_writer()
@@ -1,5 +1,11 @@
+import contextlib
+import io
+import os
+import tempfile
 import unittest
+from unittest import mock
 
+import memory_profiler as mp
 import mprof
 
 class Test_function_labels(unittest.TestCase):
@@ -16,5 +22,390 @@ class Test_function_labels(unittest.TestCase):
         result = mprof.function_labels(expected.keys())
         self.assertEqual(expected,result)
 
+
+def write_profile(writer):
+    writer.write_header("python script.py", "psutil")
+    for i in range(120):
+        writer.write_mem(10. + i, 1000. + i)
+        writer.write_child(1234, 1. + i, 1000. + i)
+        if i % 50 == 0:
+            writer.flush()
+    writer.write_func("__main__.f", 11., 1001., 15., 1005., 0)
+    writer.write_func("__main__.f", 16., 1006., 17., 1007., 1)
+    writer.flush()
+
+
+class Test_downsample(unittest.TestCase):
+    def test_keeps_extremes(self):
+        import numpy as np
+        t = np.arange(100000.)
+        mem = np.sin(t / 1000.)
+        mem[12345] = 5.
+        mem[54321] = -5.
+        dt, dmem = mprof.downsample(t, mem, 500)
+        self.assertLessEqual(len(dmem), 500)
+        self.assertEqual(dmem.max(), 5.)
+        self.assertEqual(dmem.min(), -5.)
+        self.assertEqual((dt[0], dt[-1]), (0., 99999.))
+        self.assertTrue((np.diff(dt) > 0).all())
+        np.testing.assert_array_equal(mem[dt.astype(int)], dmem)
+
+    def test_short_series(self):
+        t = [0., 1., 2.]
+        self.assertEqual(mprof.downsample(t, t, 500), (t, t))
+
+
+class Test_function_index(unittest.TestCase):
+    def test_matches_scan(self):
+        prof = {
+            "timestamp": [float(i) for i in range(100)],
+            "mem_usage": [float((i * 7) % 31) for i in range(100)],
+            "func_timestamp": {
+                # nested and overlapping calls
+                "f": [[10., 20., 0., 0., 0], [12., 15., 0., 0., 1],
+                      [18.5, 30., 0., 0., 0], [50.5, 50.7, 0., 0., 0]],
+                "g": [[60., 60., 0., 0., 0], [5.5, 8.5, 0., 0., 0]],
+            },
+        }
+        index = mprof.function_index(prof)
+        for func, calls in prof["func_timestamp"].items():
+            expected = [m for m, t in zip(prof["mem_usage"], prof["timestamp"])
+                        if any(c[0] <= t <= c[1] for c in calls)]
+            self.assertEqual(mprof.filter_mprofile_mem_usage_by_function(prof, func),
+                             expected)
+            stats = mprof.function_stats(index, func)
+            self.assertEqual(stats["peak"], max(expected))
+            self.assertAlmostEqual(stats["mean"], sum(expected) / len(expected))
+            self.assertEqual(stats["samples"], len(expected))
+            self.assertEqual(stats["calls"], len(calls))
+
+        self.assertAlmostEqual(mprof.function_stats(index, "f")["time"], 20.2)
+        self.assertEqual(mprof.function_stats(index, "g")["time"], 3.)
+        self.assertRaises(ValueError, mprof.function_samples, index, "h")
+        self.assertEqual(list(mprof.function_index(prof, ["g"])["functions"]),
+                         ["g"])
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Test case with a temporary directory, removed after each test."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+
+
+class Test_follow(TempDirTestCase):
+    def check_tail(self, writer_class, stream):
+        write_profile(writer_class(stream))
+        content = stream.getvalue()
+        if not isinstance(content, bytes):
+            content = content.encode()
+        self.check_content(content)
+
+    def check_content(self, content):
+        filename = os.path.join(self.tmpdir, "profile.dat")
+        open(filename, "wb").close()
+
+        tail = mprof.ProfileTail(filename)
+        timestamps = []
+        children = []
+        try:
+            self.assertIsNone(tail.read())
+            # append the profile in pieces that cut records in two
+            with open(filename, "ab") as f:
+                for start in range(0, len(content), 333):
+                    f.write(content[start:start + 333])
+                    f.flush()
+                    prof = tail.read()
+                    if prof is not None:
+                        timestamps.extend(prof["timestamp"].tolist())
+                        if "1234" in prof["children"]:
+                            children.extend(prof["children"]["1234"].tolist())
+        finally:
+            tail.close()
+        self.assertEqual(timestamps, [1000. + i for i in range(120)])
+        self.assertEqual(children, [[1. + i, 1000. + i] for i in range(120)])
+
+    def test_text(self):
+        self.check_tail(mp.TextProfileWriter, io.StringIO())
+
+    def test_binary(self):
+        self.check_tail(mp.BinaryProfileWriter, io.BytesIO())
+
+    def test_compact(self):
+        self.check_tail(mp.CompactProfileWriter, io.BytesIO())
+
+    def test_compressed(self):
+        filename = os.path.join(self.tmpdir, "written.dat.gz")
+        with mp.open_profile_output(filename) as f:
+            write_profile(mp.TextProfileWriter(f))
+        with open(filename, "rb") as f:
+            content = f.read()
+        os.remove(filename)
+        self.check_content(content)
+
+    def test_min_max_series(self):
+        import numpy as np
+        t = np.arange(10000.)
+        mem = np.sin(t / 100.)
+        mem[4321] = 5.
+        series = mprof.MinMaxSeries(100)
+        for start in range(0, len(t), 37):
+            series.extend(t[start:start + 37], mem[start:start + 37])
+        dt, dmem = series.data()
+        self.assertLessEqual(len(dmem), 100 + series.size)
+        self.assertEqual(series.peak, (4321., 5.))
+        self.assertEqual(dmem.max(), 5.)
+        self.assertEqual(dmem.min(), mem.min())
+        self.assertTrue((np.diff(dt) >= 0).all())
+        np.testing.assert_array_equal(mem[dt.astype(int)], dmem)
+
+
+class Test_binary_format(TempDirTestCase):
+    def test_same_content(self):
+        text_file = os.path.join(self.tmpdir, "text.dat")
+        binary_file = os.path.join(self.tmpdir, "binary.dat")
+        with open(text_file, "w") as f:
+            write_profile(mp.TextProfileWriter(f))
+        with open(binary_file, "wb") as f:
+            write_profile(mp.BinaryProfileWriter(f))
+
+        self.assertFalse(mprof.is_binary_mprofile(text_file))
+        self.assertTrue(mprof.is_binary_mprofile(binary_file))
+        self.assertLess(os.path.getsize(binary_file), os.path.getsize(text_file))
+
+        text = mprof.read_mprofile_file(text_file)
+        binary = mprof.read_mprofile_file(binary_file)
+        self.assertEqual(binary["backend"], "psutil")
+        self.assertEqual(binary["cmd_line"], text["cmd_line"].strip())
+        self.assertEqual(binary["mem_usage"], text["mem_usage"])
+        self.assertEqual(binary["timestamp"], text["timestamp"])
+        self.assertEqual(dict(binary["children"]), dict(text["children"]))
+        self.assertEqual(binary["func_timestamp"], text["func_timestamp"])
+
+    def test_compact(self):
+        binary_file = os.path.join(self.tmpdir, "binary.dat")
+        compact_file = os.path.join(self.tmpdir, "compact.dat")
+        with open(binary_file, "wb") as f:
+            write_profile(mp.BinaryProfileWriter(f))
+        with open(compact_file, "wb") as f:
+            write_profile(mp.CompactProfileWriter(f))
+        self.assertTrue(mprof.is_binary_mprofile(compact_file))
+        self.assertEqual(mprof.read_mprofile_binary_file(compact_file)["mem_usage"],
+                         mprof.read_mprofile_binary_file(binary_file)["mem_usage"])
+        compact = mprof.read_mprofile_file(compact_file)
+        binary = mprof.read_mprofile_file(binary_file)
+        self.assertEqual(compact.pop("filename"), compact_file)
+        binary.pop("filename")
+        self.assertEqual(compact, binary)
+
+        # values are rounded to the quanta
+        with open(compact_file, "wb") as f:
+            writer = mp.CompactProfileWriter(f, time_quantum=0.01,
+                                             mem_quantum=0.5)
+            writer.write_mem(10.3, 1000.004)
+            writer.write_mem(-2., 999.)
+            writer.write_child(12, 3.8, 1000.006)
+            writer.write_func("f", 1.1, 1000., 2.2, 1000.5, 2)
+            writer.flush()
+        prof = mprof.read_mprofile_file(compact_file)
+        self.assertEqual(prof["mem_usage"], [10.5, -2.])
+        self.assertEqual(prof["timestamp"], [1000.004, 999.004])
+        self.assertEqual(prof["children"]["12"], [(4., 1000.006)])
+        self.assertEqual(prof["func_timestamp"],
+                         {"f": [[1000., 1000.5, 1., 2., 2]]})
+
+    def test_compact_arrays(self):
+        import numpy as np
+        filename = os.path.join(self.tmpdir, "compact.dat")
+        with open(filename, "wb") as f:
+            writer = mp.CompactProfileWriter(f)
+            write_profile(writer)
+            writer.write_mem(1e6, 2e9)
+            writer.write_child(3, -1e6, 1.)
+            writer.flush()
+        with open(filename, "rb") as f:
+            f.seek(len(mp.BINARY_MAGIC))
+            chunks = list(mprof._iter_binary_chunks(f))
+            f.seek(len(mp.BINARY_MAGIC))
+            self.assertEqual(list(mprof._iter_binary_chunks(f, np=np)), chunks)
+
+        with self.assertRaises(ValueError):
+            mp.CompactProfileWriter(io.BytesIO(), time_quantum=0)
+        argv = ["mprof", "--format", "compact", "--mem-quantum", "0", "true"]
+        with mock.patch("sys.argv", argv), \
+                contextlib.redirect_stderr(io.StringIO()) as err, \
+                self.assertRaises(SystemExit):
+            mprof.run_action()
+        self.assertIn("0.0 is not a positive number", err.getvalue())
+
+    def test_compact_size(self):
+        import numpy as np
+        rng = np.random.RandomState(0)
+        t = 1.7e9 + 0.01 * np.arange(10000) + rng.uniform(0, 1e-3, 10000)
+        mem = 100. + np.cumsum(rng.randint(-2, 3, 10000) * 4. / 1024)
+        sizes = {}
+        for name, writer_class in (("text", mp.TextProfileWriter),
+                                   ("compact", mp.CompactProfileWriter)):
+            filename = os.path.join(self.tmpdir, name + ".dat")
+            with mp.open_profile_output(filename, name != "text") as f:
+                writer = writer_class(f)
+                for i in range(len(t)):
+                    writer.write_mem(mem[i], t[i])
+                    if i % 100 == 99:
+                        writer.flush()
+            sizes[name] = os.path.getsize(filename)
+        self.assertLess(10 * sizes["compact"], sizes["text"])
+        prof = mprof.read_mprofile_arrays(filename)
+        self.assertLess(abs(prof["timestamp"] - t).max(), 1e-4)
+        np.testing.assert_array_equal(prof["mem_usage"], mem)
+
+class Test_compressed(TempDirTestCase):
+    def check_compressed(self, writer_class, binary):
+        plain_file = os.path.join(self.tmpdir, "plain.dat")
+        filename = os.path.join(self.tmpdir, "profile.dat.gz")
+        with mp.open_profile_output(plain_file, binary) as f:
+            write_profile(writer_class(f))
+        with mp.open_profile_output(filename, binary) as f:
+            self.assertIsInstance(f, mp.CompressedProfileFile)
+            self.assertEqual(f.tell(), 0)
+            write_profile(writer_class(f))
+            self.assertEqual(f.tell(), 1)
+
+        self.assertLess(os.path.getsize(filename), os.path.getsize(plain_file))
+        self.assertEqual(mprof.is_binary_mprofile(filename), binary)
+        expected = mprof.read_mprofile_file(plain_file)
+        prof = mprof.read_mprofile_file(filename)
+        self.assertEqual(prof.pop("filename"), filename)
+        expected.pop("filename")
+        self.assertEqual(prof, expected)
+
+        # one member per flush, so that a truncated last one is ignored
+        with open(filename, "rb") as f:
+            content = f.read()
+        with mprof.open_profile(plain_file) as f:
+            plain = f.read()
+        with mprof.open_profile(filename) as f:
+            members = f.raw.members
+            self.assertEqual(f.read(), plain)
+        # the header of the binary format is written on its own
+        self.assertEqual(len(members), 6 if binary else 5)
+        self.assertEqual(members[-1][0], len(content))
+        with open(filename, "wb") as f:
+            f.write(content[:-10])
+        with mprof.open_profile(filename) as f:
+            self.assertEqual(f.read(), plain[:members[-2][1]])
+
+    def test_text(self):
+        self.check_compressed(mp.TextProfileWriter, False)
+
+    def test_binary(self):
+        self.check_compressed(mp.BinaryProfileWriter, True)
+
+    def test_existing_profiles(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            for name in ("mprofile_20200101000000.dat.gz",
+                         "mprofile_20200101000001.dat", "other.dat.gz"):
+                open(name, "wb").close()
+            self.assertEqual(mprof._existing_profiles(),
+                             ["mprofile_20200101000000.dat.gz",
+                              "mprofile_20200101000001.dat"])
+        finally:
+            os.chdir(cwd)
+
+
+class Test_read_mprofile_arrays(TempDirTestCase):
+    def test_matches_line_loader(self):
+        text_file = os.path.join(self.tmpdir, "text.dat")
+        binary_file = os.path.join(self.tmpdir, "binary.dat")
+        with open(text_file, "w") as f:
+            write_profile(mp.TextProfileWriter(f))
+        with open(binary_file, "wb") as f:
+            write_profile(mp.BinaryProfileWriter(f))
+
+        expected = mprof._read_mprofile_text_file(text_file)
+        for filename in (text_file, binary_file):
+            arrays = mprof.read_mprofile_arrays(filename)
+            self.assertEqual(arrays["mem_usage"].tolist(), expected["mem_usage"])
+            self.assertEqual(arrays["timestamp"].tolist(), expected["timestamp"])
+            self.assertEqual(arrays["func_timestamp"], expected["func_timestamp"])
+            self.assertEqual(list(arrays["children"]), ["1234"])
+            self.assertEqual(arrays["children"]["1234"].shape, (120, 2))
+            self.assertEqual([tuple(row) for row in arrays["children"]["1234"]],
+                             expected["children"]["1234"])
+
+        prof = mprof.read_mprofile_file(text_file)
+        self.assertEqual(prof.pop("start"), 1000.)
+        self.assertEqual(prof, expected)
+
+    def test_too_short(self):
+        filename = os.path.join(self.tmpdir, "short.dat")
+        with open(filename, "w") as f:
+            f.write("CMDLINE python script.py\n\n")
+        self.assertRaises(ValueError, mprof.read_mprofile_arrays, filename)
+
+
+class Test_window(TempDirTestCase):
+    def setUp(self):
+        super(Test_window, self).setUp()
+        self.addCleanup(setattr, mprof, '_INDEX_STRIDE', mprof._INDEX_STRIDE)
+        # several index entries even for a small profile
+        mprof._INDEX_STRIDE = 256
+
+    def check_window(self, filename):
+        full = mprof.read_mprofile_file(filename)
+        prof = mprof.read_mprofile_file(filename, window=(30, 60.5))
+        self.assertTrue(os.path.exists(filename + ".idx"))
+        self.assertEqual(prof["start"], 1000.)
+        self.assertEqual(prof["timestamp"], [1000. + i for i in range(30, 61)])
+        self.assertEqual(prof["mem_usage"], [10. + i for i in range(30, 61)])
+        self.assertEqual(prof["children"]["1234"],
+                         [(1. + i, 1000. + i) for i in range(30, 61)])
+        self.assertEqual(prof["cmd_line"], full["cmd_line"])
+        self.assertEqual(prof["func_timestamp"], {})
+
+        # cached index, function overlapping the window
+        prof = mprof.read_mprofile_file(filename, window=(0, 3))
+        self.assertEqual(len(prof["timestamp"]), 4)
+        self.assertEqual(prof["func_timestamp"],
+                         {"__main__.f": [full["func_timestamp"]["__main__.f"][0]]})
+
+        # the index is rebuilt when the profile changes
+        with open(filename, "ab") as f:
+            f.write(b"")
+        os.utime(filename, ns=(0, 0))
+        prof = mprof.read_mprofile_file(filename, window=(100, 1000))
+        self.assertEqual(len(prof["timestamp"]), 20)
+
+    def test_text(self):
+        filename = os.path.join(self.tmpdir, "text.dat")
+        with open(filename, "w") as f:
+            write_profile(mp.TextProfileWriter(f))
+        self.check_window(filename)
+
+    def test_binary(self):
+        filename = os.path.join(self.tmpdir, "binary.dat")
+        with open(filename, "wb") as f:
+            write_profile(mp.BinaryProfileWriter(f))
+        self.check_window(filename)
+
+    def test_compact(self):
+        filename = os.path.join(self.tmpdir, "compact.dat")
+        with open(filename, "wb") as f:
+            write_profile(mp.CompactProfileWriter(f))
+        self.check_window(filename)
+
+    def test_compressed(self):
+        filename = os.path.join(self.tmpdir, "text.dat.gz")
+        with mp.open_profile_output(filename) as f:
+            write_profile(mp.TextProfileWriter(f))
+        self.check_window(filename)
+        index = mprof._load_profile_index(filename)
+        self.assertEqual(len(index["members"]), 5)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,56 @@
+import time
+import unittest
+from io import StringIO
+
+from memory_profiler import LineProfiler, show_results
+
+
+def allocate():
+    a = []
+    for i in range(5):
+        a.append([1] * (10 ** 6))
+        time.sleep(0.05)
+    time.sleep(0.1)
+    return a
+
+
+class TestSampling(unittest.TestCase):
+    """Tests the sampling line attribution mode"""
+
+    def test_sampling(self):
+        profiler = LineProfiler(mode='sampling', interval=0.005)
+        profiler(allocate)()
+        lines = list(profiler.code_map.values())[0]
+        sleep_line = allocate.__code__.co_firstlineno + 4
+        # most of the time is spent sleeping
+        self.assertGreater(lines[sleep_line][2], 10)
+        # memory grows by about 40 MiB during the loop
+        total_inc = sum(inc for inc, _, _ in lines.values())
+        self.assertGreater(total_inc, 20)
+
+        output = StringIO()
+        show_results(profiler, stream=output)
+        self.assertIn('Samples', output.getvalue())
+
+    def test_shorter_than_interval(self):
+        # the baseline and the last sample bound a function that returns
+        # before the first tick
+        profiler = LineProfiler(mode='sampling', interval=10)
+
+        def short():
+            return bytearray(50 * 2 ** 20)
+
+        start = time.time()
+        a = profiler(short)()
+        self.assertLess(time.time() - start, 5)
+        lines = list(profiler.code_map.values())[0]
+        self.assertEqual(sum(occ for _, _, occ in lines.values()), 1)
+        self.assertGreater(sum(inc for inc, _, _ in lines.values()), 40)
+        del a
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, LineProfiler, mode='unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
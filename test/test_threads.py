@@ -0,0 +1,133 @@
+import io
+import sys
+import threading
+import unittest
+
+from memory_profiler import LineProfiler, has_monitoring, show_results
+from memory_profiler import CodeMap, _LineMeasures
+
+N_THREADS = 4
+
+
+def work(barrier):
+    barrier.wait()
+    total = 0
+    for i in range(200):
+        total += i
+    return total
+
+
+def _profile_threads(engine):
+    profiler = LineProfiler(engine=engine)
+    profiled = profiler(work)
+    barrier = threading.Barrier(N_THREADS)
+    threads = [threading.Thread(target=profiled, args=(barrier,),
+                                name='worker-%d' % i)
+               for i in range(N_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return profiler
+
+
+class TestThreads(unittest.TestCase):
+    """Each thread is traced and the measures are merged"""
+
+    def check(self, engine):
+        profiler = _profile_threads(engine)
+        self.assertEqual(len(profiler.code_map.threads), N_THREADS)
+        [(filename, lines)] = profiler.code_map.items()
+        occurrences = dict((line, mem[2]) for line, mem in lines if mem)
+        loop_line = work.__code__.co_firstlineno + 4
+        self.assertEqual(occurrences[loop_line], 200 * N_THREADS)
+        for thread in profiler.code_map.threads:
+            [(filename, lines)] = profiler.code_map.items(thread)
+            per_thread = dict((line, mem[2]) for line, mem in lines if mem)
+            self.assertEqual(per_thread[loop_line], 200)
+
+        out = io.StringIO()
+        show_results(profiler, stream=out, threads=True)
+        for i in range(N_THREADS):
+            self.assertIn('Thread: worker-%d' % i, out.getvalue())
+        self.assertEqual(out.getvalue().count('Filename: '), N_THREADS + 1)
+
+    def test_settrace(self):
+        self.check('settrace')
+        self.assertIsNone(threading.gettrace())
+        self.assertIsNone(sys.gettrace())
+
+    def test_disable_from_other_thread(self):
+        """A thread still traced when profiling is disabled from another
+        one gets its previous trace function back"""
+        profiler = LineProfiler(engine='settrace')
+        enabled = threading.Event()
+        disabled = threading.Event()
+        traces = []
+
+        def previous(frame, event, arg):
+            return None
+
+        def target():
+            sys.settrace(previous)
+            profiler.enable_by_count()
+            traces.append(sys.gettrace())
+            enabled.set()
+            disabled.wait()
+            work(threading.Barrier(1))
+            traces.append(sys.gettrace())
+            sys.settrace(None)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        enabled.wait()
+        profiler.disable_by_count()
+        disabled.set()
+        thread.join()
+        self.assertEqual(traces, [profiler.trace_memory_usage, previous])
+        self.assertIsNone(threading.gettrace())
+
+    @unittest.skipUnless(has_monitoring, "sys.monitoring requires Python 3.12+")
+    def test_monitoring(self):
+        self.check('monitoring')
+
+
+class TestLineMeasures(unittest.TestCase):
+    """Per-thread line measures and their merge"""
+
+    def test_add(self):
+        measures = _LineMeasures(10, 3)
+        measures.add(10, 1.5, 100.)
+        measures.add(10, -0.5, 99.)
+        measures.add(12, 2., 102.)
+        # .. lines outside of the code object are ignored ..
+        measures.add(9, 5., 200.)
+        measures.add(13, 5., 200.)
+        self.assertEqual(list(measures.items()),
+                         [(10, (1., 100., 2)), (12, (2., 102., 1))])
+        self.assertEqual(measures.memory(10), 100.)
+        self.assertEqual(measures.memory(11), 0)
+        self.assertEqual(measures.memory(13), 0)
+        self.assertEqual(measures.memory(None), 0)
+
+    def test_merge(self):
+        code_map = CodeMap(include_children=False, backend='psutil')
+        code = work.__code__
+        code_map.add(code)
+        first = code.co_firstlineno
+        code_map.sample(code, first + 1, 100., 99., thread=1)
+        code_map.sample(code, first + 1, 104., 100., thread=2)
+        code_map.sample(code, first + 2, 103., 104., thread=2)
+        code_map.merge()
+        self.assertEqual(code_map[code], {first + 1: (5., 104., 2),
+                                          first + 2: (-1., 103., 1)})
+        [(filename, lines)] = code_map.items(1)
+        self.assertEqual([(line, mem) for line, mem in lines if mem],
+                         [(first + 1, (1., 100., 1))])
+        # .. merging again does not count the measures twice ..
+        code_map.merge()
+        self.assertEqual(code_map[code][first + 1], (5., 104., 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
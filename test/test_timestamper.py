@@ -0,0 +1,120 @@
+import io
+import time
+import unittest
+
+from memory_profiler import TimeStamper
+
+
+def _records(stamper):
+    out = io.StringIO()
+    stamper.show_results(out)
+    return [line.split() for line in out.getvalue().splitlines()]
+
+
+class TestTimeStamper(unittest.TestCase):
+
+    def test_levels(self):
+        stamper = TimeStamper('psutil')
+
+        @stamper
+        def f(n):
+            if n:
+                f(n - 1)
+
+        f(2)
+        with stamper.timestamp('block'):
+            f(0)
+        records = _records(stamper)
+        self.assertEqual([(r[1], r[-1]) for r in records],
+                         [('__main__.f', '0'), ('__main__.f', '1'),
+                          ('__main__.f', '2'), ('__main__.f', '1'),
+                          ('.block', '0')])
+        for record in records:
+            self.assertLessEqual(float(record[3]), float(record[5]))
+
+    def test_exception(self):
+        stamper = TimeStamper('psutil')
+
+        @stamper
+        def fails():
+            raise ValueError
+
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                fails()
+        self.assertEqual([r[-1] for r in _records(stamper)], ['0', '0'])
+
+    def test_failed_sample(self):
+        stamper = TimeStamper('psutil')
+        sampler = stamper.sampler
+        failures = [RuntimeError]
+
+        def flaky(**kwargs):
+            if failures:
+                raise failures.pop()
+            return sampler(**kwargs)
+
+        stamper.sampler = flaky
+
+        @stamper
+        def f():
+            pass
+
+        with self.assertRaises(RuntimeError):
+            f()
+        f()
+        self.assertEqual(stamper.current_stack_level, -1)
+        self.assertEqual([r[-1] for r in _records(stamper)], ['0'])
+
+    def test_unfinished_call(self):
+        stamper = TimeStamper('psutil')
+
+        @stamper
+        def f():
+            self.assertEqual(_records(stamper), [])
+
+        f()
+        self.assertEqual(len(_records(stamper)), 1)
+
+    def test_stream(self):
+        out = io.StringIO()
+        stamper = TimeStamper('psutil', stream=out, flush_records=2,
+                              flush_interval=3600)
+
+        @stamper
+        def f():
+            pass
+
+        f()
+        self.assertEqual(out.getvalue(), '')
+        f()
+        self.assertEqual(out.getvalue().count('FUNC __main__.f '), 2)
+        f()
+        self.assertEqual(out.getvalue().count('FUNC __main__.f '), 2)
+        # .. nothing is kept once written ..
+        [calls] = stamper.functions.values()
+        self.assertEqual(calls.started, {})
+        self.assertEqual(len(calls), 3)
+        stamper.show_results()
+        self.assertEqual(out.getvalue().count('FUNC __main__.f '), 3)
+
+    def test_stream_idle(self):
+        # .. calls are flushed even if no other call returns ..
+        out = io.StringIO()
+        stamper = TimeStamper('psutil', stream=out, flush_interval=0.01)
+
+        @stamper
+        def f():
+            pass
+
+        f()
+        for i in range(500):
+            if out.getvalue():
+                break
+            time.sleep(0.01)
+        self.assertEqual(out.getvalue().count('FUNC __main__.f '), 1)
+        stamper.show_results()
+
+
+if __name__ == '__main__':
+    unittest.main()
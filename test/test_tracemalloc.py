@@ -1,7 +1,9 @@
 from io import StringIO
 from time import sleep
+import subprocess
+import sys
 
-from memory_profiler import profile
+from memory_profiler import profile, memory_usage
 
 try:
     import tracemalloc
@@ -31,6 +33,54 @@ def mem_prof(n):
     sleep(1)
 
 
+output_total = StringIO()
+
+
+@profile(stream=output_total, precision=6, backend='tracemalloc_total')
+def mem_prof_total(n):
+    a = bytearray(n)
+    del a
+
+
+def test_tracemalloc_total():
+    # per-line deltas come from tracemalloc.get_traced_memory(), so they
+    # include the profiler's own small allocations
+    mem_prof_total(10 ** 7)
+    text = output_total.getvalue().split('\n')
+    inc = float(text[-5].split()[3])
+    assert abs(inc - 9.536743) < 0.01, inc
+
+
+def test_tracemalloc_total_other_process():
+    # the traced memory of the monitoring process would be reported
+    p = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(1)'])
+    try:
+        memory_usage(p, backend='tracemalloc_total', timeout=.1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('tracemalloc_total accepted another process')
+    finally:
+        p.kill()
+        p.wait()
+
+
+def hold_memory(n):
+    a = bytearray(n)
+    sleep(.3)
+    return len(a)
+
+
+def test_tracemalloc_total_monitor():
+    # the default process monitor would read its own copy of tracemalloc
+    n = 50 * 1024 ** 2
+    base = memory_usage(-1, backend='tracemalloc_total', timeout=.1,
+                        max_usage=True)
+    peak = memory_usage((hold_memory, (n,)), interval=.01,
+                        backend='tracemalloc_total', max_usage=True)
+    assert peak - base >= 49, (base, peak)
+
+
 def parse_mem_prof():
     text = output.getvalue().split('\n')
 
@@ -52,3 +102,6 @@ if __name__ == '__main__':
         ]
         for test_input, expected in tests:
             test_memory_profiler(test_input, expected)
+        test_tracemalloc_total()
+        test_tracemalloc_total_other_process()
+        test_tracemalloc_total_monitor()